@@ -1,9 +1,19 @@
 import os
+import io
+import csv
 import json
+import time
+import hashlib
+import argparse
 import psycopg2
 from psycopg2.extras import execute_values
+from concurrent.futures import ProcessPoolExecutor
 import datetime
 
+from api.db import run_transaction
+from api.dedup import cluster_pairs
+from api.migrations import apply_migrations
+
 # Database configuration
 DB_PARAMS = {
     'host': '10.8.12.8',
@@ -45,6 +55,9 @@ def create_tables(conn):
         
         conn.commit()
 
+    # Bring the schema up to date (label/claim columns, indexes)
+    apply_migrations(conn)
+
 def extract_date_from_filename(filename):
     """Extract date from FOMC filename format like FOMCpresconf20180613.json"""
     # Extract the date string (assume format is consistent)
@@ -72,23 +85,60 @@ def process_json_files(directory_path, conn):
                 print(f"Error processing file {filename}: {e}")
                 continue
 
+def extract_statement(data, filename):
+    """Return (speaker, content) of the opening statement, or None if missing"""
+    # Check if 'statement' key exists and is not empty
+    if 'statement' not in data or not data['statement']:
+        print(f"Warning: No statement found in {filename}")
+        return None
+        
+    # Get statement speaker and content safely
+    try:
+        statement_speaker = list(data['statement'].keys())[0]
+        statement_content = data['statement'][statement_speaker]
+    except (IndexError, KeyError) as e:
+        print(f"Error extracting statement from {filename}: {e}")
+        print(f"Statement structure: {data['statement']}")
+        return None
+    
+    return statement_speaker, statement_content
+
+def extract_qna_records(data, filename):
+    """Return (questioner, question, responder, response) tuples for a file"""
+    qna_records = []
+    if 'qna' in data and data['qna']:
+        for i, qna in enumerate(data['qna']):
+            try:
+                # Check if question and response keys exist
+                if 'question' not in qna or 'response' not in qna:
+                    print(f"Warning: Missing question or response in {filename}, QnA #{i+1}")
+                    continue
+                    
+                # Try to extract data safely
+                if not qna['question'] or not qna['response']:
+                    print(f"Warning: Empty question or response in {filename}, QnA #{i+1}")
+                    continue
+                    
+                questioner = list(qna['question'].keys())[0]
+                question = qna['question'][questioner]
+                responder = list(qna['response'].keys())[0]
+                response = qna['response'][responder]
+                
+                qna_records.append((questioner, question, responder, response))
+            except (IndexError, KeyError) as e:
+                print(f"Error processing QnA #{i+1} in {filename}: {e}")
+                print(f"QnA structure: {qna}")
+                continue
+    return qna_records
+
 def insert_data(conn, data, filename, date):
     """Insert data from a JSON file into the database"""
     try:
         with conn.cursor() as cur:
-            # Check if 'statement' key exists and is not empty
-            if 'statement' not in data or not data['statement']:
-                print(f"Warning: No statement found in {filename}")
-                return
-                
-            # Get statement speaker and content safely
-            try:
-                statement_speaker = list(data['statement'].keys())[0]
-                statement_content = data['statement'][statement_speaker]
-            except (IndexError, KeyError) as e:
-                print(f"Error extracting statement from {filename}: {e}")
-                print(f"Statement structure: {data['statement']}")
+            statement = extract_statement(data, filename)
+            if statement is None:
                 return
+            statement_speaker, statement_content = statement
             
             # Check if this file has already been processed
             cur.execute("""
@@ -110,40 +160,21 @@ def insert_data(conn, data, filename, date):
             statement_id = cur.fetchone()[0]
             
             # Insert QnA pairs
-            if 'qna' in data and data['qna']:
-                qna_records = []
-                for i, qna in enumerate(data['qna']):
-                    try:
-                        # Check if question and response keys exist
-                        if 'question' not in qna or 'response' not in qna:
-                            print(f"Warning: Missing question or response in {filename}, QnA #{i+1}")
-                            continue
-                            
-                        # Try to extract data safely
-                        if not qna['question'] or not qna['response']:
-                            print(f"Warning: Empty question or response in {filename}, QnA #{i+1}")
-                            continue
-                            
-                        questioner = list(qna['question'].keys())[0]
-                        question = qna['question'][questioner]
-                        responder = list(qna['response'].keys())[0]
-                        response = qna['response'][responder]
-                        
-                        qna_records.append((
-                            statement_id, questioner, question, responder, response
-                        ))
-                    except (IndexError, KeyError) as e:
-                        print(f"Error processing QnA #{i+1} in {filename}: {e}")
-                        print(f"QnA structure: {qna}")
-                        continue
+            qna_records = [(statement_id,) + record for record in extract_qna_records(data, filename)]
+            
+            # Batch insert for better performance
+            if qna_records:
+                print(f"Inserting {len(qna_records)} QnA records for {filename}")
+                qna_ids = execute_values(cur, """
+                INSERT INTO fomc_qna (statement_id, questioner, question, responder, response)
+                VALUES %s
+                RETURNING id
+                """, qna_records, fetch=True)
                 
-                # Batch insert for better performance
-                if qna_records:
-                    print(f"Inserting {len(qna_records)} QnA records for {filename}")
-                    execute_values(cur, """
-                    INSERT INTO fomc_qna (statement_id, questioner, question, responder, response)
-                    VALUES %s
-                    """, qna_records)
+                # Near-duplicates of earlier pairs are not handed out again
+                _, duplicates = cluster_pairs(cur, [row[0] for row in qna_ids])
+                if duplicates:
+                    print(f"Found {duplicates} near-duplicate QnA pairs in {filename}")
             
             conn.commit()
             print(f"Successfully inserted {filename} with statement_id {statement_id}")
@@ -152,6 +183,297 @@ def insert_data(conn, data, filename, date):
         print(f"Error inserting data for {filename}: {e}")
         raise
 
+def parse_data(data, filename):
+    """Turn a loaded JSON document into rows for the bulk and incremental importers"""
+    statement = extract_statement(data, filename)
+    if statement is None:
+        return None
+    
+    return {
+        'filename': filename,
+        'date': extract_date_from_filename(filename),
+        'speaker': statement[0],
+        'content': statement[1],
+        'qna': extract_qna_records(data, filename)
+    }
+
+def parse_file(file_path):
+    """Parse one JSON file into rows for the bulk importer (runs in a worker process)"""
+    filename = os.path.basename(file_path)
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        
+        return parse_data(data, filename)
+    except Exception as e:
+        print(f"Error processing file {filename}: {e}")
+        return None
+
+def _copy_rows(cur, table, columns, rows):
+    """Stream rows into a table with COPY FROM STDIN (CSV)"""
+    buf = io.StringIO()
+    # COPY reads an unquoted empty field as NULL; quoting every field keeps
+    # empty text as '' for the NOT NULL columns, as the per-file import does
+    csv.writer(buf, quoting=csv.QUOTE_ALL).writerows(rows)
+    buf.seek(0)
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buf)
+
+def load_parsed_chunk(conn, parsed_files):
+    """Stage parsed files with COPY and insert those not yet in the database
+
+    Returns (statements inserted, QnA rows inserted). Files whose filename
+    already exists are skipped by the unique index on fomc_statements.
+    """
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS stage_statements (
+                filename VARCHAR(255),
+                date DATE,
+                speaker VARCHAR(255),
+                content TEXT
+            ) ON COMMIT DELETE ROWS
+            """)
+            cur.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS stage_qna (
+                filename VARCHAR(255),
+                seq INTEGER,
+                questioner VARCHAR(255),
+                question TEXT,
+                responder VARCHAR(255),
+                response TEXT
+            ) ON COMMIT DELETE ROWS
+            """)
+            
+            _copy_rows(cur, 'stage_statements', ('filename', 'date', 'speaker', 'content'),
+                       ((p['filename'], p['date'].isoformat(), p['speaker'], p['content'])
+                        for p in parsed_files))
+            _copy_rows(cur, 'stage_qna', ('filename', 'seq', 'questioner', 'question', 'responder', 'response'),
+                       ((p['filename'], seq) + record
+                        for p in parsed_files
+                        for seq, record in enumerate(p['qna'])))
+            
+            cur.execute("""
+            WITH inserted AS (
+                INSERT INTO fomc_statements (date, filename, speaker, content)
+                SELECT date, filename, speaker, content FROM stage_statements
+                ON CONFLICT (filename) DO NOTHING
+                RETURNING id, filename
+            ), qna AS (
+                INSERT INTO fomc_qna (statement_id, questioner, question, responder, response)
+                SELECT i.id, q.questioner, q.question, q.responder, q.response
+                FROM stage_qna q
+                JOIN inserted i ON i.filename = q.filename
+                ORDER BY q.filename, q.seq
+                RETURNING id
+            )
+            SELECT (SELECT COUNT(*) FROM inserted), (SELECT COUNT(*) FROM qna),
+                   (SELECT array_agg(id ORDER BY id) FROM qna)
+            """)
+            statements, rows, qna_ids = cur.fetchone()
+            cluster_pairs(cur, qna_ids or [])
+        conn.commit()
+        return statements, rows
+    except Exception as e:
+        conn.rollback()
+        print(f"Error loading chunk of {len(parsed_files)} files: {e}")
+        raise
+
+def bulk_import(directory_path, conn, workers=None, chunk_files=50):
+    """Parse files in a process pool and load them in COPY-staged chunks"""
+    paths = sorted(os.path.join(directory_path, f)
+                   for f in os.listdir(directory_path) if f.endswith('.json'))
+    
+    started = time.perf_counter()
+    files_done = statements = rows = 0
+    
+    def report(prefix):
+        elapsed = max(time.perf_counter() - started, 1e-9)
+        print(f"{prefix}: {files_done}/{len(paths)} files, {statements} new statements, "
+              f"{rows} QnA rows in {elapsed:.1f}s "
+              f"({files_done / elapsed:.1f} files/s, {rows / elapsed:.0f} rows/s)")
+    
+    chunk = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Results stream back in order while later files are still being parsed
+        for parsed in pool.map(parse_file, paths, chunksize=8):
+            files_done += 1
+            if parsed is not None:
+                chunk.append(parsed)
+            if len(chunk) >= chunk_files:
+                new_statements, new_rows = load_parsed_chunk(conn, chunk)
+                statements += new_statements
+                rows += new_rows
+                chunk = []
+                report("Progress")
+        if chunk:
+            new_statements, new_rows = load_parsed_chunk(conn, chunk)
+            statements += new_statements
+            rows += new_rows
+    
+    report("Bulk import finished")
+
+def hash_and_parse(task):
+    """Hash a file and parse it only if the hash changed (runs in a worker process)
+
+    Returns (status, content_hash, parsed) with status 'unchanged', 'changed'
+    or 'error'.
+    """
+    file_path, known_hash = task
+    filename = os.path.basename(file_path)
+    try:
+        with open(file_path, 'rb') as f:
+            raw = f.read()
+        content_hash = hashlib.sha256(raw).hexdigest()
+        if content_hash == known_hash:
+            return 'unchanged', content_hash, None
+        
+        parsed = parse_data(json.loads(raw.decode('utf-8')), filename)
+        if parsed is None:
+            return 'error', content_hash, None
+        return 'changed', content_hash, parsed
+    except Exception as e:
+        print(f"Error processing file {filename}: {e}")
+        return 'error', None, None
+
+def upsert_file(conn, parsed, content_hash, mtime, size):
+    """Bring one file's statement and QnA rows in line with its new content
+
+    QnA rows whose question and response text are unchanged keep their id
+    and labels; only added or edited pairs are inserted and vanished ones
+    deleted. The manifest row is written in the same transaction, so a
+    crash never records a file that was not fully imported.
+    """
+    filename = parsed['filename']
+
+    def transaction(cur):
+        cur.execute("""
+        INSERT INTO fomc_statements (date, filename, speaker, content)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (filename) DO UPDATE
+        SET date = EXCLUDED.date,
+            speaker = EXCLUDED.speaker,
+            content = EXCLUDED.content
+        RETURNING id
+        """, (parsed['date'], filename, parsed['speaker'], parsed['content']))
+        statement_id = cur.fetchone()[0]
+        
+        # Match existing pairs by text; duplicates are matched in id order
+        cur.execute("""
+        SELECT id, questioner, question, responder, response
+        FROM fomc_qna WHERE statement_id = %s ORDER BY id
+        """, (statement_id,))
+        existing = {}
+        for qna_id, questioner, question, responder, response in cur.fetchall():
+            existing.setdefault((question, response), []).append((qna_id, questioner, responder))
+        
+        new_records = []
+        renamed = []
+        for questioner, question, responder, response in parsed['qna']:
+            matches = existing.get((question, response))
+            if matches:
+                qna_id, old_questioner, old_responder = matches.pop(0)
+                if (old_questioner, old_responder) != (questioner, responder):
+                    renamed.append((qna_id, questioner, responder))
+            else:
+                new_records.append((statement_id, questioner, question, responder, response))
+        stale_ids = [m[0] for matches in existing.values() for m in matches]
+        
+        if stale_ids:
+            cur.execute("DELETE FROM fomc_qna WHERE id = ANY(%s)", (stale_ids,))
+        if renamed:
+            execute_values(cur, """
+            UPDATE fomc_qna AS q
+            SET questioner = v.questioner, responder = v.responder
+            FROM (VALUES %s) AS v(id, questioner, responder)
+            WHERE q.id = v.id
+            """, renamed, template='(%s::integer, %s, %s)')
+        if new_records:
+            qna_ids = execute_values(cur, """
+            INSERT INTO fomc_qna (statement_id, questioner, question, responder, response)
+            VALUES %s
+            RETURNING id
+            """, new_records, fetch=True)
+            _, duplicates = cluster_pairs(cur, [row[0] for row in qna_ids])
+            if duplicates:
+                print(f"Found {duplicates} near-duplicate QnA pairs in {filename}")
+        
+        cur.execute("""
+        INSERT INTO import_manifest (filename, content_hash, mtime, size, statement_id)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (filename) DO UPDATE
+        SET content_hash = EXCLUDED.content_hash,
+            mtime = EXCLUDED.mtime,
+            size = EXCLUDED.size,
+            statement_id = EXCLUDED.statement_id,
+            imported_at = CURRENT_TIMESTAMP
+        """, (filename, content_hash, mtime, size, statement_id))
+        return len(new_records), len(stale_ids)
+
+    try:
+        # Retried if an annotator labels one of the file's pairs meanwhile
+        # (the label moves it to the other partition of fomc_qna)
+        return run_transaction(conn, transaction)
+    except Exception as e:
+        conn.rollback()
+        print(f"Error upserting data for {filename}: {e}")
+        raise
+
+def incremental_import(directory_path, conn, workers=None):
+    """Import only files that are new or whose content changed since the last run
+
+    Every file is committed together with its manifest row, so an
+    interrupted run resumes where it stopped when started again.
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT filename, content_hash, mtime, size FROM import_manifest")
+        manifest = {row[0]: row[1:] for row in cur.fetchall()}
+    conn.commit()
+    
+    tasks = []
+    stats = []
+    skipped = 0
+    for filename in sorted(os.listdir(directory_path)):
+        if not filename.endswith('.json'):
+            continue
+        file_path = os.path.join(directory_path, filename)
+        st = os.stat(file_path)
+        known = manifest.get(filename)
+        if known and known[1] == st.st_mtime and known[2] == st.st_size:
+            skipped += 1
+            continue
+        tasks.append((file_path, known[0] if known else None))
+        stats.append((st.st_mtime, st.st_size))
+    
+    started = time.perf_counter()
+    changed = touched = failed = inserted = deleted = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(hash_and_parse, tasks, chunksize=8)
+        for (file_path, _), (mtime, size), (status, content_hash, parsed) in zip(tasks, stats, results):
+            filename = os.path.basename(file_path)
+            if status == 'error':
+                # Not recorded in the manifest, so it is retried next run
+                failed += 1
+            elif status == 'unchanged':
+                # Same content under a new mtime: only refresh the manifest
+                with conn.cursor() as cur:
+                    cur.execute("""
+                    UPDATE import_manifest SET mtime = %s, size = %s WHERE filename = %s
+                    """, (mtime, size, filename))
+                conn.commit()
+                touched += 1
+            else:
+                new_rows, stale_rows = upsert_file(conn, parsed, content_hash, mtime, size)
+                inserted += new_rows
+                deleted += stale_rows
+                changed += 1
+                print(f"Imported {filename}: {new_rows} QnA rows added, {stale_rows} removed")
+    
+    elapsed = time.perf_counter() - started
+    print(f"Incremental import finished in {elapsed:.1f}s: {changed} files imported, "
+          f"{touched} unchanged after re-hashing, {skipped} skipped by mtime/size, "
+          f"{failed} failed; {inserted} QnA rows added, {deleted} removed")
+
 def reset_tables(conn):
     """Drop and recreate tables - use with caution!"""
     try:
@@ -159,6 +481,16 @@ def reset_tables(conn):
             # Drop tables in correct order due to foreign key constraints
             cur.execute("DROP TABLE IF EXISTS fomc_qna CASCADE")
             cur.execute("DROP TABLE IF EXISTS fomc_statements CASCADE")
+            # Tables owned by migrations go too, so they are re-applied
+            cur.execute("DROP TABLE IF EXISTS import_manifest CASCADE")
+            cur.execute("DROP TABLE IF EXISTS label_batches CASCADE")
+            cur.execute("DROP TABLE IF EXISTS labeling_stats CASCADE")
+            cur.execute("DROP TABLE IF EXISTS statement_progress CASCADE")
+            cur.execute("DROP TABLE IF EXISTS user_affinity CASCADE")
+            cur.execute("DROP TABLE IF EXISTS qna_labels CASCADE")
+            cur.execute("DROP TABLE IF EXISTS qna_lsh_buckets CASCADE")
+            cur.execute("DROP TABLE IF EXISTS qna_minhash CASCADE")
+            cur.execute("DROP TABLE IF EXISTS schema_migrations CASCADE")
             conn.commit()
         return True
     except Exception as e:
@@ -166,15 +498,31 @@ def reset_tables(conn):
         print(f"Error resetting tables: {e}")
         return False
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Import FOMC press conference JSON files")
+    parser.add_argument('--dir', default='./Powell',
+                        help="directory containing the JSON files (default: ./Powell)")
+    parser.add_argument('--reset', action='store_true',
+                        help="drop all tables and reimport everything")
+    parser.add_argument('--bulk', action='store_true',
+                        help="parse files in parallel and load them with COPY")
+    parser.add_argument('--incremental', action='store_true',
+                        help="only import new or changed files, keeping existing labels")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="parser processes for --bulk/--incremental (default: CPU count)")
+    parser.add_argument('--chunk-files', type=int, default=50,
+                        help="files loaded per transaction with --bulk (default: 50)")
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
+    
     # Connect to the database
     try:
         conn = psycopg2.connect(**DB_PARAMS)
         print("Connected to the database successfully!")
         
-        # Ask to reset tables
-        reset = input("Do you want to reset all tables and reimport everything? (yes/no): ").strip().lower()
-        if reset in ['yes', 'y']:
+        if args.reset:
             if reset_tables(conn):
                 print("Tables reset successfully.")
             else:
@@ -185,9 +533,14 @@ def main():
         create_tables(conn)
         print("Tables created or already exist.")
         
-        # Process directory with Powell's JSON files
-        directory_path = './Powell'
-        process_json_files(directory_path, conn)
+        # Process directory with the JSON files
+        directory_path = args.dir
+        if args.incremental:
+            incremental_import(directory_path, conn, workers=args.workers)
+        elif args.bulk:
+            bulk_import(directory_path, conn, workers=args.workers, chunk_files=args.chunk_files)
+        else:
+            process_json_files(directory_path, conn)
         print(f"Processed all JSON files in {directory_path}")
         
         # Close connection
@@ -200,4 +553,4 @@ def main():
         print(f"Error: {e}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,351 @@
+import argparse
+import json
+import os
+import sys
+import threading
+from datetime import timedelta
+
+import numpy as np
+
+from api.queries import COMMIT, Query
+
+# Inter-annotator agreement over every label in qna_labels.
+#
+# Labels are held in memory as parallel NumPy arrays (pair, annotator,
+# label) and every statistic is computed from them in one vectorised pass:
+#
+#   fleiss_kappa       - Fleiss' kappa over the pairs with two or more
+#                        labels (raters per pair may vary)
+#   pairs              - Cohen's kappa for every two annotators who share
+#                        at least AGREEMENT_MIN_PAIR_ITEMS pairs
+#   majority_agreement - per annotator, how often their label matches the
+#                        majority of the other labels on the same pair
+#
+# Each report only reads labels newer than the last one seen. The number of
+# labels held is checked against the trigger-maintained labeling_stats
+# counters; on a mismatch (deleted labels, a missed transaction) everything
+# is read again.
+#
+# How many labels a pair needs is its required_labels (default 1). Set it
+# for a sample of the pairs with:
+#
+#   python -m api.agreement --overlap 3 --sample 0.1
+#   python -m api.agreement                    # print the report
+
+# Annotator pairs sharing fewer pairs than this get no Cohen's kappa
+MIN_PAIR_ITEMS = int(os.getenv('AGREEMENT_MIN_PAIR_ITEMS', '10'))
+# Labels are stamped with their transaction's start time, so a transaction
+# that commits late can add labels older than ones already seen. Each
+# refresh re-reads this far behind the newest label.
+WATERMARK_SLACK_SECONDS = 60
+
+# Both reads see the same snapshot, so the counters match the labels read
+BEGIN_SNAPSHOT = Query('begin', "BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY",
+                       returns_rows=False)
+
+LABEL_TOTAL_SQL = """
+    SELECT COALESCE(SUM(total), 0)::bigint AS labels
+    FROM labeling_stats
+    WHERE user_id <> ''
+"""
+
+ALL_LABELS_SQL = """
+    SELECT id, qna_id, user_id, label, labeled_at
+    FROM qna_labels
+"""
+
+LABELS_SINCE_SQL = ALL_LABELS_SQL + """
+    WHERE labeled_at >= %(since)s
+"""
+
+SET_OVERLAP_SQL = """
+    UPDATE fomc_qna
+    SET required_labels = %(overlap)s
+    WHERE required_labels <> %(overlap)s
+      AND (%(include_labeled)s OR is_labeled = FALSE)
+      AND random() < %(sample)s
+    RETURNING id, label_count
+"""
+
+SUMMARIZE_SQL = "SELECT qna_labels_summarize(%(ids)s::integer[])"
+
+
+class LabelSet:
+    """Every label as parallel arrays, updated in place as labels arrive"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.ids = np.empty(0, dtype=np.int64)
+        self.items = np.empty(0, dtype=np.int64)
+        self.annotators = np.empty(0, dtype=np.int32)
+        self.labels = np.empty(0, dtype=np.int8)
+        self.positions = {}     # label id -> index into the arrays
+        self.users = []         # annotator code -> user_id
+        self.user_codes = {}    # user_id -> annotator code
+        self.watermark = None   # newest labeled_at seen
+        self.version = 0        # bumped whenever the arrays change
+        self.report = None
+        self.report_version = -1
+
+    def _code(self, user_id):
+        code = self.user_codes.get(user_id)
+        if code is None:
+            code = self.user_codes[user_id] = len(self.users)
+            self.users.append(user_id)
+        return code
+
+    def load(self, rows):
+        """Replace every label"""
+        self.clear()
+        self.ids = np.fromiter((row['id'] for row in rows), dtype=np.int64, count=len(rows))
+        self.items = np.fromiter((row['qna_id'] for row in rows), dtype=np.int64, count=len(rows))
+        self.annotators = np.fromiter((self._code(row['user_id']) for row in rows),
+                                      dtype=np.int32, count=len(rows))
+        self.labels = np.fromiter((row['label'] for row in rows), dtype=np.int8, count=len(rows))
+        self.positions = dict(zip(self.ids.tolist(), range(len(rows))))
+        self.watermark = max((row['labeled_at'] for row in rows), default=None)
+        self.version += 1
+
+    def merge(self, rows):
+        """Add new labels and overwrite changed ones"""
+        added = []
+        changed = False
+        for row in rows:
+            code = self._code(row['user_id'])
+            position = self.positions.get(row['id'])
+            if position is None:
+                self.positions[row['id']] = len(self.ids) + len(added)
+                added.append((row['id'], row['qna_id'], code, row['label']))
+            elif (self.items[position], self.annotators[position], self.labels[position]) != \
+                    (row['qna_id'], code, row['label']):
+                self.items[position] = row['qna_id']
+                self.annotators[position] = code
+                self.labels[position] = row['label']
+                changed = True
+            if self.watermark is None or row['labeled_at'] > self.watermark:
+                self.watermark = row['labeled_at']
+        if added:
+            ids, items, annotators, labels = zip(*added)
+            self.ids = np.concatenate([self.ids, np.array(ids, dtype=np.int64)])
+            self.items = np.concatenate([self.items, np.array(items, dtype=np.int64)])
+            self.annotators = np.concatenate([self.annotators, np.array(annotators, dtype=np.int32)])
+            self.labels = np.concatenate([self.labels, np.array(labels, dtype=np.int8)])
+        if added or changed:
+            self.version += 1
+
+    def get_report(self):
+        """The agreement report, recomputed only if the labels changed"""
+        if self.report_version != self.version:
+            self.report = compute_agreement(self.items, self.annotators, self.labels, self.users)
+            self.report_version = self.version
+        return self.report
+
+
+_labels = LabelSet()
+
+
+def _number(value, digits=4):
+    """JSON-friendly float: None for undefined statistics"""
+    value = float(value)
+    return None if np.isnan(value) else round(value, digits)
+
+
+def _kappa(observed, expected):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(expected < 1, (observed - expected) / (1 - expected), np.nan)
+
+
+def compute_agreement(items, annotators, labels, users):
+    """Fleiss' kappa, pairwise Cohen's kappa and per-annotator agreement with the majority"""
+    user_count = len(users)
+    labels = labels.astype(np.float64)
+    _, item_index = np.unique(items, return_inverse=True)
+    raters = np.bincount(item_index)
+    relevant = np.bincount(item_index, weights=labels)
+
+    # Fleiss' kappa over pairs with at least two labels
+    overlap = raters >= 2
+    n, r = raters[overlap], relevant[overlap]
+    if len(n):
+        agreement = (r * (r - 1) + (n - r) * (n - r - 1)) / (n * (n - 1))
+        p = r.sum() / n.sum()
+        fleiss = _kappa(agreement.mean(), p * p + (1 - p) * (1 - p))
+    else:
+        fleiss = np.nan
+
+    # Majority of the other labels on the same pair; ties and single labels
+    # are not compared
+    others = raters[item_index] - 1
+    others_relevant = relevant[item_index] - labels
+    compared = (others >= 1) & (2 * others_relevant != others)
+    agrees = compared & ((2 * others_relevant > others) == (labels == 1))
+    per_user_labels = np.bincount(annotators, minlength=user_count)
+    per_user_relevant = np.bincount(annotators, weights=labels, minlength=user_count)
+    per_user_compared = np.bincount(annotators, weights=compared, minlength=user_count)
+    per_user_agrees = np.bincount(annotators, weights=agrees, minlength=user_count)
+
+    # Cohen's kappa for every annotator pair from annotator x pair indicator
+    # matrices: R[a, i] = 1 if a labeled pair i relevant, N[a, i] if irrelevant
+    in_overlap = overlap[item_index]
+    _, column = np.unique(item_index[in_overlap], return_inverse=True)
+    relevant_matrix = np.zeros((user_count, int(overlap.sum())), dtype=np.float32)
+    irrelevant_matrix = np.zeros_like(relevant_matrix)
+    relevant_matrix[annotators[in_overlap], column] = labels[in_overlap]
+    irrelevant_matrix[annotators[in_overlap], column] = 1 - labels[in_overlap]
+    both_relevant = relevant_matrix @ relevant_matrix.T
+    both_irrelevant = irrelevant_matrix @ irrelevant_matrix.T
+    split = relevant_matrix @ irrelevant_matrix.T   # a relevant, b irrelevant
+    shared = both_relevant + both_irrelevant + split + split.T
+    with np.errstate(divide='ignore', invalid='ignore'):
+        observed = (both_relevant + both_irrelevant) / shared
+        rate_a = (both_relevant + split) / shared
+        rate_b = (both_relevant + split.T) / shared
+    cohen = _kappa(observed, rate_a * rate_b + (1 - rate_a) * (1 - rate_b))
+
+    pairs = []
+    for a, b in zip(*np.triu_indices(user_count, k=1)):
+        if shared[a, b] >= MIN_PAIR_ITEMS:
+            pairs.append({
+                'annotators': sorted([users[a], users[b]]),
+                'shared': int(shared[a, b]),
+                'agreement': _number(observed[a, b]),
+                'cohen_kappa': _number(cohen[a, b]),
+            })
+    pairs.sort(key=lambda pair: pair['annotators'])
+    kappas = [pair['cohen_kappa'] for pair in pairs if pair['cohen_kappa'] is not None]
+
+    return {
+        'labels': int(len(labels)),
+        'items': int(len(raters)),
+        'overlap_items': int(overlap.sum()),
+        'fleiss_kappa': _number(fleiss),
+        'mean_cohen_kappa': _number(np.mean(kappas)) if kappas else None,
+        'annotators': [{
+            'user_id': user_id,
+            'labels': int(per_user_labels[code]),
+            'relevant': int(per_user_relevant[code]),
+            'compared': int(per_user_compared[code]),
+            'majority_agreement': _number(per_user_agrees[code] / per_user_compared[code])
+                                  if per_user_compared[code] else None,
+        } for code, user_id in sorted(enumerate(users), key=lambda entry: entry[1])],
+        'pairs': pairs,
+    }
+
+
+def agreement_report(fresh=False):
+    """Agreement over every label, reading only labels added since the last report"""
+    labels = _labels
+    since = None
+    if not fresh and labels.watermark is not None:
+        since = labels.watermark - timedelta(seconds=WATERMARK_SLACK_SECONDS)
+
+    while True:
+        yield BEGIN_SNAPSHOT
+        total = yield Query('label_total', LABEL_TOTAL_SQL)
+        if since is None:
+            rows = yield Query('agreement_labels', ALL_LABELS_SQL)
+        else:
+            rows = yield Query('agreement_new_labels', LABELS_SINCE_SQL, {'since': since})
+        yield COMMIT
+
+        with labels.lock:
+            if since is None:
+                labels.load(rows)
+            else:
+                labels.merge(rows)
+            if since is None or len(labels.ids) == total[0]['labels']:
+                return labels.get_report()
+        # Labels were deleted or missed; read them all again
+        since = None
+
+
+def set_overlap(overlap, sample=1.0, include_labeled=False):
+    """Require `overlap` labels on a random sample of the pairs
+
+    Labeled pairs are only included on request; they go back into the
+    queue until they have enough labels.
+    """
+    yield Query('begin', "BEGIN", returns_rows=False)
+    rows = yield Query('set_overlap', SET_OVERLAP_SQL, {
+        'overlap': overlap,
+        'sample': sample,
+        'include_labeled': include_labeled,
+    })
+    # Pairs that already have labels get their summary recomputed
+    ids = [row['id'] for row in rows if row['label_count']]
+    if ids:
+        yield Query('summarize', SUMMARIZE_SQL, {'ids': ids})
+    yield COMMIT
+    return len(rows)
+
+
+def print_report(report):
+    print(f"Labels: {report['labels']} on {report['items']} QnA pairs "
+          f"({report['overlap_items']} with two or more labels)")
+    print(f"Fleiss' kappa: {report['fleiss_kappa']}")
+    print(f"Mean pairwise Cohen's kappa: {report['mean_cohen_kappa']}")
+    print()
+    print(f"{'Annotator':<24} {'Labels':>8} {'Relevant':>9} {'Compared':>9} {'Majority':>9}")
+    for annotator in report['annotators']:
+        majority = annotator['majority_agreement']
+        print(f"{annotator['user_id']:<24} {annotator['labels']:>8} {annotator['relevant']:>9} "
+              f"{annotator['compared']:>9} {'-' if majority is None else f'{majority:.1%}':>9}")
+    if report['pairs']:
+        print()
+        print(f"{'Annotators':<40} {'Shared':>7} {'Agree':>7} {'Kappa':>7}")
+        for pair in report['pairs']:
+            kappa = pair['cohen_kappa']
+            print(f"{' / '.join(pair['annotators']):<40} {pair['shared']:>7} "
+                  f"{pair['agreement']:>7.1%} {'-' if kappa is None else f'{kappa:.3f}':>7}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Inter-annotator agreement report")
+    parser.add_argument('--overlap', type=int,
+                        help="set the number of labels required per QnA pair")
+    parser.add_argument('--sample', type=float, default=1.0,
+                        help="fraction of pairs --overlap applies to (default: 1)")
+    parser.add_argument('--include-labeled', action='store_true',
+                        help="apply --overlap to labeled pairs too, sending them back for more labels")
+    parser.add_argument('--json', action='store_true', help="print the report as JSON")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.overlap is not None and not 1 <= args.overlap <= 100:
+        print("--overlap must be between 1 and 100")
+        return 1
+    if not 0 < args.sample <= 1:
+        print("--sample must be in (0, 1]")
+        return 1
+
+    import psycopg2
+    from api.db import run_sync, run_write
+    from api.pool import DB_PARAMS
+
+    conn = psycopg2.connect(**DB_PARAMS)
+    conn.autocommit = True
+    try:
+        if args.overlap is not None:
+            # Retried if a pair is labeled (and changes partition) meanwhile
+            updated = run_write(conn, lambda: set_overlap(args.overlap, args.sample,
+                                                          args.include_labeled))
+            print(f"{updated} QnA pairs now require {args.overlap} label(s).")
+            return 0
+        report = run_sync(conn, agreement_report(fresh=True))
+    finally:
+        conn.close()
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
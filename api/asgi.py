@@ -0,0 +1,198 @@
+from quart import Quart, Response, render_template, request, redirect, url_for, jsonify, session
+import os
+import secrets
+from quart.wrappers.response import DataBody
+from dotenv import load_dotenv
+
+# Async variant of app.py for ASGI servers, e.g.
+#   uvicorn api.asgi:app --workers 2
+# Request handling (api/handlers.py), validation and queries are shared
+# with the Flask app, so both serving modes return identical JSON.
+
+# Load environment variables
+load_dotenv()
+
+# Create Quart app
+app = Quart(__name__, template_folder='../templates')
+app.secret_key = os.getenv("SECRET_KEY", secrets.token_hex(16))
+
+# Routes are thin: the shared handlers in api/handlers.py do the work, run
+# on the asyncio data layer in api/db_async.py
+from api import db_async, handlers
+from api.db_async import open_pool, close_pool
+from api.handlers import run_handler_async
+from api.stream import SSE_HEADERS, stats_stream_enabled
+from api.stream_async import get_hub, stream_stats
+from api.metrics import begin_request, end_request
+from api.compression import COMPRESSIBLE_MIMETYPES, add_vary, choose_encoding, compress
+
+# An open stream only costs a waiting task here, so it is on by default
+STATS_STREAM = stats_stream_enabled(True)
+
+TEMPLATES = ('index.html', 'label.html')
+
+async def respond(reply):
+    """Turn a handler's Reply into a Quart response"""
+    if reply.mimetype:
+        response = Response(reply.body, status=reply.status, mimetype=reply.mimetype)
+    elif reply.body is None:
+        response = await app.make_response(('', reply.status))
+    else:
+        response = jsonify(reply.body)
+        response.status_code = reply.status
+    response.headers.update(reply.headers)
+    return response
+
+async def handle(handler, *args):
+    """Run a shared handler and respond with its Reply"""
+    return await respond(await run_handler_async(handler(*args), db_async))
+
+@app.before_serving
+async def startup():
+    await open_pool()
+
+@app.after_serving
+async def shutdown():
+    await close_pool()
+
+@app.before_request
+async def start_request_timing():
+    begin_request()
+
+@app.after_request
+async def add_server_timing(response):
+    timing = end_request(request.endpoint, request.method, request.path, response.status_code)
+    if timing:
+        response.headers['Server-Timing'] = timing
+    return response
+
+# Registered after the timing hook, so it runs first and is timed too
+@app.after_request
+async def compress_response(response):
+    if response.mimetype not in COMPRESSIBLE_MIMETYPES or not isinstance(response.response, DataBody):
+        return response
+    add_vary(response.headers)
+    data = await response.get_data()
+    encoding = choose_encoding(request.headers.get('Accept-Encoding'), response.mimetype,
+                               len(data), response.headers.get('Content-Encoding'))
+    if encoding:
+        response.set_data(compress(data, encoding))
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+# Routes
+@app.route('/')
+async def index():
+    """Main page - user identification"""
+    return await render_template('index.html')
+
+@app.route('/label', methods=['GET', 'POST'])
+async def label():
+    """Labeling page"""
+    # Check if user is set
+    if 'user_id' not in session:
+        return redirect(url_for('index'))
+
+    stats = await run_handler_async(handlers.label_page_stats(session), db_async)
+    return await render_template('label.html',
+                                 user_id=session['user_id'],
+                                 stats=stats,
+                                 stats_stream=STATS_STREAM)
+
+@app.route('/api/next_qna', methods=['GET'])
+async def api_next_qna():
+    """API to get the next QnA pair, or a batch of them with ?count=N"""
+    return await handle(handlers.next_qna, session, request.args)
+
+@app.route('/api/label_qna', methods=['POST'])
+async def api_label_qna():
+    """API to label a QnA pair"""
+    return await handle(handlers.label_one, session, await request.get_json(silent=True))
+
+@app.route('/api/label_batch', methods=['POST'])
+async def api_label_batch():
+    """API to label several QnA pairs at once"""
+    # Batches sent with navigator.sendBeacon arrive as text/plain
+    data = await request.get_json(force=True, silent=True)
+    return await handle(handlers.label_batch, session, data)
+
+@app.route('/api/statement/<int:statement_id>', methods=['GET'])
+async def api_statement(statement_id):
+    """API to get the full text of a statement, cacheable by the browser"""
+    return await handle(handlers.statement, session, statement_id, request.if_none_match)
+
+@app.route('/api/stats', methods=['GET'])
+async def api_stats():
+    """API to get user statistics"""
+    return await handle(handlers.stats, session)
+
+@app.route('/api/stream/stats', methods=['GET'])
+async def api_stream_stats():
+    """Server-sent events with the user's statistics, pushed as labels come in"""
+    reply = await run_handler_async(handlers.stream_start(session, STATS_STREAM), db_async)
+    if reply.status != 200:
+        return await respond(reply)
+    stats = reply.body
+    subscription = get_hub().subscribe(session['user_id'], stats)
+
+    async def events():
+        try:
+            async for event in subscription.events(stats):
+                yield event
+        finally:
+            subscription.close()
+
+    response = Response(events(), mimetype='text/event-stream', headers=SSE_HEADERS)
+    # The stream stays open for as long as the page does
+    response.timeout = None
+    return response
+
+@app.route('/api/search', methods=['GET'])
+async def api_search():
+    """API to search QnA pairs (or statements with scope=statements), one keyset page at a time"""
+    return await handle(handlers.search, session, request.args)
+
+@app.route('/api/my_labels', methods=['GET'])
+async def api_my_labels():
+    """API to page through the user's own labels, newest first"""
+    return await handle(handlers.my_labels, session, request.args)
+
+@app.route('/api/my_labels/<int:qna_id>', methods=['POST'])
+async def api_edit_label(qna_id):
+    """API to change a label the user gave earlier"""
+    return await handle(handlers.edit, session, qna_id, await request.get_json(silent=True))
+
+@app.route('/api/agreement', methods=['GET'])
+async def api_agreement():
+    """API to get inter-annotator agreement over all labels"""
+    return await handle(handlers.agreement, session)
+
+@app.route('/set_user', methods=['POST'])
+async def set_user():
+    """Set the user ID in the session"""
+    form = await request.form
+    user_id = form.get('user_id')
+    if user_id:
+        session['user_id'] = user_id
+        return redirect(url_for('label'))
+    return redirect(url_for('index'))
+
+@app.route('/logout')
+async def logout():
+    """Log out the user"""
+    session.pop('user_id', None)
+    return redirect(url_for('index'))
+
+def compile_templates():
+    for template in TEMPLATES:
+        app.jinja_env.get_template(template)
+
+@app.route('/health')
+async def health_check():
+    """Health check endpoint; ?warm=1 also warms the instance up"""
+    return await handle(handlers.health, request.args, compile_templates, stream_stats())
+
+@app.route('/metrics')
+async def metrics():
+    """Prometheus metrics for this worker process"""
+    return await handle(handlers.metrics)
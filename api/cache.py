@@ -0,0 +1,157 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Optional path of a SQLite file shared by all workers on this host (ideally
+# on tmpfs, e.g. /dev/shm/fedspeak_cache.sqlite3). Without it every worker
+# keeps only its own in-memory cache.
+CACHE_SHARED_PATH = os.getenv('CACHE_SHARED_PATH')
+
+MISSING = object()
+
+
+class SharedStore:
+    """Cross-process key/value store with expiry, backed by a local SQLite file"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self):
+        # SQLite connections may not cross threads or forks
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS cache (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                )
+            """)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, namespace, key):
+        try:
+            row = self._conn().execute(
+                "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?",
+                (namespace, str(key))).fetchone()
+        except sqlite3.Error as e:
+            print(f"Shared cache read error: {e}")
+            return MISSING
+        if row is None or row[1] < time.time():
+            return MISSING
+        return json.loads(row[0])
+
+    def set(self, namespace, key, value, ttl):
+        try:
+            self._conn().execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (namespace, str(key), json.dumps(value), time.time() + ttl))
+        except sqlite3.Error as e:
+            print(f"Shared cache write error: {e}")
+
+    def delete(self, namespace, key=None):
+        try:
+            if key is None:
+                self._conn().execute("DELETE FROM cache WHERE namespace = ?", (namespace,))
+            else:
+                self._conn().execute("DELETE FROM cache WHERE namespace = ? AND key = ?",
+                                     (namespace, str(key)))
+        except sqlite3.Error as e:
+            print(f"Shared cache delete error: {e}")
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after `ttl` seconds
+
+    With a shared store the cache becomes two-level: misses in this worker
+    fall through to the store, and invalidations clear both. Other workers
+    may still serve their own copy until it expires, so keep the TTL short
+    for data that changes.
+    """
+
+    def __init__(self, name, maxsize=256, ttl=60, shared=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.shared = shared
+        self._lock = threading.Lock()
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._counters = {'hits': 0, 'shared_hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def get(self, key):
+        """Return the cached value or MISSING"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._data.move_to_end(key)
+                    self._counters['hits'] += 1
+                    return entry[1]
+                del self._data[key]
+
+        if self.shared is not None:
+            value = self.shared.get(self.name, key)
+            if value is not MISSING:
+                with self._lock:
+                    self._counters['shared_hits'] += 1
+                self._store(key, value)
+                return value
+
+        with self._lock:
+            self._counters['misses'] += 1
+        return MISSING
+
+    def _store(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self._counters['evictions'] += 1
+
+    def set(self, key, value):
+        self._store(key, value)
+        if self.shared is not None:
+            self.shared.set(self.name, key, value, self.ttl)
+
+    def invalidate(self, key=None):
+        """Drop one key, or everything when no key is given"""
+        with self._lock:
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+            self._counters['invalidations'] += 1
+        if self.shared is not None:
+            self.shared.delete(self.name, key)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters, size=len(self._data), maxsize=self.maxsize, ttl=self.ttl)
+
+
+_shared_store = SharedStore(CACHE_SHARED_PATH) if CACHE_SHARED_PATH else None
+_caches = {}
+
+
+def get_cache(name, maxsize=256, ttl=60):
+    """Return the named cache, creating it on first use"""
+    cache = _caches.get(name)
+    if cache is None:
+        cache = _caches.setdefault(name, TTLCache(name, maxsize, ttl, _shared_store))
+    return cache
+
+
+def cache_stats():
+    """Hit/miss counters for every cache in this process"""
+    return {name: cache.stats() for name, cache in _caches.items()}
@@ -0,0 +1,58 @@
+import gzip
+import os
+
+# Response compression shared by the Flask and ASGI apps. QnA items and
+# statement texts are long English prose and shrink several times over.
+# Brotli is used when the optional 'brotli' package is installed and the
+# client accepts it; otherwise gzip.
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Bodies smaller than this are sent as is
+COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', '1024'))
+GZIP_LEVEL = int(os.getenv('COMPRESS_GZIP_LEVEL', '6'))
+BROTLI_QUALITY = int(os.getenv('COMPRESS_BROTLI_QUALITY', '5'))
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'text/html', 'text/plain', 'text/css',
+                          'application/javascript')
+
+
+def _accepted(accept_encoding):
+    """Encodings from an Accept-Encoding header that are not refused with q=0"""
+    accepted = set()
+    for part in (accept_encoding or '').lower().split(','):
+        coding, _, params = part.strip().partition(';')
+        if params.strip().replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        accepted.add(coding.strip())
+    return accepted
+
+
+def choose_encoding(accept_encoding, mimetype, size, content_encoding=None):
+    """Encoding to compress a response with, or None to send it as is"""
+    if content_encoding or size < COMPRESS_MIN_BYTES or mimetype not in COMPRESSIBLE_MIMETYPES:
+        return None
+    accepted = _accepted(accept_encoding)
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL)
+
+
+def add_vary(headers):
+    """Mark a response as depending on Accept-Encoding"""
+    vary = headers.get('Vary')
+    if not vary:
+        headers['Vary'] = 'Accept-Encoding'
+    elif 'accept-encoding' not in vary.lower():
+        headers['Vary'] = f"{vary}, Accept-Encoding"
@@ -1,156 +1,168 @@
-import psycopg2
-from psycopg2.extras import DictCursor
-import os
-from datetime import datetime
-from dotenv import load_dotenv
-
-# Load environment variables
-load_dotenv()
-
-# Database configuration from environment variables
-DB_PARAMS = {
-    'host': os.getenv('DB_HOST'),
-    'port': os.getenv('DB_PORT'),
-    'database': os.getenv('DB_NAME'),
-    'user': os.getenv('DB_USER'),
-    'password': os.getenv('DB_PASSWORD')
-}
-
-def get_db_connection():
-    """Create and return a database connection"""
-    try:
-        conn = psycopg2.connect(**DB_PARAMS)
-        conn.autocommit = True  # Automatically commit changes
-        return conn
-    except Exception as e:
-        print(f"Database connection error: {e}")
-        raise
-
-def get_next_unlabeled_qna():
-    """Get the next unlabeled QnA pair"""
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=DictCursor)
-    
+from psycopg2 import errors, extensions
+from psycopg2.extras import RealDictCursor
+
+# Connections are borrowed from the process-wide pool in api/pool.py
+# get_pool_stats and get_replica_stats are looked up here by api.handlers
+from api.pool import REPLICAS, get_conn, get_pool_stats, get_replica_stats
+from api.metrics import timed_query
+from api.prepared import execute
+from api import queries, review, scheduler, search
+from api.queries import CLAIM_LEASE_SECONDS, WRITE_ATTEMPTS
+
+def run_sync(conn, steps):
+    """Drive a data-access generator from api.queries on a psycopg2 connection"""
+    cur = conn.cursor(cursor_factory=RealDictCursor)
     try:
-        # Get next unlabeled QnA with statement info
-        cur.execute("""
-            SELECT q.id, q.questioner, q.question, q.responder, q.response, 
-                   s.date, s.filename
-            FROM fomc_qna q
-            JOIN fomc_statements s ON q.statement_id = s.id
-            WHERE q.is_labeled = FALSE
-            ORDER BY RANDOM() -- Randomize to distribute workload among users
-            LIMIT 1
-        """)
-        
-        row = cur.fetchone()
-        result = dict(row) if row else None
-        
-        # Convert the date to string format if it exists
-        if result and 'date' in result:
-            result['date'] = result['date'].strftime('%Y-%m-%d')
-            
-        return result
-    except Exception as e:
-        print(f"Error getting next unlabeled QnA: {e}")
-        raise
+        query = next(steps)
+        while True:
+            with timed_query(query.name):
+                execute(cur, query)
+                rows = [dict(row) for row in cur.fetchall()] if query.returns_rows else []
+            query = steps.send(rows)
+    except StopIteration as stop:
+        return stop.value
     finally:
+        steps.close()
         cur.close()
-        conn.close()
+
+def run_write(conn, make_steps):
+    """run_sync for a claim or label write, started over after a serialization failure"""
+    for attempt in range(WRITE_ATTEMPTS):
+        try:
+            return run_sync(conn, make_steps())
+        except errors.SerializationFailure:
+            if attempt == WRITE_ATTEMPTS - 1:
+                raise
+            if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                with conn.cursor() as cur:
+                    cur.execute("ROLLBACK")
+
+def run_transaction(conn, transaction):
+    """Run transaction(cur) and commit, started over after a serialization failure
+
+    For batch jobs on their own connection. Labeling moves a pair to the other partition of fomc_qna, so an UPDATE
+    or DELETE of that pair in a concurrent batch job fails with 40001
+    """
+    for attempt in range(WRITE_ATTEMPTS):
+        try:
+            with conn.cursor() as cur:
+                result = transaction(cur)
+            conn.commit()
+            return result
+        except errors.SerializationFailure:
+            conn.rollback()
+            if attempt == WRITE_ATTEMPTS - 1:
+                raise
+
+def claim_next_qnas(user_id, count=1):
+    """Claim up to `count` unlabeled QnA pairs for a user in one round trip"""
+    with get_conn() as conn:
+        try:
+            return run_write(conn, lambda: scheduler.claim_next_qnas(user_id, count))
+        except Exception as e:
+            print(f"Error claiming unlabeled QnAs: {e}")
+            raise
+
+def get_next_unlabeled_qna(user_id):
+    """Claim the next unlabeled QnA pair for a user"""
+    results = claim_next_qnas(user_id, 1)
+    return results[0] if results else None
 
 def label_qna(qna_id, label_value, user_id):
     """Label a QnA pair and record the user who labeled it"""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    try:
-        # Update the QnA record with label and user info
-        cur.execute("""
-            UPDATE fomc_qna
-            SET is_labeled = TRUE, 
-                label = %s,
-                labeled_by = %s,
-                labeled_at = NOW()
-            WHERE id = %s
-        """, (label_value, user_id, qna_id))
-        
-        # Get the number of remaining unlabeled QnAs
-        cur.execute("""
-            SELECT COUNT(*) FROM fomc_qna WHERE is_labeled = FALSE
-        """)
-        remaining = cur.fetchone()[0]
-        
-        # Get labeling statistics for this user
-        cur.execute("""
-            SELECT COUNT(*) FROM fomc_qna 
-            WHERE labeled_by = %s
-        """, (user_id,))
-        user_count = cur.fetchone()[0]
-        
-        return {
-            'success': True,
-            'remaining': remaining,
-            'user_count': user_count
-        }
-    except Exception as e:
-        print(f"Error labeling QnA: {e}")
-        raise
-    finally:
-        cur.close()
-        conn.close()
+    with get_conn() as conn:
+        try:
+            return run_write(conn, lambda: queries.label_qna(qna_id, label_value, user_id))
+        except Exception as e:
+            print(f"Error labeling QnA: {e}")
+            raise
 
-def get_user_stats(user_id):
-    """Get labeling statistics for a user"""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    try:
-        # Get total labeled by this user
-        cur.execute("""
-            SELECT COUNT(*) FROM fomc_qna 
-            WHERE labeled_by = %s
-        """, (user_id,))
-        total = cur.fetchone()[0]
-        
-        # Get relevant count
-        cur.execute("""
-            SELECT COUNT(*) FROM fomc_qna 
-            WHERE labeled_by = %s AND label = TRUE
-        """, (user_id,))
-        relevant = cur.fetchone()[0]
-        
-        # Get irrelevant count
-        cur.execute("""
-            SELECT COUNT(*) FROM fomc_qna 
-            WHERE labeled_by = %s AND label = FALSE
-        """, (user_id,))
-        irrelevant = cur.fetchone()[0]
-        
-        # Get overall stats
-        cur.execute("""
-            SELECT 
-                COUNT(*) as total,
-                COUNT(*) FILTER (WHERE is_labeled = TRUE) as labeled,
-                COUNT(*) FILTER (WHERE is_labeled = FALSE) as unlabeled
-            FROM fomc_qna
-        """)
-        overall = cur.fetchone()
-        
-        return {
-            'user': {
-                'total': total,
-                'relevant': relevant,
-                'irrelevant': irrelevant
-            },
-            'overall': {
-                'total': overall[0],
-                'labeled': overall[1],
-                'unlabeled': overall[2]
-            }
-        }
-    except Exception as e:
-        print(f"Error getting user stats: {e}")
-        raise
-    finally:
-        cur.close()
-        conn.close()
\ No newline at end of file
+def label_qna_batch(labels, user_id, batch_id):
+    """Apply a batch of (qna_id, label) pairs at most once per batch_id of the user"""
+    with get_conn() as conn:
+        try:
+            return run_write(conn, lambda: queries.label_qna_batch(labels, user_id, batch_id))
+        except Exception as e:
+            print(f"Error labeling QnA batch: {e}")
+            raise
+
+def get_statement(statement_id):
+    """Get the full text of a statement, or None if it does not exist"""
+    # Statements do not change after import, so a replica can serve them;
+    # one the replica has not received yet is looked up on the primary
+    for replica in ((True, False) if REPLICAS else (False,)):
+        with get_conn(replica=replica) as conn:
+            try:
+                statement = run_sync(conn, queries.get_statement(statement_id))
+            except Exception as e:
+                print(f"Error getting statement: {e}")
+                raise
+        if statement is not None:
+            break
+    return statement
+
+def get_user_stats(user_id, replica=False):
+    """Get labeling statistics for a user, from a replica if allowed"""
+    with get_conn(replica=replica) as conn:
+        try:
+            return run_sync(conn, queries.read_stats(user_id))
+        except Exception as e:
+            print(f"Error getting user stats: {e}")
+            raise
+
+def get_agreement():
+    """Inter-annotator agreement over every label"""
+    # Imported on first use: numpy would otherwise add to every cold start
+    from api import agreement
+    # A report over every label: a few seconds of replica lag do not matter
+    with get_conn(replica=True) as conn:
+        try:
+            return run_sync(conn, agreement.agreement_report())
+        except Exception as e:
+            print(f"Error computing agreement: {e}")
+            raise
+
+def search_qna(user_id, **kwargs):
+    """One page of QnA pairs matching a full-text search"""
+    with get_conn() as conn:
+        try:
+            return run_sync(conn, search.search_qna(user_id=user_id, **kwargs))
+        except Exception as e:
+            print(f"Error searching QnAs: {e}")
+            raise
+
+def search_statements(**kwargs):
+    """One page of statements matching a full-text search"""
+    with get_conn() as conn:
+        try:
+            return run_sync(conn, search.search_statements(**kwargs))
+        except Exception as e:
+            print(f"Error searching statements: {e}")
+            raise
+
+def get_my_labels(user_id, **kwargs):
+    """One page of the labels a user has given, newest first"""
+    with get_conn() as conn:
+        try:
+            return run_sync(conn, review.my_labels(user_id, **kwargs))
+        except Exception as e:
+            print(f"Error getting labels for review: {e}")
+            raise
+
+def edit_label(qna_id, label_value, user_id):
+    """Change a user's own label on a QnA pair; None if they have not labeled it"""
+    with get_conn() as conn:
+        try:
+            return run_write(conn, lambda: review.edit_label(qna_id, label_value, user_id))
+        except Exception as e:
+            print(f"Error editing label: {e}")
+            raise
+
+def warm_up():
+    """Open a pooled connection and fill the shared caches ahead of the first request"""
+    with get_conn() as conn:
+        try:
+            return run_sync(conn, queries.warm_up())
+        except Exception as e:
+            print(f"Error warming up: {e}")
+            raise
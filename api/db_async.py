@@ -0,0 +1,202 @@
+import itertools
+import os
+import time
+
+import asyncpg
+
+from api.pool import DB_PARAMS, POOL_MAX, POOL_MAX_LIFETIME, REPLICAS, REPLICA_RETRY
+from api.prepared import PREPARE_STATEMENTS
+from api import queries, review, scheduler, search
+from api.queries import WRITE_ATTEMPTS, numbered_sql
+from api.metrics import record_acquire, timed_query
+
+# Connections per ASGI worker. One event loop multiplexes many requests
+# over these, so this can stay small even with many concurrent annotators.
+ASYNC_POOL_MAX = int(os.getenv('DB_ASYNC_POOL_MAX', str(POOL_MAX)))
+
+_pool = None
+# Read replicas, as with the sync pool (DB_REPLICA_HOSTS in api/pool.py)
+_replica_pools = []
+_replica_turn = itertools.count()
+_replica_down_until = {}    # index in _replica_pools -> monotonic time to try it again
+_routing = {'replica_checkouts': 0, 'replica_failures': 0, 'primary_fallbacks': 0}
+
+async def _create_pool(params, min_size):
+    return await asyncpg.create_pool(
+        host=params['host'],
+        port=int(params['port']) if params['port'] else None,
+        database=params['database'],
+        user=params['user'],
+        password=params['password'],
+        min_size=min_size,
+        max_size=ASYNC_POOL_MAX,
+        max_inactive_connection_lifetime=POOL_MAX_LIFETIME,
+        # asyncpg prepares every query itself; off behind a transaction pooler
+        statement_cache_size=100 if PREPARE_STATEMENTS else 0,
+    )
+
+async def open_pool():
+    """Create the asyncpg pools; called once when the ASGI app starts serving"""
+    global _pool
+    if _pool is None:
+        # Replicas connect on first use, so one that is down cannot stop startup
+        _replica_pools[:] = [await _create_pool(dict(DB_PARAMS, **replica), min_size=0)
+                             for replica in REPLICAS]
+        _pool = await _create_pool(DB_PARAMS, min_size=1)
+    return _pool
+
+async def close_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+    for pool in _replica_pools:
+        await pool.close()
+    _replica_pools.clear()
+
+def get_pool_stats():
+    """Return pool statistics in the same spirit as api.pool.get_pool_stats()"""
+    if _pool is None:
+        return {'size': 0, 'idle': 0, 'in_use': 0, 'max': ASYNC_POOL_MAX}
+    size = _pool.get_size()
+    idle = _pool.get_idle_size()
+    return {'size': size, 'idle': idle, 'in_use': size - idle, 'max': ASYNC_POOL_MAX}
+
+def get_replica_stats():
+    """Replica pools and read routing counters, as api.pool.get_replica_stats()"""
+    pools = []
+    for replica, pool in zip(REPLICAS, _replica_pools):
+        size = pool.get_size()
+        idle = pool.get_idle_size()
+        pools.append({'host': replica['host'], 'size': size, 'idle': idle,
+                      'in_use': size - idle, 'max': ASYNC_POOL_MAX})
+    return dict(_routing, pools=pools)
+
+async def _acquire(replica):
+    """(pool, connection) from a replica if asked and one is available, else the primary"""
+    primary = await open_pool()
+    if replica and _replica_pools:
+        start = next(_replica_turn)
+        for i in range(len(_replica_pools)):
+            index = (start + i) % len(_replica_pools)
+            if _replica_down_until.get(index, 0) > time.monotonic():
+                continue
+            pool = _replica_pools[index]
+            try:
+                conn = await pool.acquire()
+            except (OSError, asyncpg.PostgresError) as e:
+                print(f"Error connecting to replica {REPLICAS[index]['host']}: {e}")
+                _replica_down_until[index] = time.monotonic() + REPLICA_RETRY
+                _routing['replica_failures'] += 1
+                continue
+            _routing['replica_checkouts'] += 1
+            return pool, conn
+        _routing['primary_fallbacks'] += 1
+    return primary, await primary.acquire()
+
+async def run_async(conn, steps):
+    """Drive a data-access generator from api.queries on an asyncpg connection"""
+    try:
+        query = next(steps)
+        while True:
+            sql, names = numbered_sql(query.sql)
+            args = [query.params[name] for name in names]
+            with timed_query(query.name):
+                if query.returns_rows:
+                    rows = [dict(row) for row in await conn.fetch(sql, *args)]
+                else:
+                    await conn.execute(sql, *args)
+                    rows = []
+            query = steps.send(rows)
+    except StopIteration as stop:
+        return stop.value
+    except Exception:
+        # Leave the connection clean before it goes back to the pool
+        if conn.is_in_transaction():
+            await conn.execute("ROLLBACK")
+        raise
+    finally:
+        steps.close()
+
+async def _run(steps, error_message, replica=False):
+    started = time.perf_counter()
+    pool, conn = await _acquire(replica)
+    record_acquire(time.perf_counter() - started)
+    try:
+        return await run_async(conn, steps)
+    except Exception as e:
+        print(f"{error_message}: {e}")
+        raise
+    finally:
+        await pool.release(conn)
+
+async def _run_write(make_steps, error_message):
+    """_run for a claim or label write, started over after a serialization failure"""
+    for attempt in range(WRITE_ATTEMPTS):
+        try:
+            return await _run(make_steps(), error_message)
+        except asyncpg.exceptions.SerializationError:
+            if attempt == WRITE_ATTEMPTS - 1:
+                raise
+
+async def claim_next_qnas(user_id, count=1):
+    """Claim up to `count` unlabeled QnA pairs for a user in one round trip"""
+    return await _run_write(lambda: scheduler.claim_next_qnas(user_id, count),
+                            "Error claiming unlabeled QnAs")
+
+async def get_next_unlabeled_qna(user_id):
+    """Claim the next unlabeled QnA pair for a user"""
+    results = await claim_next_qnas(user_id, 1)
+    return results[0] if results else None
+
+async def label_qna(qna_id, label_value, user_id):
+    """Label a QnA pair and record the user who labeled it"""
+    return await _run_write(lambda: queries.label_qna(qna_id, label_value, user_id),
+                            "Error labeling QnA")
+
+async def label_qna_batch(labels, user_id, batch_id):
+    """Apply a batch of (qna_id, label) pairs at most once per batch_id of the user"""
+    return await _run_write(lambda: queries.label_qna_batch(labels, user_id, batch_id),
+                            "Error labeling QnA batch")
+
+async def get_statement(statement_id):
+    """Get the full text of a statement, or None if it does not exist"""
+    # From a replica, then the primary if it has not been replicated yet (see api.db)
+    statement = None
+    for replica in ((True, False) if REPLICAS else (False,)):
+        statement = await _run(queries.get_statement(statement_id), "Error getting statement",
+                               replica=replica)
+        if statement is not None:
+            break
+    return statement
+
+async def get_user_stats(user_id, replica=False):
+    """Get labeling statistics for a user, from a replica if allowed"""
+    return await _run(queries.read_stats(user_id), "Error getting user stats", replica=replica)
+
+async def get_agreement():
+    """Inter-annotator agreement over every label"""
+    # Imported on first use: numpy would otherwise add to every cold start
+    from api import agreement
+    return await _run(agreement.agreement_report(), "Error computing agreement", replica=True)
+
+async def search_qna(user_id, **kwargs):
+    """One page of QnA pairs matching a full-text search"""
+    return await _run(search.search_qna(user_id=user_id, **kwargs), "Error searching QnAs")
+
+async def search_statements(**kwargs):
+    """One page of statements matching a full-text search"""
+    return await _run(search.search_statements(**kwargs), "Error searching statements")
+
+async def get_my_labels(user_id, **kwargs):
+    """One page of the labels a user has given, newest first"""
+    return await _run(review.my_labels(user_id, **kwargs), "Error getting labels for review")
+
+async def edit_label(qna_id, label_value, user_id):
+    """Change a user's own label on a QnA pair; None if they have not labeled it"""
+    return await _run_write(lambda: review.edit_label(qna_id, label_value, user_id),
+                            "Error editing label")
+
+async def warm_up():
+    """Open a pooled connection and fill the shared caches ahead of the first request"""
+    return await _run(queries.warm_up(), "Error warming up")
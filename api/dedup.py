@@ -0,0 +1,231 @@
+import argparse
+import hashlib
+import os
+import re
+import sys
+import time
+import zlib
+
+import numpy as np
+
+# Near-duplicate detection for QnA pairs with MinHash and LSH.
+#
+# Each pair's question + response text is cut into word 3-gram shingles
+# and summarised by NUM_PERM min-hashes. The signature is split into
+# LSH_BANDS bands; pairs sharing any band bucket are candidates, and a
+# candidate whose estimated Jaccard similarity reaches DEDUP_THRESHOLD
+# joins its cluster. Only cluster representatives are stored (qna_minhash,
+# qna_lsh_buckets), so a new pair is compared with the few representatives
+# that share a bucket with it instead of the whole corpus.
+#
+# The importer clusters new pairs in the transaction that inserts them.
+# Pairs imported before this existed are clustered with:
+#
+#   python -m api.dedup
+
+DEDUP_THRESHOLD = float(os.getenv('DEDUP_THRESHOLD', '0.8'))
+
+NUM_PERM = 128
+LSH_BANDS = 16              # of NUM_PERM // LSH_BANDS rows each
+SHINGLE_WORDS = 3
+
+# Multiply-shift hash functions, fixed so stored signatures stay comparable
+_random = np.random.RandomState(20180613)
+_MULTIPLIERS = (_random.randint(0, 2 ** 32, NUM_PERM, dtype=np.uint64) << np.uint64(32)
+                | _random.randint(0, 2 ** 32, NUM_PERM, dtype=np.uint64) | np.uint64(1))
+_OFFSETS = (_random.randint(0, 2 ** 32, NUM_PERM, dtype=np.uint64) << np.uint64(32)
+            | _random.randint(0, 2 ** 32, NUM_PERM, dtype=np.uint64))
+
+_WORD_RE = re.compile(r"\w+")
+
+# Pairs that may join a cluster have no labels of their own
+PAIRS_SQL = """
+    SELECT id, question, response, label_count = 0 AS can_join
+    FROM fomc_qna
+    WHERE id = ANY(%s)
+    ORDER BY id
+"""
+
+CANDIDATES_SQL = """
+    SELECT b.band, b.bucket, b.qna_id, m.signature
+    FROM unnest(%s::smallint[], %s::bigint[]) AS k(band, bucket)
+    JOIN qna_lsh_buckets b ON b.band = k.band AND b.bucket = k.bucket
+    JOIN qna_minhash m ON m.qna_id = b.qna_id
+"""
+
+# Pairs that are neither representatives nor duplicates yet
+UNCLUSTERED_SQL = """
+    SELECT q.id
+    FROM fomc_qna q
+    WHERE q.duplicate_of IS NULL
+      AND q.id > %s
+      AND NOT EXISTS (SELECT 1 FROM qna_minhash m WHERE m.qna_id = q.id)
+    ORDER BY q.id
+    LIMIT %s
+"""
+
+
+def shingles(text):
+    """32-bit hashes of the word 3-grams of a text"""
+    words = np.array([zlib.crc32(word.encode('utf-8')) for word in _WORD_RE.findall(text.lower())],
+                     dtype=np.uint64)
+    if len(words) < SHINGLE_WORDS:
+        return words
+    combined = words[:len(words) - SHINGLE_WORDS + 1].copy()
+    for offset in range(1, SHINGLE_WORDS):
+        combined = combined * np.uint64(1000003) + words[offset:len(words) - SHINGLE_WORDS + 1 + offset]
+    return np.unique(combined & np.uint64(0xFFFFFFFF))
+
+
+def signature(text):
+    """MinHash signature (NUM_PERM uint32 values), or None for text without words"""
+    hashes = shingles(text)
+    if not len(hashes):
+        return None
+    # (a * x + b) mod 2^64, top 32 bits, minimum per hash function
+    values = (_MULTIPLIERS[:, None] * hashes[None, :] + _OFFSETS[:, None]) >> np.uint64(32)
+    return values.min(axis=1).astype(np.uint32)
+
+
+def band_buckets(sig):
+    """One signed 64-bit bucket key per LSH band"""
+    rows = NUM_PERM // LSH_BANDS
+    return [int.from_bytes(hashlib.blake2b(sig[band * rows:(band + 1) * rows].tobytes(),
+                                           digest_size=8).digest(), 'big', signed=True)
+            for band in range(LSH_BANDS)]
+
+
+def similarity(sig, candidates):
+    """Estimated Jaccard similarity of one signature with each row of a matrix"""
+    return (candidates == sig).mean(axis=1)
+
+
+def pair_text(question, response):
+    return f"{question or ''}\n{response or ''}"
+
+
+def cluster_pairs(cur, qna_ids):
+    """Cluster the given pairs against the stored representatives and each other
+
+    Runs in the caller's transaction. Returns (representatives, duplicates)
+    added. Duplicates of an already labeled representative take its label
+    right away.
+    """
+    if not qna_ids:
+        return 0, 0
+    cur.execute(PAIRS_SQL, (list(qna_ids),))
+    pairs = []
+    for qna_id, question, response, can_join in cur.fetchall():
+        sig = signature(pair_text(question, response))
+        if sig is not None:
+            pairs.append((qna_id, sig, band_buckets(sig), can_join))
+    if not pairs:
+        return 0, 0
+
+    # Stored representatives sharing a bucket with any of the pairs
+    keys = {(band, bucket) for _, _, buckets, _ in pairs for band, bucket in enumerate(buckets)}
+    bands, buckets = zip(*keys)
+    cur.execute(CANDIDATES_SQL, (list(bands), list(buckets)))
+    known = {}      # representative id -> signature
+    index = {}      # (band, bucket) -> representative ids
+    for band, bucket, qna_id, sig in cur.fetchall():
+        index.setdefault((band, bucket), []).append(qna_id)
+        if qna_id not in known:
+            known[qna_id] = np.frombuffer(bytes(sig), dtype=np.uint32)
+
+    new_representatives = []
+    duplicates = []
+    for qna_id, sig, buckets, can_join in pairs:
+        candidates = sorted({rep for band, bucket in enumerate(buckets)
+                             for rep in index.get((band, bucket), ()) if rep != qna_id})
+        if can_join and candidates:
+            scores = similarity(sig, np.stack([known[rep] for rep in candidates]))
+            best = int(np.argmax(scores))
+            if scores[best] >= DEDUP_THRESHOLD:
+                duplicates.append((qna_id, candidates[best]))
+                continue
+        # A representative of its own; later pairs in this batch can join it
+        known[qna_id] = sig
+        for band, bucket in enumerate(buckets):
+            index.setdefault((band, bucket), []).append(qna_id)
+        new_representatives.append((qna_id, sig, buckets))
+
+    if new_representatives:
+        cur.execute("""
+            INSERT INTO qna_minhash (qna_id, signature)
+            SELECT * FROM unnest(%s::integer[], %s::bytea[])
+            ON CONFLICT (qna_id) DO NOTHING
+        """, ([qna_id for qna_id, _, _ in new_representatives],
+              [sig.tobytes() for _, sig, _ in new_representatives]))
+        cur.execute("""
+            INSERT INTO qna_lsh_buckets (band, bucket, qna_id)
+            SELECT * FROM unnest(%s::smallint[], %s::bigint[], %s::integer[])
+            ON CONFLICT DO NOTHING
+        """, ([band for _ in new_representatives for band in range(LSH_BANDS)],
+              [bucket for _, _, buckets in new_representatives for bucket in buckets],
+              [qna_id for qna_id, _, _ in new_representatives for _ in range(LSH_BANDS)]))
+    if duplicates:
+        cur.execute("""
+            UPDATE fomc_qna AS q
+            SET duplicate_of = v.representative
+            FROM unnest(%s::integer[], %s::integer[]) AS v(id, representative)
+            WHERE q.id = v.id
+        """, ([qna_id for qna_id, _ in duplicates], [rep for _, rep in duplicates]))
+        cur.execute("SELECT qna_propagate_labels(%s::integer[])",
+                    (sorted({rep for _, rep in duplicates}),))
+    return len(new_representatives), len(duplicates)
+
+
+def _cluster_chunk(cur, last_id, chunk_rows):
+    """Cluster the next chunk of unclustered pairs; (ids, cluster_pairs result)"""
+    cur.execute(UNCLUSTERED_SQL, (last_id, chunk_rows))
+    ids = [row[0] for row in cur.fetchall()]
+    return ids, (cluster_pairs(cur, ids) if ids else (0, 0))
+
+
+def cluster_existing(conn, chunk_rows=5000):
+    """Cluster every pair not clustered yet, in id order, one transaction per chunk
+
+    A chunk is retried if labeling moves one of its pairs to the other
+    partition of fomc_qna meanwhile.
+    """
+    from api.db import run_transaction
+
+    started = time.perf_counter()
+    last_id = 0
+    representatives = duplicates = 0
+    while True:
+        ids, (added_representatives, added_duplicates) = run_transaction(
+            conn, lambda cur: _cluster_chunk(cur, last_id, chunk_rows))
+        if not ids:
+            break
+        last_id = ids[-1]
+        representatives += added_representatives
+        duplicates += added_duplicates
+        elapsed = max(time.perf_counter() - started, 1e-9)
+        print(f"Progress: {representatives + duplicates} pairs clustered, {duplicates} duplicates "
+              f"({(representatives + duplicates) / elapsed:.0f} rows/s)")
+    return representatives, duplicates
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cluster near-duplicate QnA pairs")
+    parser.add_argument('--chunk-rows', type=int, default=5000,
+                        help="pairs clustered per transaction (default: 5000)")
+    args = parser.parse_args()
+
+    import psycopg2
+    from api.pool import DB_PARAMS
+
+    conn = psycopg2.connect(**DB_PARAMS)
+    try:
+        representatives, duplicates = cluster_existing(conn, args.chunk_rows)
+    finally:
+        conn.close()
+    print(f"Clustered {representatives + duplicates} QnA pairs: {duplicates} near-duplicates "
+          f"of {representatives} new representatives.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
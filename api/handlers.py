@@ -0,0 +1,290 @@
+import inspect
+import time
+
+from werkzeug.http import quote_etag
+
+from api.cache import cache_stats
+from api.metrics import render_metrics
+from api.payloads import (EMPTY_STATS, STATEMENT_MAX_AGE, parse_count, parse_label,
+                          parse_label_batch, parse_search, parse_my_labels, parse_label_edit)
+from api.pool import REPLICAS
+from api.queries import CLAIM_LEASE_SECONDS
+from api.routing import note_write, use_replica
+
+# Request handling shared by the Flask app (app.py) and the ASGI app
+# (api/asgi.py), so auth checks, validation, status codes and error
+# messages are written once.
+#
+# Like the data-access generators in api.queries, a handler does no I/O of
+# its own: it yields a Call for each data-layer function it needs and
+# returns a Reply. The Flask app drives it with run_handler and api.db,
+# the ASGI app with run_handler_async and api.db_async; an exception from
+# the call is raised inside the handler at its yield. The apps only route,
+# read the request and turn the Reply into a response.
+
+
+class Call:
+    """One call of a data-layer function, looked up by name in api.db or api.db_async"""
+
+    def __init__(self, name, *args, **kwargs):
+        self.name = name
+        self.args = args
+        self.kwargs = kwargs
+
+
+class Reply:
+    """A handler's result: a JSON body (or text with a mimetype), status and extra headers"""
+
+    def __init__(self, body, status=200, headers=None, mimetype=None):
+        self.body = body
+        self.status = status
+        self.headers = headers or {}
+        self.mimetype = mimetype
+
+
+def error(message, status):
+    return Reply({'error': message}, status)
+
+
+def database_error(e):
+    return error(f'Database error: {str(e)}', 500)
+
+
+NOT_AUTHENTICATED = ('User not authenticated', 401)
+
+
+def run_handler(steps, data):
+    """Drive a handler with the synchronous data layer (api.db)"""
+    try:
+        call = next(steps)
+        while True:
+            try:
+                result = getattr(data, call.name)(*call.args, **call.kwargs)
+            except Exception as e:
+                call = steps.throw(e)
+            else:
+                call = steps.send(result)
+    except StopIteration as stop:
+        return stop.value
+
+
+async def run_handler_async(steps, data):
+    """Drive a handler with the asyncio data layer (api.db_async)"""
+    try:
+        call = next(steps)
+        while True:
+            try:
+                result = getattr(data, call.name)(*call.args, **call.kwargs)
+                if inspect.isawaitable(result):
+                    result = await result
+            except Exception as e:
+                call = steps.throw(e)
+            else:
+                call = steps.send(result)
+    except StopIteration as stop:
+        return stop.value
+
+
+def label_page_stats(session):
+    """Statistics shown on /label; EMPTY_STATS if they cannot be read"""
+    try:
+        return (yield Call('get_user_stats', session['user_id'], replica=use_replica(session)))
+    except Exception as e:
+        print(f"Error getting stats: {e}")
+        return EMPTY_STATS
+
+
+def next_qna(session, args):
+    """The next QnA pair, or a batch of them with ?count=N"""
+    if 'user_id' not in session:
+        return error(*NOT_AUTHENTICATED)
+
+    if 'count' in args:
+        count, message = parse_count(args['count'])
+        if message:
+            return error(message, 400)
+        try:
+            items = yield Call('claim_next_qnas', session['user_id'], count)
+        except Exception as e:
+            return database_error(e)
+        # An empty list means there is nothing left to label
+        return Reply({'items': items, 'lease_seconds': CLAIM_LEASE_SECONDS})
+
+    try:
+        qna = yield Call('get_next_unlabeled_qna', session['user_id'])
+    except Exception as e:
+        return database_error(e)
+    if not qna:
+        return error('No more unlabeled QnA pairs available', 404)
+    return Reply(qna)
+
+
+def label_one(session, body):
+    """Label a QnA pair"""
+    if 'user_id' not in session:
+        return error(*NOT_AUTHENTICATED)
+
+    qna_id, label, message = parse_label(body)
+    if message:
+        return error(message, 400)
+
+    try:
+        result = yield Call('label_qna', qna_id, label, session['user_id'])
+    except Exception as e:
+        return database_error(e)
+    note_write(session)
+    return Reply(result)
+
+
+def label_batch(session, body):
+    """Label several QnA pairs at once"""
+    if 'user_id' not in session:
+        return error(*NOT_AUTHENTICATED)
+
+    batch_id, pairs, message = parse_label_batch(body)
+    if message:
+        return error(message, 400)
+
+    try:
+        result = yield Call('label_qna_batch', pairs, session['user_id'], batch_id)
+    except Exception as e:
+        return database_error(e)
+    note_write(session)
+    return Reply(result)
+
+
+def statement(session, statement_id, if_none_match):
+    """Full text of a statement, cacheable by the browser"""
+    if 'user_id' not in session:
+        return error(*NOT_AUTHENTICATED)
+
+    try:
+        found = yield Call('get_statement', statement_id)
+    except Exception as e:
+        return database_error(e)
+    if found is None:
+        return error('Statement not found', 404)
+
+    etag = found.pop('etag')
+    headers = {
+        # Weak, so the same tag matches the gzip and brotli encodings
+        'ETag': quote_etag(etag, weak=True),
+        'Cache-Control': f'private, max-age={STATEMENT_MAX_AGE}',
+    }
+    if if_none_match.contains_weak(etag):
+        return Reply(None, 304, headers)
+    return Reply(found, headers=headers)
+
+
+def stats(session):
+    """The user's labeling statistics"""
+    if 'user_id' not in session:
+        return error(*NOT_AUTHENTICATED)
+
+    try:
+        result = yield Call('get_user_stats', session['user_id'], replica=use_replica(session))
+    except Exception as e:
+        return database_error(e)
+    return Reply(result)
+
+
+def stream_start(session, enabled):
+    """Checks before opening /api/stream/stats; a 200 Reply carries the first stats"""
+    if 'user_id' not in session:
+        return error(*NOT_AUTHENTICATED)
+    if not enabled:
+        return error('Stats stream is disabled', 404)
+    return (yield from stats(session))
+
+
+def search(session, args):
+    """Search QnA pairs (or statements with scope=statements), one keyset page at a time"""
+    if 'user_id' not in session:
+        return error(*NOT_AUTHENTICATED)
+
+    parsed, message = parse_search(args)
+    if message:
+        return error(message, 400)
+
+    scope, params = parsed
+    try:
+        if scope == 'statements':
+            return Reply((yield Call('search_statements', **params)))
+        return Reply((yield Call('search_qna', session['user_id'], **params)))
+    except Exception as e:
+        return database_error(e)
+
+
+def my_labels(session, args):
+    """Page through the user's own labels, newest first"""
+    if 'user_id' not in session:
+        return error(*NOT_AUTHENTICATED)
+
+    before, limit, message = parse_my_labels(args)
+    if message:
+        return error(message, 400)
+
+    try:
+        return Reply((yield Call('get_my_labels', session['user_id'], before=before, limit=limit)))
+    except Exception as e:
+        return database_error(e)
+
+
+def edit(session, qna_id, body):
+    """Change a label the user gave earlier"""
+    if 'user_id' not in session:
+        return error(*NOT_AUTHENTICATED)
+
+    label, message = parse_label_edit(body)
+    if message:
+        return error(message, 400)
+
+    try:
+        result = yield Call('edit_label', qna_id, label, session['user_id'])
+    except Exception as e:
+        return database_error(e)
+    if result is None:
+        return error('You have not labeled this QnA pair', 404)
+    note_write(session)
+    return Reply(result)
+
+
+def agreement(session):
+    """Inter-annotator agreement over all labels"""
+    if 'user_id' not in session:
+        return error(*NOT_AUTHENTICATED)
+
+    try:
+        return Reply((yield Call('get_agreement')))
+    except Exception as e:
+        return database_error(e)
+
+
+def health(args, compile_templates, stream):
+    """Health check
+
+    With ?warm=1 it also opens the pooled connection, fills the caches and
+    compiles the templates, so a scheduled ping keeps an instance ready
+    for the first /api/next_qna after it has been idle.
+    """
+    body = {"status": "ok"}
+    if args.get('warm'):
+        started = time.perf_counter()
+        try:
+            yield Call('warm_up')
+        except Exception as e:
+            return Reply({'status': 'error', 'error': f'Database error: {str(e)}'}, 503)
+        compile_templates()
+        body['warm_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    body.update(pool=(yield Call('get_pool_stats')), cache=cache_stats(), stream=stream)
+    if REPLICAS:
+        body['replicas'] = yield Call('get_replica_stats')
+    return Reply(body)
+
+
+def metrics():
+    """Prometheus metrics for this worker process"""
+    pool = yield Call('get_pool_stats')
+    replicas = (yield Call('get_replica_stats')) if REPLICAS else None
+    return Reply(render_metrics(pool=pool, caches=cache_stats(), replicas=replicas),
+                 mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,33 @@
+import os
+import sys
+
+# Vercel entry point: vercel.json routes every request here.
+#
+# A serverless instance serves one request at a time and is frozen between
+# invocations, so everything set up at import time survives as long as the
+# instance stays warm. Cold starts are kept short:
+#
+#   - the environment comes from the platform, so no .env lookup (VERCEL=1)
+#   - numpy (agreement metrics) is only imported by /api/agreement
+#   - the pool holds a single connection, reused across warm invocations;
+#     one idle longer than DB_POOL_IDLE_CHECK is pinged before reuse
+#     (it may have been dropped while the instance was frozen)
+#   - the live stats stream is off (STATS_STREAM): a function cannot hold
+#     a response open, so the page polls /api/stats instead
+#   - GET /health?warm=1 opens that connection and fills the caches, for
+#     a scheduled ping ahead of the first annotator
+#
+# python -m bench.coldstart measures import and first-request time.
+
+os.environ.setdefault('DB_POOL_MAX', '1')
+os.environ.setdefault('STATS_STREAM', 'false')
+
+_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _root not in sys.path:
+    sys.path.insert(0, _root)
+
+if not os.getenv('SECRET_KEY'):
+    print("SECRET_KEY is not set: sessions will not survive a cold start")
+
+# Imported after the settings above
+from app import app
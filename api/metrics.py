@@ -0,0 +1,239 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Request instrumentation shared by the Flask and ASGI apps.
+#
+# The data-access runners report every query they execute and the pool
+# reports how long each connection checkout waited. Per request this
+# becomes a Server-Timing header and one JSON log line; across requests it
+# is aggregated into Prometheus counters and histograms served on /metrics.
+# Every worker process keeps and serves its own numbers.
+
+# One JSON line per request on stdout; REQUEST_LOG_MIN_MS logs slow requests only
+REQUEST_LOG = os.getenv('REQUEST_LOG', 'true').lower() in ('1', 'true', 'yes')
+REQUEST_LOG_MIN_MS = float(os.getenv('REQUEST_LOG_MIN_MS', '0'))
+
+# Histogram buckets in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class RequestMetrics:
+    """Timings collected while handling one request"""
+
+    __slots__ = ('started', 'queries', 'acquire_seconds', 'acquires')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = []           # (name, seconds) in execution order
+        self.acquire_seconds = 0.0
+        self.acquires = 0
+
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+class Counter:
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._values = {}  # label values -> [bucket counts, sum, count]
+
+    def observe(self, seconds, *label_values):
+        with self._lock:
+            entry = self._values.get(label_values)
+            if entry is None:
+                entry = self._values[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    entry[0][i] += 1
+            entry[1] += seconds
+            entry[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, (counts, total, count) in sorted(self._values.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    labels = _labels(self.labels + ('le',), label_values + (repr(bound),))
+                    lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+                labels = _labels(self.labels + ('le',), label_values + ('+Inf',))
+                lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = _labels(self.labels, label_values)
+                lines.append(f"{self.name}_sum{labels} {total}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                     for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+REQUESTS = Counter('fedspeak_http_requests_total', "HTTP requests handled",
+                   ('endpoint', 'method', 'status'))
+REQUEST_DURATION = Histogram('fedspeak_http_request_duration_seconds',
+                             "Time to handle a request", ('endpoint',))
+REQUEST_QUERIES = Counter('fedspeak_http_request_queries_total',
+                          "Database queries executed on behalf of requests", ('endpoint',))
+QUERY_DURATION = Histogram('fedspeak_db_query_duration_seconds',
+                           "Time to execute a query and fetch its rows", ('query',))
+QUERY_ERRORS = Counter('fedspeak_db_query_errors_total', "Queries that raised an error", ('query',))
+QUERY_PREPARES = Counter('fedspeak_db_statements_prepared_total',
+                         "Server-side prepared statements created on pooled connections", ('query',))
+ACQUIRE_DURATION = Histogram('fedspeak_db_pool_acquire_seconds',
+                             "Time to check a connection out of the pool")
+
+
+@contextmanager
+def timed_query(name):
+    """Time one query execution (including fetching its rows)"""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        QUERY_ERRORS.inc(name)
+        raise
+    finally:
+        seconds = time.perf_counter() - started
+        QUERY_DURATION.observe(seconds, name)
+        metrics = _current.get()
+        if metrics is not None:
+            metrics.queries.append((name, seconds))
+
+
+def record_acquire(seconds):
+    """Record how long a pool checkout took"""
+    ACQUIRE_DURATION.observe(seconds)
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.acquire_seconds += seconds
+        metrics.acquires += 1
+
+
+def begin_request():
+    """Start collecting timings for the request being handled"""
+    _current.set(RequestMetrics())
+
+
+def end_request(endpoint, method, path, status):
+    """Record the finished request; returns the Server-Timing header value"""
+    metrics = _current.get()
+    if metrics is None:
+        return None
+    _current.set(None)
+    endpoint = endpoint or 'unmatched'
+    total = time.perf_counter() - metrics.started
+
+    REQUESTS.inc(endpoint, method, status)
+    REQUEST_DURATION.observe(total, endpoint)
+    if metrics.queries:
+        REQUEST_QUERIES.inc(endpoint, amount=len(metrics.queries))
+
+    # Time per query name, in the order the queries first ran
+    per_query = {}
+    for name, seconds in metrics.queries:
+        per_query[name] = per_query.get(name, 0.0) + seconds
+    db_seconds = sum(per_query.values())
+
+    timings = [f"pool;dur={metrics.acquire_seconds * 1000:.2f}"]
+    timings += [f"{name};dur={seconds * 1000:.2f}" for name, seconds in per_query.items()]
+    timings.append(f'db;dur={db_seconds * 1000:.2f};desc="{len(metrics.queries)} queries"')
+    timings.append(f"total;dur={total * 1000:.2f}")
+
+    if REQUEST_LOG and total * 1000 >= REQUEST_LOG_MIN_MS:
+        print(json.dumps({
+            'event': 'request',
+            'method': method,
+            'path': path,
+            'endpoint': endpoint,
+            'status': status,
+            'duration_ms': round(total * 1000, 2),
+            'db_ms': round(db_seconds * 1000, 2),
+            'acquire_ms': round(metrics.acquire_seconds * 1000, 2),
+            'queries': len(metrics.queries),
+            'query_ms': {name: round(seconds * 1000, 2) for name, seconds in per_query.items()},
+        }), flush=True)
+
+    return ', '.join(timings)
+
+
+# Pool values that go up and down; every other pool value, the replica
+# routing counts and these cache values only ever grow, so they are
+# exported as counters with a _total suffix
+POOL_GAUGES = ('size', 'idle', 'in_use', 'max')
+CACHE_COUNTERS = ('hits', 'shared_hits', 'misses', 'evictions', 'invalidations')
+
+
+def render_metrics(pool=None, caches=None, replicas=None):
+    """Prometheus text exposition of the request and query metrics, pool, cache and replica stats"""
+    lines = []
+    for metric in (REQUESTS, REQUEST_DURATION, REQUEST_QUERIES,
+                   QUERY_DURATION, QUERY_ERRORS, QUERY_PREPARES, ACQUIRE_DURATION):
+        lines += metric.render()
+
+    if pool:
+        for key, value in sorted(pool.items()):
+            if key == 'pid':
+                continue
+            if key in POOL_GAUGES:
+                name = f"fedspeak_db_pool_{key}"
+                lines += [f"# TYPE {name} gauge", f"{name} {value}"]
+            else:
+                name = f"fedspeak_db_pool_{key}_total"
+                lines += [f"# TYPE {name} counter", f"{name} {value}"]
+
+    if replicas:
+        # Read routing counts: replica checkouts, failures and primary fallbacks
+        for key, value in sorted(replicas.items()):
+            if key == 'pools':
+                continue
+            name = f"fedspeak_db_{key}_total"
+            lines += [f"# TYPE {name} counter", f"{name} {value}"]
+        for key in ('size', 'idle', 'in_use'):
+            name = f"fedspeak_db_replica_pool_{key}"
+            lines.append(f"# TYPE {name} gauge")
+            for stats in replicas['pools']:
+                lines.append(f'{name}{{host="{stats["host"]}"}} {stats[key]}')
+
+    if caches:
+        for key in CACHE_COUNTERS:
+            name = f"fedspeak_cache_{key}_total"
+            lines.append(f"# TYPE {name} counter")
+            for cache_name, stats in sorted(caches.items()):
+                lines.append(f'{name}{{cache="{cache_name}"}} {stats[key]}')
+        name = "fedspeak_cache_size"
+        lines.append(f"# TYPE {name} gauge")
+        for cache_name, stats in sorted(caches.items()):
+            lines.append(f'{name}{{cache="{cache_name}"}} {stats["size"]}')
+
+    return '\n'.join(lines) + '\n'
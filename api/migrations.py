@@ -0,0 +1,1059 @@
+import argparse
+import sys
+
+import psycopg2
+
+from api.pool import DB_PARAMS
+
+# Ordered schema migrations; each one is applied once and recorded in
+# schema_migrations. Never edit a migration that has shipped, add a new one.
+MIGRATIONS = [
+    ('0001_label_columns', """
+        ALTER TABLE fomc_qna
+            ADD COLUMN IF NOT EXISTS labeled_by VARCHAR(255),
+            ADD COLUMN IF NOT EXISTS labeled_at TIMESTAMP
+    """),
+    ('0002_claim_queue', """
+        -- Lease columns and a precomputed shuffle key, so work is dispatched
+        -- by walking an index instead of sorting the unlabeled set per request
+        ALTER TABLE fomc_qna
+            ADD COLUMN IF NOT EXISTS claimed_by VARCHAR(255),
+            ADD COLUMN IF NOT EXISTS claim_expires_at TIMESTAMP,
+            ADD COLUMN IF NOT EXISTS shuffle_key DOUBLE PRECISION NOT NULL DEFAULT random();
+
+        CREATE INDEX IF NOT EXISTS fomc_qna_unlabeled_shuffle_idx
+            ON fomc_qna (shuffle_key)
+            WHERE is_labeled = FALSE;
+    """),
+    ('0003_label_batches', """
+        -- Idempotency keys for /api/label_batch, so a retried batch is not
+        -- applied twice
+        CREATE TABLE IF NOT EXISTS label_batches (
+            batch_id VARCHAR(64) PRIMARY KEY,
+            user_id VARCHAR(255) NOT NULL,
+            label_count INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """),
+    ('0004_labeling_stats', """
+        -- Running label counters: one row per annotator plus a global row
+        -- (user_id = ''), kept current by statement-level triggers so stats
+        -- are read from at most two rows instead of COUNT(*) scans
+        CREATE TABLE IF NOT EXISTS labeling_stats (
+            user_id VARCHAR(255) PRIMARY KEY,
+            total BIGINT NOT NULL DEFAULT 0,
+            labeled BIGINT NOT NULL DEFAULT 0,
+            relevant BIGINT NOT NULL DEFAULT 0,
+            irrelevant BIGINT NOT NULL DEFAULT 0
+        );
+
+        -- Add signed row contributions to the global and per-user counters.
+        -- Rows are upserted in user_id order so concurrent writers always
+        -- lock counter rows in the same order.
+        CREATE OR REPLACE FUNCTION labeling_stats_bump(
+            signs INTEGER[], labeled BOOLEAN[], labels BOOLEAN[], users VARCHAR[]
+        ) RETURNS void AS $$
+            INSERT INTO labeling_stats AS s (user_id, total, labeled, relevant, irrelevant)
+            SELECT k.user_id,
+                   SUM(c.sign),
+                   SUM(c.sign * (c.is_labeled IS TRUE)::int),
+                   SUM(c.sign * (c.is_labeled IS TRUE AND c.label IS TRUE)::int),
+                   SUM(c.sign * (c.is_labeled IS TRUE AND c.label IS FALSE)::int)
+            FROM unnest(signs, labeled, labels, users) AS c(sign, is_labeled, label, labeled_by)
+            CROSS JOIN LATERAL (
+                VALUES (''),
+                       (CASE WHEN c.is_labeled THEN c.labeled_by END)
+            ) AS k(user_id)
+            WHERE k.user_id IS NOT NULL
+            GROUP BY k.user_id
+            ORDER BY k.user_id
+            ON CONFLICT (user_id) DO UPDATE
+            SET total = s.total + EXCLUDED.total,
+                labeled = s.labeled + EXCLUDED.labeled,
+                relevant = s.relevant + EXCLUDED.relevant,
+                irrelevant = s.irrelevant + EXCLUDED.irrelevant
+        $$ LANGUAGE sql;
+
+        CREATE OR REPLACE FUNCTION labeling_stats_apply() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                PERFORM labeling_stats_bump(array_agg(1), array_agg(n.is_labeled),
+                                            array_agg(n.label), array_agg(n.labeled_by))
+                FROM new_rows n;
+            ELSIF TG_OP = 'DELETE' THEN
+                PERFORM labeling_stats_bump(array_agg(-1), array_agg(o.is_labeled),
+                                            array_agg(o.label), array_agg(o.labeled_by))
+                FROM old_rows o;
+            ELSE
+                -- Only rows whose labeling state changed count; claims do not
+                PERFORM labeling_stats_bump(array_agg(c.sign), array_agg(c.is_labeled),
+                                            array_agg(c.label), array_agg(c.labeled_by))
+                FROM old_rows o
+                JOIN new_rows n ON n.id = o.id
+                CROSS JOIN LATERAL (
+                    VALUES (-1, o.is_labeled, o.label, o.labeled_by),
+                           (1, n.is_labeled, n.label, n.labeled_by)
+                ) AS c(sign, is_labeled, label, labeled_by)
+                WHERE (o.is_labeled, o.label, o.labeled_by)
+                      IS DISTINCT FROM (n.is_labeled, n.label, n.labeled_by);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        -- Block writers while the counters are backfilled and wired up
+        LOCK TABLE fomc_qna IN SHARE ROW EXCLUSIVE MODE;
+
+        DELETE FROM labeling_stats;
+        INSERT INTO labeling_stats (user_id, total, labeled, relevant, irrelevant)
+        SELECT '',
+               COUNT(*),
+               COUNT(*) FILTER (WHERE is_labeled),
+               COUNT(*) FILTER (WHERE is_labeled AND label),
+               COUNT(*) FILTER (WHERE is_labeled AND NOT label)
+        FROM fomc_qna
+        UNION ALL
+        SELECT labeled_by,
+               COUNT(*),
+               COUNT(*),
+               COUNT(*) FILTER (WHERE label),
+               COUNT(*) FILTER (WHERE NOT label)
+        FROM fomc_qna
+        WHERE is_labeled AND labeled_by IS NOT NULL
+        GROUP BY labeled_by;
+
+        DROP TRIGGER IF EXISTS fomc_qna_stats_insert ON fomc_qna;
+        DROP TRIGGER IF EXISTS fomc_qna_stats_update ON fomc_qna;
+        DROP TRIGGER IF EXISTS fomc_qna_stats_delete ON fomc_qna;
+        CREATE TRIGGER fomc_qna_stats_insert AFTER INSERT ON fomc_qna
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION labeling_stats_apply();
+        CREATE TRIGGER fomc_qna_stats_update AFTER UPDATE ON fomc_qna
+            REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION labeling_stats_apply();
+        CREATE TRIGGER fomc_qna_stats_delete AFTER DELETE ON fomc_qna
+            REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION labeling_stats_apply();
+    """),
+    ('0005_indexes', """
+        -- Joins from statements to their QnA pairs
+        CREATE INDEX IF NOT EXISTS fomc_qna_statement_id_idx
+            ON fomc_qna (statement_id);
+
+        -- Per-annotator counts can be answered by an index-only scan
+        CREATE INDEX IF NOT EXISTS fomc_qna_labeled_by_label_idx
+            ON fomc_qna (labeled_by, label)
+            WHERE is_labeled;
+
+        -- The importer looks statements up by filename
+        CREATE UNIQUE INDEX IF NOT EXISTS fomc_statements_filename_key
+            ON fomc_statements (filename);
+    """),
+    ('0006_import_manifest', """
+        -- Source files seen by the incremental importer. A file is re-read
+        -- only when its mtime/size change, and re-imported only when its
+        -- content hash changes.
+        CREATE TABLE IF NOT EXISTS import_manifest (
+            filename VARCHAR(255) PRIMARY KEY,
+            content_hash CHAR(64) NOT NULL,
+            mtime DOUBLE PRECISION NOT NULL,
+            size BIGINT NOT NULL,
+            statement_id INTEGER REFERENCES fomc_statements(id) ON DELETE CASCADE,
+            imported_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """),
+    ('0007_labeled_at_index', """
+        -- Incremental exports read labels newer than a labeled_at watermark
+        CREATE INDEX IF NOT EXISTS fomc_qna_labeled_at_idx
+            ON fomc_qna (labeled_at)
+            WHERE is_labeled;
+    """),
+    ('0008_statement_queues', """
+        -- Per-statement work queues for the assignment scheduler: the
+        -- unlabeled pairs of each statement in shuffle order, plus running
+        -- per-statement progress kept current by triggers
+        CREATE INDEX IF NOT EXISTS fomc_qna_unlabeled_statement_idx
+            ON fomc_qna (statement_id, shuffle_key)
+            WHERE is_labeled = FALSE;
+
+        CREATE INDEX IF NOT EXISTS fomc_statements_date_idx
+            ON fomc_statements (date, id);
+
+        -- No foreign keys: rows of deleted statements are harmless and the
+        -- triggers must not fail while a statement is being replaced
+        CREATE TABLE IF NOT EXISTS statement_progress (
+            statement_id INTEGER PRIMARY KEY,
+            total BIGINT NOT NULL DEFAULT 0,
+            labeled BIGINT NOT NULL DEFAULT 0,
+            last_dispatched_at TIMESTAMP
+        );
+
+        -- Round-robin order over statements that still have work
+        CREATE INDEX IF NOT EXISTS statement_progress_dispatch_idx
+            ON statement_progress (last_dispatched_at NULLS FIRST, statement_id)
+            WHERE labeled < total;
+
+        -- The statement each annotator is currently working through
+        CREATE TABLE IF NOT EXISTS user_affinity (
+            user_id VARCHAR(255) PRIMARY KEY,
+            statement_id INTEGER NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+
+        -- Same shape as labeling_stats_bump, keyed by statement
+        CREATE OR REPLACE FUNCTION statement_progress_bump(
+            signs INTEGER[], labeled BOOLEAN[], statements INTEGER[]
+        ) RETURNS void AS $$
+            INSERT INTO statement_progress AS p (statement_id, total, labeled)
+            SELECT c.statement_id,
+                   SUM(c.sign),
+                   SUM(c.sign * (c.is_labeled IS TRUE)::int)
+            FROM unnest(signs, labeled, statements) AS c(sign, is_labeled, statement_id)
+            WHERE c.statement_id IS NOT NULL
+            GROUP BY c.statement_id
+            ORDER BY c.statement_id
+            ON CONFLICT (statement_id) DO UPDATE
+            SET total = p.total + EXCLUDED.total,
+                labeled = p.labeled + EXCLUDED.labeled
+        $$ LANGUAGE sql;
+
+        CREATE OR REPLACE FUNCTION statement_progress_apply() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                PERFORM statement_progress_bump(array_agg(1), array_agg(n.is_labeled),
+                                                array_agg(n.statement_id))
+                FROM new_rows n;
+            ELSIF TG_OP = 'DELETE' THEN
+                PERFORM statement_progress_bump(array_agg(-1), array_agg(o.is_labeled),
+                                                array_agg(o.statement_id))
+                FROM old_rows o;
+            ELSE
+                PERFORM statement_progress_bump(array_agg(c.sign), array_agg(c.is_labeled),
+                                                array_agg(c.statement_id))
+                FROM old_rows o
+                JOIN new_rows n ON n.id = o.id
+                CROSS JOIN LATERAL (
+                    VALUES (-1, o.is_labeled, o.statement_id),
+                           (1, n.is_labeled, n.statement_id)
+                ) AS c(sign, is_labeled, statement_id)
+                WHERE (o.is_labeled, o.statement_id)
+                      IS DISTINCT FROM (n.is_labeled, n.statement_id);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        LOCK TABLE fomc_qna IN SHARE ROW EXCLUSIVE MODE;
+
+        DELETE FROM statement_progress;
+        INSERT INTO statement_progress (statement_id, total, labeled)
+        SELECT statement_id, COUNT(*), COUNT(*) FILTER (WHERE is_labeled)
+        FROM fomc_qna
+        WHERE statement_id IS NOT NULL
+        GROUP BY statement_id;
+
+        DROP TRIGGER IF EXISTS fomc_qna_progress_insert ON fomc_qna;
+        DROP TRIGGER IF EXISTS fomc_qna_progress_update ON fomc_qna;
+        DROP TRIGGER IF EXISTS fomc_qna_progress_delete ON fomc_qna;
+        CREATE TRIGGER fomc_qna_progress_insert AFTER INSERT ON fomc_qna
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION statement_progress_apply();
+        CREATE TRIGGER fomc_qna_progress_update AFTER UPDATE ON fomc_qna
+            REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION statement_progress_apply();
+        CREATE TRIGGER fomc_qna_progress_delete AFTER DELETE ON fomc_qna
+            REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION statement_progress_apply();
+    """),
+    ('0009_qna_labels', """
+        -- Every annotator's label is kept. fomc_qna.label/labeled_by/labeled_at
+        -- become a summary maintained by triggers: the majority label (ties go
+        -- to the latest one), and is_labeled once label_count reaches the
+        -- pair's required_labels (the overlap factor).
+        CREATE TABLE IF NOT EXISTS qna_labels (
+            id BIGSERIAL PRIMARY KEY,
+            qna_id INTEGER NOT NULL REFERENCES fomc_qna(id) ON DELETE CASCADE,
+            user_id VARCHAR(255) NOT NULL,
+            label BOOLEAN NOT NULL,
+            labeled_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (qna_id, user_id)
+        );
+
+        -- Agreement is refreshed from labels newer than a watermark
+        CREATE INDEX IF NOT EXISTS qna_labels_labeled_at_idx
+            ON qna_labels (labeled_at);
+
+        ALTER TABLE fomc_qna
+            ADD COLUMN IF NOT EXISTS required_labels SMALLINT NOT NULL DEFAULT 1,
+            ADD COLUMN IF NOT EXISTS label_count SMALLINT NOT NULL DEFAULT 0;
+
+        -- Per-annotator counters now count label rows; the fomc_qna triggers
+        -- only maintain the global row
+        CREATE OR REPLACE FUNCTION user_label_stats_bump(
+            signs INTEGER[], labels BOOLEAN[], users VARCHAR[]
+        ) RETURNS void AS $$
+            INSERT INTO labeling_stats AS s (user_id, total, labeled, relevant, irrelevant)
+            SELECT c.user_id,
+                   SUM(c.sign),
+                   SUM(c.sign),
+                   SUM(c.sign * c.label::int),
+                   SUM(c.sign * (NOT c.label)::int)
+            FROM unnest(signs, labels, users) AS c(sign, label, user_id)
+            GROUP BY c.user_id
+            ORDER BY c.user_id
+            ON CONFLICT (user_id) DO UPDATE
+            SET total = s.total + EXCLUDED.total,
+                labeled = s.labeled + EXCLUDED.labeled,
+                relevant = s.relevant + EXCLUDED.relevant,
+                irrelevant = s.irrelevant + EXCLUDED.irrelevant
+        $$ LANGUAGE sql;
+
+        CREATE OR REPLACE FUNCTION labeling_stats_apply() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                PERFORM labeling_stats_bump(array_agg(1), array_agg(n.is_labeled),
+                                            array_agg(n.label), array_agg(NULL::varchar))
+                FROM new_rows n;
+            ELSIF TG_OP = 'DELETE' THEN
+                PERFORM labeling_stats_bump(array_agg(-1), array_agg(o.is_labeled),
+                                            array_agg(o.label), array_agg(NULL::varchar))
+                FROM old_rows o;
+            ELSE
+                PERFORM labeling_stats_bump(array_agg(c.sign), array_agg(c.is_labeled),
+                                            array_agg(c.label), array_agg(NULL::varchar))
+                FROM old_rows o
+                JOIN new_rows n ON n.id = o.id
+                CROSS JOIN LATERAL (
+                    VALUES (-1, o.is_labeled, o.label),
+                           (1, n.is_labeled, n.label)
+                ) AS c(sign, is_labeled, label)
+                WHERE (o.is_labeled, o.label) IS DISTINCT FROM (n.is_labeled, n.label);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        -- Recompute the summary columns of the given pairs from their labels.
+        -- Rows are locked in id order first so concurrent batches cannot
+        -- deadlock on each other.
+        CREATE OR REPLACE FUNCTION qna_labels_summarize(qna_ids INTEGER[]) RETURNS void AS $$
+            WITH locked AS (
+                SELECT id FROM fomc_qna WHERE id = ANY(qna_ids) ORDER BY id FOR UPDATE
+            ), summary AS (
+                SELECT l.qna_id,
+                       COUNT(*) AS n,
+                       COUNT(*) FILTER (WHERE l.label) AS relevant,
+                       (array_agg(l.label ORDER BY l.labeled_at DESC, l.id DESC))[1] AS latest_label,
+                       (array_agg(l.user_id ORDER BY l.labeled_at DESC, l.id DESC))[1] AS latest_user,
+                       MAX(l.labeled_at) AS labeled_at
+                FROM qna_labels l
+                WHERE l.qna_id IN (SELECT id FROM locked)
+                GROUP BY l.qna_id
+            ), target AS (
+                SELECT k.id, s.n, s.relevant, s.latest_label, s.latest_user, s.labeled_at
+                FROM locked k
+                LEFT JOIN summary s ON s.qna_id = k.id
+            )
+            UPDATE fomc_qna q
+            SET label_count = COALESCE(t.n, 0),
+                is_labeled = COALESCE(t.n, 0) >= q.required_labels,
+                label = CASE WHEN COALESCE(t.n, 0) < q.required_labels THEN NULL
+                             WHEN t.relevant * 2 > t.n THEN TRUE
+                             WHEN t.relevant * 2 < t.n THEN FALSE
+                             ELSE t.latest_label END,
+                labeled_by = CASE WHEN COALESCE(t.n, 0) >= q.required_labels THEN t.latest_user END,
+                labeled_at = CASE WHEN COALESCE(t.n, 0) >= q.required_labels THEN t.labeled_at END,
+                claimed_by = NULL,
+                claim_expires_at = NULL
+            FROM target t
+            WHERE q.id = t.id
+        $$ LANGUAGE sql;
+
+        CREATE OR REPLACE FUNCTION qna_labels_apply() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                PERFORM user_label_stats_bump(array_agg(1), array_agg(n.label), array_agg(n.user_id)),
+                        qna_labels_summarize(array_agg(DISTINCT n.qna_id))
+                FROM new_rows n;
+            ELSIF TG_OP = 'DELETE' THEN
+                PERFORM user_label_stats_bump(array_agg(-1), array_agg(o.label), array_agg(o.user_id)),
+                        qna_labels_summarize(array_agg(DISTINCT o.qna_id))
+                FROM old_rows o;
+            ELSE
+                PERFORM user_label_stats_bump(array_agg(c.sign), array_agg(c.label), array_agg(c.user_id))
+                FROM old_rows o
+                JOIN new_rows n ON n.id = o.id
+                CROSS JOIN LATERAL (
+                    VALUES (-1, o.label, o.user_id),
+                           (1, n.label, n.user_id)
+                ) AS c(sign, label, user_id)
+                WHERE o.label IS DISTINCT FROM n.label;
+                PERFORM qna_labels_summarize(array_agg(DISTINCT n.qna_id))
+                FROM new_rows n;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        LOCK TABLE fomc_qna IN SHARE ROW EXCLUSIVE MODE;
+
+        -- Existing labels become the first label row of their pair
+        INSERT INTO qna_labels (qna_id, user_id, label, labeled_at)
+        SELECT id, labeled_by, label, COALESCE(labeled_at, created_at, CURRENT_TIMESTAMP)
+        FROM fomc_qna
+        WHERE is_labeled AND labeled_by IS NOT NULL AND label IS NOT NULL
+        ON CONFLICT (qna_id, user_id) DO NOTHING;
+
+        UPDATE fomc_qna SET label_count = 1 WHERE is_labeled;
+
+        -- Labels without a known annotator no longer count towards anyone
+        DELETE FROM labeling_stats WHERE user_id <> '';
+        INSERT INTO labeling_stats (user_id, total, labeled, relevant, irrelevant)
+        SELECT user_id, COUNT(*), COUNT(*),
+               COUNT(*) FILTER (WHERE label), COUNT(*) FILTER (WHERE NOT label)
+        FROM qna_labels
+        GROUP BY user_id;
+
+        DROP TRIGGER IF EXISTS qna_labels_insert ON qna_labels;
+        DROP TRIGGER IF EXISTS qna_labels_update ON qna_labels;
+        DROP TRIGGER IF EXISTS qna_labels_delete ON qna_labels;
+        CREATE TRIGGER qna_labels_insert AFTER INSERT ON qna_labels
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION qna_labels_apply();
+        CREATE TRIGGER qna_labels_update AFTER UPDATE ON qna_labels
+            REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION qna_labels_apply();
+        CREATE TRIGGER qna_labels_delete AFTER DELETE ON qna_labels
+            REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION qna_labels_apply();
+    """),
+    ('0010_qna_priority', """
+        -- Written by prioritize.py: the relevance model's predicted
+        -- probability and how uncertain it is (1 at p = 0.5, 0 at p = 0 or 1).
+        -- NULL until a pair has been scored.
+        ALTER TABLE fomc_qna
+            ADD COLUMN IF NOT EXISTS relevance_score REAL,
+            ADD COLUMN IF NOT EXISTS priority REAL;
+
+        -- The uncertainty strategy walks unlabeled pairs most uncertain first;
+        -- unscored pairs follow in shuffle order
+        CREATE INDEX IF NOT EXISTS fomc_qna_unlabeled_priority_idx
+            ON fomc_qna (priority DESC NULLS LAST, shuffle_key)
+            WHERE is_labeled = FALSE;
+
+        -- Claims skip the annotator's own labels with an index lookup
+        -- instead of scanning every label
+        CREATE INDEX IF NOT EXISTS qna_labels_user_idx
+            ON qna_labels (user_id, qna_id);
+    """),
+    ('0011_near_duplicates', """
+        -- Near-duplicate pairs found at import time (api/dedup.py) point at
+        -- their cluster's representative. Only representatives are handed
+        -- out; their summary label is copied to the duplicates.
+        ALTER TABLE fomc_qna
+            ADD COLUMN IF NOT EXISTS duplicate_of INTEGER REFERENCES fomc_qna(id) ON DELETE SET NULL;
+
+        CREATE INDEX IF NOT EXISTS fomc_qna_duplicate_of_idx
+            ON fomc_qna (duplicate_of)
+            WHERE duplicate_of IS NOT NULL;
+
+        -- MinHash signatures of the representatives and their LSH band
+        -- buckets; a new pair is only compared with representatives that
+        -- share a bucket with it
+        CREATE TABLE IF NOT EXISTS qna_minhash (
+            qna_id INTEGER PRIMARY KEY REFERENCES fomc_qna(id) ON DELETE CASCADE,
+            signature BYTEA NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS qna_lsh_buckets (
+            band SMALLINT NOT NULL,
+            bucket BIGINT NOT NULL,
+            qna_id INTEGER NOT NULL REFERENCES qna_minhash(qna_id) ON DELETE CASCADE,
+            PRIMARY KEY (band, bucket, qna_id)
+        );
+        CREATE INDEX IF NOT EXISTS qna_lsh_buckets_qna_id_idx
+            ON qna_lsh_buckets (qna_id);
+
+        -- The dispatch indexes leave duplicates out
+        DROP INDEX IF EXISTS fomc_qna_unlabeled_shuffle_idx;
+        CREATE INDEX fomc_qna_unlabeled_shuffle_idx
+            ON fomc_qna (shuffle_key)
+            WHERE is_labeled = FALSE AND duplicate_of IS NULL;
+        DROP INDEX IF EXISTS fomc_qna_unlabeled_statement_idx;
+        CREATE INDEX fomc_qna_unlabeled_statement_idx
+            ON fomc_qna (statement_id, shuffle_key)
+            WHERE is_labeled = FALSE AND duplicate_of IS NULL;
+        DROP INDEX IF EXISTS fomc_qna_unlabeled_priority_idx;
+        CREATE INDEX fomc_qna_unlabeled_priority_idx
+            ON fomc_qna (priority DESC NULLS LAST, shuffle_key)
+            WHERE is_labeled = FALSE AND duplicate_of IS NULL;
+
+        -- Copy the summary label of the given representatives to their
+        -- duplicates, except duplicates that were labeled themselves
+        CREATE OR REPLACE FUNCTION qna_propagate_labels(representative_ids INTEGER[]) RETURNS void AS $$
+            UPDATE fomc_qna m
+            SET is_labeled = r.is_labeled,
+                label = r.label,
+                labeled_by = r.labeled_by,
+                labeled_at = r.labeled_at
+            FROM fomc_qna r
+            WHERE r.id = ANY(representative_ids)
+              AND m.duplicate_of = r.id
+              AND m.label_count = 0
+              AND (m.is_labeled, m.label, m.labeled_by, m.labeled_at)
+                  IS DISTINCT FROM (r.is_labeled, r.label, r.labeled_by, r.labeled_at)
+        $$ LANGUAGE sql;
+
+        -- As in 0009, followed by propagation to duplicates
+        CREATE OR REPLACE FUNCTION qna_labels_summarize(qna_ids INTEGER[]) RETURNS void AS $$
+            WITH locked AS (
+                SELECT id FROM fomc_qna WHERE id = ANY(qna_ids) ORDER BY id FOR UPDATE
+            ), summary AS (
+                SELECT l.qna_id,
+                       COUNT(*) AS n,
+                       COUNT(*) FILTER (WHERE l.label) AS relevant,
+                       (array_agg(l.label ORDER BY l.labeled_at DESC, l.id DESC))[1] AS latest_label,
+                       (array_agg(l.user_id ORDER BY l.labeled_at DESC, l.id DESC))[1] AS latest_user,
+                       MAX(l.labeled_at) AS labeled_at
+                FROM qna_labels l
+                WHERE l.qna_id IN (SELECT id FROM locked)
+                GROUP BY l.qna_id
+            ), target AS (
+                SELECT k.id, s.n, s.relevant, s.latest_label, s.latest_user, s.labeled_at
+                FROM locked k
+                LEFT JOIN summary s ON s.qna_id = k.id
+            )
+            UPDATE fomc_qna q
+            SET label_count = COALESCE(t.n, 0),
+                is_labeled = COALESCE(t.n, 0) >= q.required_labels,
+                label = CASE WHEN COALESCE(t.n, 0) < q.required_labels THEN NULL
+                             WHEN t.relevant * 2 > t.n THEN TRUE
+                             WHEN t.relevant * 2 < t.n THEN FALSE
+                             ELSE t.latest_label END,
+                labeled_by = CASE WHEN COALESCE(t.n, 0) >= q.required_labels THEN t.latest_user END,
+                labeled_at = CASE WHEN COALESCE(t.n, 0) >= q.required_labels THEN t.labeled_at END,
+                claimed_by = NULL,
+                claim_expires_at = NULL
+            FROM target t
+            WHERE q.id = t.id;
+
+            SELECT qna_propagate_labels(qna_ids);
+        $$ LANGUAGE sql;
+    """),
+    ('0012_search_vectors', """
+        -- Full-text search for /api/search. The vectors are set by row
+        -- triggers whenever the importer inserts or edits text; they fire
+        -- only for UPDATEs that name the text columns, so claims and
+        -- labels do not re-parse it.
+        ALTER TABLE fomc_qna ADD COLUMN IF NOT EXISTS search_vector TSVECTOR;
+        ALTER TABLE fomc_statements ADD COLUMN IF NOT EXISTS search_vector TSVECTOR;
+
+        -- Matches in the question rank above matches in the response
+        CREATE OR REPLACE FUNCTION fomc_qna_search_vector() RETURNS trigger AS $$
+        BEGIN
+            NEW.search_vector := setweight(to_tsvector('english', COALESCE(NEW.question, '')), 'A')
+                              || setweight(to_tsvector('english', COALESCE(NEW.response, '')), 'B');
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        CREATE OR REPLACE FUNCTION fomc_statements_search_vector() RETURNS trigger AS $$
+        BEGIN
+            NEW.search_vector := to_tsvector('english', COALESCE(NEW.content, ''));
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS fomc_qna_search_vector ON fomc_qna;
+        CREATE TRIGGER fomc_qna_search_vector
+            BEFORE INSERT OR UPDATE OF question, response ON fomc_qna
+            FOR EACH ROW EXECUTE FUNCTION fomc_qna_search_vector();
+        DROP TRIGGER IF EXISTS fomc_statements_search_vector ON fomc_statements;
+        CREATE TRIGGER fomc_statements_search_vector
+            BEFORE INSERT OR UPDATE OF content ON fomc_statements
+            FOR EACH ROW EXECUTE FUNCTION fomc_statements_search_vector();
+
+        -- Backfill through the triggers
+        UPDATE fomc_qna SET question = question WHERE search_vector IS NULL;
+        UPDATE fomc_statements SET content = content WHERE search_vector IS NULL;
+
+        CREATE INDEX IF NOT EXISTS fomc_qna_search_idx
+            ON fomc_qna USING GIN (search_vector);
+        CREATE INDEX IF NOT EXISTS fomc_statements_search_idx
+            ON fomc_statements USING GIN (search_vector);
+    """),
+    ('0013_label_review_index', """
+        -- /api/my_labels pages through one annotator's labels, newest first,
+        -- by keyset on (labeled_at, id)
+        CREATE INDEX IF NOT EXISTS qna_labels_user_labeled_at_idx
+            ON qna_labels (user_id, labeled_at, id);
+    """),
+    ('0014_stats_notify', """
+        -- Announce counter changes to /api/stream/stats listeners. The
+        -- payload is a JSON array of the annotators whose row changed (the
+        -- global row changes with nearly every label and is not listed),
+        -- or null if it would not fit in a notification. Delivered on
+        -- commit, once per statement.
+        CREATE OR REPLACE FUNCTION labeling_stats_notify() RETURNS trigger AS $$
+        DECLARE
+            payload TEXT;
+        BEGIN
+            -- An upsert fires the INSERT trigger even if every row was updated
+            IF NOT EXISTS (SELECT 1 FROM new_rows) THEN
+                RETURN NULL;
+            END IF;
+            SELECT COALESCE(json_agg(DISTINCT n.user_id)::text, '[]') INTO payload
+            FROM new_rows n
+            WHERE n.user_id <> '';
+            IF length(payload) > 7000 THEN
+                payload := 'null';
+            END IF;
+            PERFORM pg_notify('labeling_stats', payload);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS labeling_stats_notify_insert ON labeling_stats;
+        DROP TRIGGER IF EXISTS labeling_stats_notify_update ON labeling_stats;
+        CREATE TRIGGER labeling_stats_notify_insert AFTER INSERT ON labeling_stats
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION labeling_stats_notify();
+        CREATE TRIGGER labeling_stats_notify_update AFTER UPDATE ON labeling_stats
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION labeling_stats_notify();
+    """),
+    ('0015_partition_qna', """
+        -- Split fomc_qna by labeling state: LIST partitions on is_labeled,
+        -- fomc_qna_unlabeled (the work that claims, dispatch indexes and
+        -- unlabeled counts touch) and fomc_qna_labeled (the archive). When
+        -- qna_labels_summarize sets is_labeled the row moves to the archive,
+        -- so the hot partition, its indexes and its dead tuples only grow
+        -- with the remaining work. Queries keep using fomc_qna; the planner
+        -- prunes to the partition their is_labeled condition names.
+        --
+        -- A partitioned table can only have unique indexes that include the
+        -- partition key, so the primary key becomes (id, is_labeled) and no
+        -- foreign key can point at fomc_qna any more. Until 0017 restores
+        -- them through fomc_qna_ids, the ON DELETE actions of the dropped
+        -- keys (qna_labels, qna_minhash, duplicate_of) are done by a trigger.
+        -- Needs PostgreSQL 13 or later (row triggers on partitioned tables).
+        LOCK TABLE fomc_qna IN ACCESS EXCLUSIVE MODE;
+
+        UPDATE fomc_qna SET is_labeled = FALSE WHERE is_labeled IS NULL;
+
+        ALTER TABLE fomc_qna RENAME TO fomc_qna_unpartitioned;
+        ALTER SEQUENCE fomc_qna_id_seq OWNED BY NONE;
+
+        CREATE TABLE fomc_qna (
+            LIKE fomc_qna_unpartitioned INCLUDING DEFAULTS INCLUDING CONSTRAINTS
+        ) PARTITION BY LIST (is_labeled);
+        ALTER TABLE fomc_qna ALTER COLUMN is_labeled SET NOT NULL;
+
+        -- Claims rewrite the lease columns of hot rows: leave room on each
+        -- page for HOT updates, and vacuum after 2% of the rows changed
+        -- rather than the default 20%
+        CREATE TABLE fomc_qna_unlabeled PARTITION OF fomc_qna FOR VALUES IN (FALSE)
+            WITH (fillfactor = 90,
+                  autovacuum_vacuum_scale_factor = 0.02,
+                  autovacuum_analyze_scale_factor = 0.02);
+        CREATE TABLE fomc_qna_labeled PARTITION OF fomc_qna FOR VALUES IN (TRUE);
+
+        INSERT INTO fomc_qna SELECT * FROM fomc_qna_unpartitioned;
+
+        -- Takes the triggers and the foreign keys pointing at it along
+        DROP TABLE fomc_qna_unpartitioned CASCADE;
+        ALTER SEQUENCE fomc_qna_id_seq OWNED BY fomc_qna.id;
+
+        ALTER TABLE fomc_qna ADD PRIMARY KEY (id, is_labeled);
+        ALTER TABLE fomc_qna ADD FOREIGN KEY (statement_id) REFERENCES fomc_statements(id);
+
+        -- The indexes of 0005, 0007, 0011 and 0012. The partial ones on
+        -- unlabeled rows are empty on the archive.
+        CREATE INDEX fomc_qna_statement_id_idx ON fomc_qna (statement_id);
+        CREATE INDEX fomc_qna_labeled_by_label_idx
+            ON fomc_qna (labeled_by, label)
+            WHERE is_labeled;
+        CREATE INDEX fomc_qna_labeled_at_idx
+            ON fomc_qna (labeled_at)
+            WHERE is_labeled;
+        CREATE INDEX fomc_qna_duplicate_of_idx
+            ON fomc_qna (duplicate_of)
+            WHERE duplicate_of IS NOT NULL;
+        CREATE INDEX fomc_qna_unlabeled_shuffle_idx
+            ON fomc_qna (shuffle_key)
+            WHERE is_labeled = FALSE AND duplicate_of IS NULL;
+        CREATE INDEX fomc_qna_unlabeled_statement_idx
+            ON fomc_qna (statement_id, shuffle_key)
+            WHERE is_labeled = FALSE AND duplicate_of IS NULL;
+        CREATE INDEX fomc_qna_unlabeled_priority_idx
+            ON fomc_qna (priority DESC NULLS LAST, shuffle_key)
+            WHERE is_labeled = FALSE AND duplicate_of IS NULL;
+        CREATE INDEX fomc_qna_search_idx ON fomc_qna USING GIN (search_vector);
+
+        -- A row moving to the other partition is inserted there again: keep
+        -- its vector instead of parsing the text at every label
+        CREATE OR REPLACE FUNCTION fomc_qna_search_vector() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' AND NEW.search_vector IS NOT NULL THEN
+                RETURN NEW;
+            END IF;
+            NEW.search_vector := setweight(to_tsvector('english', COALESCE(NEW.question, '')), 'A')
+                              || setweight(to_tsvector('english', COALESCE(NEW.response, '')), 'B');
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        -- What the foreign keys to fomc_qna did on delete. A row moving
+        -- between partitions only fires the UPDATE triggers.
+        CREATE OR REPLACE FUNCTION fomc_qna_delete_cascade() RETURNS trigger AS $$
+        BEGIN
+            DELETE FROM qna_labels WHERE qna_id IN (SELECT id FROM old_rows);
+            DELETE FROM qna_minhash WHERE qna_id IN (SELECT id FROM old_rows);
+            UPDATE fomc_qna SET duplicate_of = NULL
+            WHERE duplicate_of IN (SELECT id FROM old_rows);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        CREATE TRIGGER fomc_qna_stats_insert AFTER INSERT ON fomc_qna
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION labeling_stats_apply();
+        CREATE TRIGGER fomc_qna_stats_update AFTER UPDATE ON fomc_qna
+            REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION labeling_stats_apply();
+        CREATE TRIGGER fomc_qna_stats_delete AFTER DELETE ON fomc_qna
+            REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION labeling_stats_apply();
+        CREATE TRIGGER fomc_qna_progress_insert AFTER INSERT ON fomc_qna
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION statement_progress_apply();
+        CREATE TRIGGER fomc_qna_progress_update AFTER UPDATE ON fomc_qna
+            REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION statement_progress_apply();
+        CREATE TRIGGER fomc_qna_progress_delete AFTER DELETE ON fomc_qna
+            REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION statement_progress_apply();
+        CREATE TRIGGER fomc_qna_delete_cascade AFTER DELETE ON fomc_qna
+            REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION fomc_qna_delete_cascade();
+        CREATE TRIGGER fomc_qna_search_vector
+            BEFORE INSERT OR UPDATE OF question, response ON fomc_qna
+            FOR EACH ROW EXECUTE FUNCTION fomc_qna_search_vector();
+
+        ANALYZE fomc_qna;
+    """),
+    ('0016_label_batches_per_user', """
+        -- batch_id comes from the client, so it is only unique per annotator:
+        -- one annotator's batch_id must not mark another's batch a duplicate
+        ALTER TABLE label_batches DROP CONSTRAINT IF EXISTS label_batches_pkey;
+        ALTER TABLE label_batches ADD PRIMARY KEY (user_id, batch_id);
+    """),
+    ('0017_qna_ids', """
+        -- The keys 0015 had to drop, on a non-partitioned table with one row
+        -- per pair: fomc_qna_ids holds the unique id and is what qna_labels,
+        -- qna_minhash and duplicate_of reference again, with their ON DELETE
+        -- actions from before 0015.
+        --
+        -- It also records the partition of each pair, and fomc_qna references
+        -- (id, is_labeled). As the id is unique here, a pair can only be
+        -- stored once in fomc_qna, and only in the partition its id names.
+        --
+        -- Triggers keep the ids in step: a row inserted into fomc_qna, or
+        -- moved to the other partition (which fires the BEFORE INSERT row
+        -- triggers of the new one), upserts its id, and deleting pairs
+        -- deletes their ids, cascading to the references. The key from
+        -- fomc_qna is checked at commit, as the id changes partition before
+        -- its row does; a row stored twice or left behind still fails it.
+        --
+        -- Moving an id locks its row against the key share lock a label or
+        -- signature of the same pair takes to check its key. Those keys are
+        -- checked at commit too: by then a labeling transaction holds the
+        -- fomc_qna rows of its pairs, locked in id order, so it cannot wait
+        -- on an id that a transaction waiting on it has moved.
+        LOCK TABLE fomc_qna, qna_labels, qna_minhash IN ACCESS EXCLUSIVE MODE;
+
+        CREATE TABLE fomc_qna_ids (
+            id INTEGER PRIMARY KEY,
+            is_labeled BOOLEAN NOT NULL,
+            UNIQUE (id, is_labeled)
+        );
+        -- Fails if 0015 let an id be stored twice
+        INSERT INTO fomc_qna_ids (id, is_labeled)
+        SELECT id, is_labeled FROM fomc_qna;
+
+        -- References to pairs deleted since 0015 get the action their key
+        -- would have taken
+        DELETE FROM qna_labels l
+        WHERE NOT EXISTS (SELECT 1 FROM fomc_qna_ids i WHERE i.id = l.qna_id);
+        DELETE FROM qna_minhash m
+        WHERE NOT EXISTS (SELECT 1 FROM fomc_qna_ids i WHERE i.id = m.qna_id);
+        UPDATE fomc_qna d SET duplicate_of = NULL
+        WHERE duplicate_of IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM fomc_qna_ids i WHERE i.id = d.duplicate_of);
+
+        ALTER TABLE fomc_qna ADD FOREIGN KEY (id, is_labeled)
+            REFERENCES fomc_qna_ids (id, is_labeled) ON DELETE CASCADE
+            DEFERRABLE INITIALLY DEFERRED;
+        ALTER TABLE qna_labels ADD FOREIGN KEY (qna_id)
+            REFERENCES fomc_qna_ids (id) ON DELETE CASCADE
+            DEFERRABLE INITIALLY DEFERRED;
+        ALTER TABLE qna_minhash ADD FOREIGN KEY (qna_id)
+            REFERENCES fomc_qna_ids (id) ON DELETE CASCADE
+            DEFERRABLE INITIALLY DEFERRED;
+        ALTER TABLE fomc_qna ADD FOREIGN KEY (duplicate_of)
+            REFERENCES fomc_qna_ids (id) ON DELETE SET NULL;
+
+        CREATE OR REPLACE FUNCTION fomc_qna_ids_upsert() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO fomc_qna_ids (id, is_labeled)
+            VALUES (NEW.id, NEW.is_labeled)
+            ON CONFLICT (id) DO UPDATE SET is_labeled = EXCLUDED.is_labeled
+            WHERE fomc_qna_ids.is_labeled <> EXCLUDED.is_labeled;
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        -- Replaces the ON DELETE actions 0015 did by hand: the keys do them
+        CREATE OR REPLACE FUNCTION fomc_qna_delete_cascade() RETURNS trigger AS $$
+        BEGIN
+            DELETE FROM fomc_qna_ids WHERE id IN (SELECT id FROM old_rows);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        CREATE TRIGGER fomc_qna_ids_upsert BEFORE INSERT ON fomc_qna
+            FOR EACH ROW EXECUTE FUNCTION fomc_qna_ids_upsert();
+    """),
+]
+
+# Exact counters: the global row from the pairs, the per-annotator rows
+# from the individual labels
+EXACT_STATS_SQL = """
+    SELECT '' AS user_id,
+           COUNT(*) AS total,
+           COUNT(*) FILTER (WHERE is_labeled) AS labeled,
+           COUNT(*) FILTER (WHERE is_labeled AND label) AS relevant,
+           COUNT(*) FILTER (WHERE is_labeled AND NOT label) AS irrelevant
+    FROM fomc_qna
+    UNION ALL
+    SELECT user_id, COUNT(*), COUNT(*),
+           COUNT(*) FILTER (WHERE label),
+           COUNT(*) FILTER (WHERE NOT label)
+    FROM qna_labels
+    GROUP BY user_id
+"""
+
+# Exact per-statement counts for statement_progress
+EXACT_PROGRESS_SQL = """
+    SELECT statement_id, COUNT(*) AS total, COUNT(*) FILTER (WHERE is_labeled) AS labeled
+    FROM fomc_qna
+    WHERE statement_id IS NOT NULL
+    GROUP BY statement_id
+"""
+
+def apply_migrations(conn):
+    """Apply any pending migrations, each in its own transaction"""
+    conn.autocommit = False
+    applied = []
+    with conn.cursor() as cur:
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            name VARCHAR(255) PRIMARY KEY,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """)
+        conn.commit()
+
+        for name, sql in MIGRATIONS:
+            try:
+                # Serialise concurrent runners (e.g. several workers starting up)
+                cur.execute("SELECT pg_advisory_xact_lock(hashtext('schema_migrations'))")
+                cur.execute("SELECT 1 FROM schema_migrations WHERE name = %s", (name,))
+                if cur.fetchone():
+                    conn.commit()
+                    continue
+
+                cur.execute(sql)
+                cur.execute("INSERT INTO schema_migrations (name) VALUES (%s)", (name,))
+                conn.commit()
+                applied.append(name)
+                print(f"Applied migration {name}")
+            except Exception as e:
+                conn.rollback()
+                print(f"Error applying migration {name}: {e}")
+                raise
+    return applied
+
+def _hot_queries():
+    """Queries on the request path, with representative parameters"""
+    from api.queries import APPLY_LABELS_SQL, READ_STATS_SQL
+    from api.scheduler import (CLAIM_NEXT_QNA_SQL, ROUND_ROBIN_CLAIM_SQL,
+                               OLDEST_FIRST_CLAIM_SQL, AFFINITY_CLAIM_SQL,
+                               UNCERTAINTY_CLAIM_SQL)
+    from api.search import SEARCH_QNA_SQL, SEARCH_STATEMENTS_SQL
+    from api.review import MY_LABELS_SQL, EDIT_LABEL_SQL
+
+    claim_params = {'user_id': 'plan-check', 'count': 5, 'per_statement': 5, 'lease_seconds': 600}
+    search_params = {'q': 'balance sheet runoff', 'after_rank': None, 'after_id': 0, 'limit': 21}
+    return [
+        ('claim next QnA', CLAIM_NEXT_QNA_SQL, dict(claim_params, start=0.5, exclude=[])),
+        ('claim round robin', ROUND_ROBIN_CLAIM_SQL, dict(claim_params, per_statement=1)),
+        ('claim oldest first', OLDEST_FIRST_CLAIM_SQL, claim_params),
+        ('claim affinity', AFFINITY_CLAIM_SQL, claim_params),
+        ('claim most uncertain', UNCERTAINTY_CLAIM_SQL, claim_params),
+        ('apply labels', APPLY_LABELS_SQL, {
+            'user_id': 'plan-check', 'ids': [1], 'labels': [True],
+        }),
+        ('read stats', READ_STATS_SQL, {'user_ids': ['', 'plan-check']}),
+        ('search QnA', SEARCH_QNA_SQL['rank'], dict(search_params, user_id='plan-check',
+                                                    unlabeled=True)),
+        ('search statements', SEARCH_STATEMENTS_SQL['rank'], search_params),
+        ('my labels', MY_LABELS_SQL, {
+            'user_id': 'plan-check', 'before_at': None, 'before_id': 0, 'limit': 51,
+        }),
+        ('edit label', EDIT_LABEL_SQL, {'user_id': 'plan-check', 'qna_id': 1, 'label': True}),
+        ('user label counts', """
+            SELECT label, COUNT(*) FROM fomc_qna
+            WHERE is_labeled AND labeled_by = %s
+            GROUP BY label
+        """, ('plan-check',)),
+        ('statement by filename', """
+            SELECT id FROM fomc_statements WHERE filename = %s
+        """, ('FOMCpresconf20180613.json',)),
+    ]
+
+def _seq_scans(plan):
+    """Relations read by sequential scans anywhere in an EXPLAIN plan"""
+    found = []
+    nodes = [plan]
+    while nodes:
+        node = nodes.pop()
+        if node.get('Node Type') == 'Seq Scan':
+            found.append(node.get('Relation Name'))
+        nodes.extend(node.get('Plans', []))
+    return found
+
+def check_query_plans(conn):
+    """Return (name, relations) for hot queries that still need a seq scan
+
+    Sequential scans are disabled for the check, so on a small development
+    table the planner still picks an index whenever a usable one exists.
+    """
+    failures = []
+    conn.autocommit = False
+    with conn.cursor() as cur:
+        try:
+            cur.execute("SET LOCAL enable_seqscan = off")
+            for name, sql, params in _hot_queries():
+                cur.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+                plan = cur.fetchone()[0][0]['Plan']
+                scans = _seq_scans(plan)
+                if scans:
+                    failures.append((name, scans))
+        finally:
+            conn.rollback()
+    return failures
+
+def check_labeling_stats(conn, rebuild=False):
+    """Compare the labeling_stats counters with exact counts, optionally fixing them"""
+    conn.autocommit = False
+    with conn.cursor() as cur:
+        try:
+            if rebuild:
+                cur.execute("LOCK TABLE fomc_qna, qna_labels IN SHARE ROW EXCLUSIVE MODE")
+            cur.execute(EXACT_STATS_SQL)
+            exact = {row[0]: row[1:] for row in cur.fetchall()}
+            cur.execute("SELECT user_id, total, labeled, relevant, irrelevant FROM labeling_stats")
+            stored = {row[0]: row[1:] for row in cur.fetchall()}
+
+            drift = sorted(user_id for user_id in set(exact) | set(stored)
+                           if exact.get(user_id, (0, 0, 0, 0)) != stored.get(user_id, (0, 0, 0, 0)))
+
+            if rebuild and drift:
+                cur.execute("DELETE FROM labeling_stats")
+                cur.execute("""
+                    INSERT INTO labeling_stats (user_id, total, labeled, relevant, irrelevant)
+                """ + EXACT_STATS_SQL)
+                conn.commit()
+            else:
+                conn.rollback()
+            return drift
+        except Exception:
+            conn.rollback()
+            raise
+
+def check_statement_progress(conn, rebuild=False):
+    """Compare statement_progress with exact counts, optionally fixing it
+
+    Dispatch times are kept when rebuilding.
+    """
+    conn.autocommit = False
+    with conn.cursor() as cur:
+        try:
+            if rebuild:
+                cur.execute("LOCK TABLE fomc_qna IN SHARE ROW EXCLUSIVE MODE")
+            cur.execute(EXACT_PROGRESS_SQL)
+            exact = {row[0]: row[1:] for row in cur.fetchall()}
+            cur.execute("SELECT statement_id, total, labeled FROM statement_progress")
+            stored = {row[0]: row[1:] for row in cur.fetchall()}
+
+            drift = sorted(statement_id for statement_id in set(exact) | set(stored)
+                           if exact.get(statement_id, (0, 0)) != stored.get(statement_id, (0, 0)))
+
+            if rebuild and drift:
+                cur.execute("""
+                    UPDATE statement_progress SET total = 0, labeled = 0
+                    WHERE statement_id <> ALL(%s)
+                """, (list(exact),))
+                cur.execute("""
+                    INSERT INTO statement_progress AS p (statement_id, total, labeled)
+                """ + EXACT_PROGRESS_SQL + """
+                    ON CONFLICT (statement_id) DO UPDATE
+                    SET total = EXCLUDED.total, labeled = EXCLUDED.labeled
+                """)
+                conn.commit()
+            else:
+                conn.rollback()
+            return drift
+        except Exception:
+            conn.rollback()
+            raise
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply schema migrations and check the hot query plans")
+    parser.add_argument('--check', action='store_true',
+                        help="also verify the counters match the data")
+    parser.add_argument('--rebuild-stats', action='store_true',
+                        help="recompute labeling_stats and statement_progress if they have drifted")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(**DB_PARAMS)
+    try:
+        applied = apply_migrations(conn)
+        if not applied:
+            print("Schema is up to date.")
+
+        # Run on every migration, so a migration or query change that loses
+        # an index fails the deploy step instead of slowing down production
+        ok = True
+        for name, scans in check_query_plans(conn):
+            ok = False
+            print(f"Sequential scan in '{name}' on: {', '.join(scans)}")
+        if args.check or args.rebuild_stats:
+            drift = check_labeling_stats(conn, rebuild=args.rebuild_stats)
+            if drift:
+                action = "Rebuilt" if args.rebuild_stats else "Drifted"
+                ok = ok and args.rebuild_stats
+                print(f"{action} labeling_stats rows: {', '.join(repr(u) for u in drift)}")
+            drift = check_statement_progress(conn, rebuild=args.rebuild_stats)
+            if drift:
+                action = "Rebuilt" if args.rebuild_stats else "Drifted"
+                ok = ok and args.rebuild_stats
+                print(f"{action} statement_progress rows for {len(drift)} statements")
+        if ok:
+            print("All checks passed." if args.check else "Query plans use their indexes.")
+        return 0 if ok else 1
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+import os
+
+from api.queries import MAX_LABEL_BATCH
+from api.review import FIRST_PAGE, parse_cursor
+from api.search import SEARCH_SCOPES, SEARCH_SORTS
+
+# Request validation shared by the Flask app and the ASGI app, so both
+# reject the same inputs with the same messages. Each parser returns its
+# values followed by an error message (None when the input is valid).
+
+# How long browsers may reuse a statement text before revalidating its ETag
+STATEMENT_MAX_AGE = int(os.getenv('STATEMENT_MAX_AGE', '86400'))
+
+# Page size limits for /api/search
+SEARCH_PAGE_SIZE = 20
+MAX_SEARCH_PAGE_SIZE = 100
+MAX_SEARCH_QUERY_LENGTH = 200
+
+# Page size limits for /api/my_labels
+REVIEW_PAGE_SIZE = 50
+MAX_REVIEW_PAGE_SIZE = 200
+
+# Shown on /label when the stats cannot be loaded
+EMPTY_STATS = {
+    'user': {'total': 0, 'relevant': 0, 'irrelevant': 0},
+    'overall': {'total': 0, 'labeled': 0, 'unlabeled': 0}
+}
+
+def parse_count(value):
+    """Parse the ?count= argument of /api/next_qna"""
+    try:
+        count = int(value)
+    except ValueError:
+        return None, 'count must be an integer'
+    if count < 1:
+        return None, 'count must be at least 1'
+    return count, None
+
+def parse_label(data):
+    """Parse the body of /api/label_qna"""
+    data = data or {}
+    qna_id = data.get('qna_id')
+    label = data.get('label')
+
+    if not qna_id or label is None:
+        return None, None, 'Missing qna_id or label'
+    # psycopg2 would cast "12" or 1 but asyncpg rejects them: check here so
+    # both apps answer 400
+    if not isinstance(qna_id, int) or not isinstance(label, bool):
+        return None, None, 'qna_id must be an integer and label a boolean'
+    return qna_id, label, None
+
+def parse_label_batch(data):
+    """Parse the body of /api/label_batch into (batch_id, [(qna_id, label)])"""
+    data = data or {}
+    batch_id = data.get('batch_id')
+    labels = data.get('labels')
+
+    if not batch_id or not isinstance(batch_id, str) or len(batch_id) > 64:
+        return None, None, 'Missing or invalid batch_id'
+    if not isinstance(labels, list) or len(labels) > MAX_LABEL_BATCH:
+        return None, None, f'labels must be a list of at most {MAX_LABEL_BATCH} items'
+
+    pairs = []
+    for item in labels:
+        qna_id = item.get('qna_id') if isinstance(item, dict) else None
+        label = item.get('label') if isinstance(item, dict) else None
+        if not isinstance(qna_id, int) or not isinstance(label, bool):
+            return None, None, 'Each label needs an integer qna_id and a boolean label'
+        pairs.append((qna_id, label))
+    return batch_id, pairs, None
+
+def parse_search(args):
+    """Parse the query string of /api/search into keyword arguments for the search"""
+    text = (args.get('q') or '').strip()
+    if not text:
+        return None, 'Missing search query q'
+    if len(text) > MAX_SEARCH_QUERY_LENGTH:
+        return None, f'q must be at most {MAX_SEARCH_QUERY_LENGTH} characters'
+
+    scope = args.get('scope', 'qna')
+    if scope not in SEARCH_SCOPES:
+        return None, f"scope must be one of: {', '.join(SEARCH_SCOPES)}"
+    sort = args.get('sort', 'rank')
+    if sort not in SEARCH_SORTS:
+        return None, f"sort must be one of: {', '.join(SEARCH_SORTS)}"
+
+    try:
+        limit = int(args.get('limit', SEARCH_PAGE_SIZE))
+    except ValueError:
+        return None, 'limit must be an integer'
+    if not 1 <= limit <= MAX_SEARCH_PAGE_SIZE:
+        return None, f'limit must be between 1 and {MAX_SEARCH_PAGE_SIZE}'
+
+    # The cursor of the previous page
+    after = (None, 0)
+    cursor = args.get('after')
+    if cursor:
+        try:
+            if sort == 'rank':
+                rank, qna_id = cursor.split(':')
+                after = (float(rank), int(qna_id))
+            else:
+                after = (None, int(cursor))
+        except ValueError:
+            return None, 'Invalid cursor in after'
+
+    search = {'text': text, 'sort': sort, 'after': after, 'limit': limit}
+    if scope == 'qna':
+        search['unlabeled'] = args.get('unlabeled', '').lower() in ('1', 'true', 'yes')
+    return (scope, search), None
+
+def parse_my_labels(args):
+    """Parse the query string of /api/my_labels into (before, limit)"""
+    try:
+        limit = int(args.get('limit', REVIEW_PAGE_SIZE))
+    except ValueError:
+        return None, None, 'limit must be an integer'
+    if not 1 <= limit <= MAX_REVIEW_PAGE_SIZE:
+        return None, None, f'limit must be between 1 and {MAX_REVIEW_PAGE_SIZE}'
+
+    # The cursor of the previous page
+    before = FIRST_PAGE
+    cursor = args.get('before')
+    if cursor:
+        try:
+            before = parse_cursor(cursor)
+        except ValueError:
+            return None, None, 'Invalid cursor in before'
+    return before, limit, None
+
+def parse_label_edit(data):
+    """Parse the body of POST /api/my_labels/<qna_id>"""
+    label = (data or {}).get('label')
+    if not isinstance(label, bool):
+        return None, 'label must be true or false'
+    return label, None
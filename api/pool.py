@@ -0,0 +1,321 @@
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+
+from api.metrics import record_acquire
+
+# Load environment variables. On Vercel they are set by the platform, so
+# cold starts skip importing dotenv and searching for a .env file.
+if not os.getenv('VERCEL'):
+    from dotenv import load_dotenv
+    load_dotenv()
+
+# Database configuration from environment variables
+DB_PARAMS = {
+    'host': os.getenv('DB_HOST'),
+    'port': os.getenv('DB_PORT'),
+    'database': os.getenv('DB_NAME'),
+    'user': os.getenv('DB_USER'),
+    'password': os.getenv('DB_PASSWORD')
+}
+
+# Pool configuration. Every gunicorn worker holds its own pool, so the
+# server-wide connection count is at most workers * DB_POOL_MAX.
+POOL_MAX = int(os.getenv('DB_POOL_MAX', '5'))
+POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))            # seconds to wait for a free connection
+POOL_MAX_LIFETIME = float(os.getenv('DB_POOL_MAX_LIFETIME', '1800'))  # recycle connections older than this
+POOL_IDLE_CHECK = float(os.getenv('DB_POOL_IDLE_CHECK', '30'))      # ping connections idle longer than this
+
+# Optional read replicas: DB_REPLICA_HOSTS=host[:port],... with the same
+# database and credentials as the primary. Reads that may lag a little
+# (get_conn(replica=True)) go to them in turn; writes and claims always use
+# the primary. A replica that cannot be reached is skipped for
+# DB_REPLICA_RETRY seconds and its reads fall back to the next one, then to
+# the primary.
+def _parse_replica_hosts(value):
+    replicas = []
+    for entry in filter(None, (part.strip() for part in value.split(','))):
+        host, _, port = entry.rpartition(':') if ':' in entry else (entry, '', '')
+        replicas.append({'host': host, 'port': port or DB_PARAMS['port']})
+    return replicas
+
+REPLICAS = _parse_replica_hosts(os.getenv('DB_REPLICA_HOSTS', ''))
+REPLICA_RETRY = float(os.getenv('DB_REPLICA_RETRY', '30'))
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes available within the pool timeout"""
+
+
+class ConnectionPool:
+    """Thread-safe pool of autocommit psycopg2 connections"""
+
+    def __init__(self, params, maxconn=POOL_MAX, timeout=POOL_TIMEOUT,
+                 max_lifetime=POOL_MAX_LIFETIME, idle_check=POOL_IDLE_CHECK):
+        self.params = params
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.idle_check = idle_check
+        self.pid = os.getpid()
+
+        self._cond = threading.Condition()
+        self._idle = []       # stack of (conn, created_at, returned_at), most recently used last
+        self._created = {}    # id(conn) -> creation time, for every open connection
+        self._counters = {
+            'connections_opened': 0,
+            'connections_closed': 0,
+            'connections_recycled': 0,
+            'health_check_failures': 0,
+            'checkouts': 0,
+            'waits': 0,
+            'timeouts': 0,
+        }
+
+    def _connect(self):
+        """Open a new connection; caller must already hold a slot in _created"""
+        conn = psycopg2.connect(**self.params)
+        conn.autocommit = True  # Automatically commit changes
+        return conn
+
+    def _close(self, conn):
+        self._counters['connections_closed'] += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_healthy(self, conn, returned_at):
+        """Check an idle connection before handing it out; called without the lock held"""
+        if conn.closed:
+            return False
+        if time.monotonic() - returned_at < self.idle_check:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        """Borrow a connection, opening a new one if the pool has spare capacity"""
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self._cond:
+                while not self._idle:
+                    if len(self._created) < self.maxconn:
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._counters['timeouts'] += 1
+                        raise PoolTimeout(f"No database connection available after {self.timeout}s")
+                    self._counters['waits'] += 1
+                    self._cond.wait(remaining)
+                if not self._idle:
+                    # Reserve the slot before releasing the lock to connect
+                    placeholder = object()
+                    self._created[id(placeholder)] = None
+                    break
+                # The popped connection keeps its slot while it is checked
+                conn, created_at, returned_at = self._idle.pop()
+
+            # Pinged outside the lock, so a slow or half-dead connection only
+            # holds up this thread
+            recycle = time.monotonic() - created_at > self.max_lifetime
+            closed = conn.closed
+            healthy = not recycle and self._is_healthy(conn, returned_at)
+            with self._cond:
+                if healthy:
+                    self._counters['checkouts'] += 1
+                    return conn
+                if recycle:
+                    self._counters['connections_recycled'] += 1
+                elif not closed:
+                    self._counters['health_check_failures'] += 1
+                self._created.pop(id(conn), None)
+                self._close(conn)
+                self._cond.notify()
+
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._created.pop(id(placeholder), None)
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            self._created.pop(id(placeholder), None)
+            self._created[id(conn)] = time.monotonic()
+            self._counters['connections_opened'] += 1
+            self._counters['checkouts'] += 1
+        return conn
+
+    def putconn(self, conn, discard=False):
+        """Return a borrowed connection, closing it if it is broken or too old"""
+        if not discard and not conn.closed:
+            status = conn.info.transaction_status
+            if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                discard = True
+            elif status != extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                    conn.autocommit = True
+                except psycopg2.Error:
+                    discard = True
+
+        with self._cond:
+            created_at = self._created.get(id(conn))
+            if created_at is None:
+                # Not ours (or already closed by closeall)
+                self._close(conn)
+                return
+            now = time.monotonic()
+            if discard or conn.closed:
+                self._created.pop(id(conn))
+                self._close(conn)
+            elif now - created_at > self.max_lifetime:
+                self._created.pop(id(conn))
+                self._counters['connections_recycled'] += 1
+                self._close(conn)
+            else:
+                self._idle.append((conn, created_at, now))
+            self._cond.notify()
+
+    def closeall(self):
+        """Close every idle connection and forget the ones still borrowed"""
+        with self._cond:
+            for conn, _, _ in self._idle:
+                self._close(conn)
+            self._idle = []
+            self._created = {}
+            self._cond.notify_all()
+
+    def stats(self):
+        """Snapshot of pool usage for monitoring"""
+        with self._cond:
+            size = len(self._created)
+            idle = len(self._idle)
+            return dict(self._counters,
+                        pid=self.pid,
+                        size=size,
+                        idle=idle,
+                        in_use=size - idle,
+                        max=self.maxconn)
+
+
+_pools = {}     # 'primary' or 'replica<N>' -> pool of this process
+_pool_lock = threading.Lock()
+# Pools inherited across a fork are kept referenced so their sockets, which
+# the parent process still uses, are never closed by garbage collection here.
+_inherited_pools = []
+
+_replica_turn = itertools.count()
+_replica_down_until = {}    # pool key -> monotonic time to try it again
+_routing = {'replica_checkouts': 0, 'replica_failures': 0, 'primary_fallbacks': 0}
+
+
+def _get_pool(key, params):
+    pool = _pools.get(key)
+    if pool is not None and pool.pid == os.getpid():
+        return pool
+    with _pool_lock:
+        pool = _pools.get(key)
+        if pool is not None and pool.pid != os.getpid():
+            _inherited_pools.append(pool)
+            pool = None
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(params)
+        return pool
+
+
+def get_pool():
+    """Return this process's pool of primary connections, re-creating it after a fork"""
+    return _get_pool('primary', DB_PARAMS)
+
+
+def get_replica_pools():
+    """(key, pool) for every configured replica, in DB_REPLICA_HOSTS order"""
+    return [(f'replica{i}', _get_pool(f'replica{i}', dict(DB_PARAMS, **replica)))
+            for i, replica in enumerate(REPLICAS)]
+
+
+def reset_pool():
+    """Drop the current pools, e.g. from a gunicorn post_fork hook"""
+    with _pool_lock:
+        for pool in _pools.values():
+            if pool.pid == os.getpid():
+                pool.closeall()
+            else:
+                _inherited_pools.append(pool)
+        _pools.clear()
+        _replica_down_until.clear()
+
+
+def get_pool_stats():
+    """Return pool statistics for the current process"""
+    return get_pool().stats()
+
+
+def get_replica_stats():
+    """Replica pools and read routing counters for the current process"""
+    with _pool_lock:
+        routing = dict(_routing)
+    return dict(routing, pools=[dict(pool.stats(), host=pool.params['host'])
+                                for _, pool in get_replica_pools()])
+
+
+def _count(counter):
+    with _pool_lock:
+        _routing[counter] += 1
+
+
+def _checkout(replica):
+    """(pool, connection) from a replica if asked and one is available, else the primary"""
+    if replica and REPLICAS:
+        pools = get_replica_pools()
+        start = next(_replica_turn)
+        for i in range(len(pools)):
+            key, pool = pools[(start + i) % len(pools)]
+            if _replica_down_until.get(key, 0) > time.monotonic():
+                continue
+            try:
+                conn = pool.getconn()
+            except psycopg2.OperationalError as e:
+                print(f"Error connecting to replica {pool.params['host']}: {e}")
+                _replica_down_until[key] = time.monotonic() + REPLICA_RETRY
+                _count('replica_failures')
+                continue
+            _count('replica_checkouts')
+            return pool, conn
+        _count('primary_fallbacks')
+    pool = get_pool()
+    return pool, pool.getconn()
+
+
+@contextmanager
+def get_conn(replica=False):
+    """Borrow a pooled connection for the duration of a with-block
+
+    With replica=True the connection may come from a read replica, so only
+    use it for reads that can be slightly behind the primary.
+    """
+    started = time.perf_counter()
+    pool, conn = _checkout(replica)
+    record_acquire(time.perf_counter() - started)
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        pool.putconn(conn, discard=True)
+        raise
+    except BaseException:
+        pool.putconn(conn)
+        raise
+    else:
+        pool.putconn(conn)
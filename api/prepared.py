@@ -0,0 +1,97 @@
+import hashlib
+import os
+import weakref
+from functools import lru_cache
+
+from psycopg2 import errors, extensions
+
+from api.metrics import QUERY_PREPARES
+from api.queries import numbered_sql
+
+# Server-side prepared statements for the sync runner.
+#
+# Every Query the data-access generators yield is a named, fixed SQL text,
+# so each one maps to one prepared statement. The statement is created with
+# PREPARE the first time a pooled connection runs it, and every later call
+# on that connection runs EXECUTE: PostgreSQL parses and analyses the query
+# once per connection instead of once per call, and after a few executions
+# it can settle on a cached generic plan. Run python -m bench.prepared to
+# measure the difference.
+#
+# asyncpg prepares and caches statements on its own, so the ASGI app gets
+# the same effect without this module.
+#
+# Behind a transaction-mode pooler such as PgBouncer (before 1.21), a
+# session's prepared statements are not guaranteed to exist on the next
+# transaction: set DB_PREPARE_STATEMENTS=false there.
+
+PREPARE_STATEMENTS = os.getenv('DB_PREPARE_STATEMENTS', 'true').lower() in ('1', 'true', 'yes')
+
+# Statements that can be prepared; transaction control cannot
+PREPARABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'VALUES')
+
+# Statement name -> (query name, SQL) for every statement seen so far
+_registry = {}
+# Names of the statements prepared on each open connection
+_prepared = weakref.WeakKeyDictionary()
+
+
+class Statement:
+    """A prepared form of one Query's SQL"""
+
+    __slots__ = ('name', 'prepare_sql', 'execute_sql')
+
+    def __init__(self, name, prepare_sql, execute_sql):
+        self.name = name
+        self.prepare_sql = prepare_sql
+        self.execute_sql = execute_sql
+
+
+@lru_cache(maxsize=None)
+def statement(query_name, sql):
+    """The registry entry for a query, or None if it cannot be prepared
+
+    The statement name combines the query name with a hash of the SQL, as
+    one query name may stand for several SQL texts (e.g. one per sort).
+    """
+    if sql.split(None, 1)[0].upper() not in PREPARABLE:
+        return None
+    numbered, names = numbered_sql(sql)
+    name = f"{query_name}_{hashlib.md5(sql.encode('utf-8')).hexdigest()[:8]}"
+    _registry[name] = (query_name, sql)
+    execute_sql = f"EXECUTE {name}"
+    if names:
+        execute_sql += "(" + ", ".join(f"%({param})s" for param in names) + ")"
+    return Statement(name, f"PREPARE {name} AS {numbered}", execute_sql)
+
+
+def registry():
+    """Statement name -> (query name, SQL) for every statement seen by this process"""
+    return dict(_registry)
+
+
+def execute(cur, query):
+    """Execute a Query on a psycopg2 cursor, through its prepared statement when possible"""
+    stmt = statement(query.name, query.sql) if PREPARE_STATEMENTS else None
+    if stmt is None:
+        cur.execute(query.sql, query.params)
+        return
+
+    conn = cur.connection
+    prepared = _prepared.setdefault(conn, set())
+    if stmt.name not in prepared:
+        cur.execute(stmt.prepare_sql)
+        prepared.add(stmt.name)
+        QUERY_PREPARES.inc(query.name)
+    try:
+        cur.execute(stmt.execute_sql, query.params)
+    except errors.InvalidSqlStatementName:
+        # The session lost its statements (e.g. DISCARD ALL by a pooler).
+        # Prepare again and retry, unless this aborted an open transaction.
+        prepared.clear()
+        if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+            raise
+        cur.execute(stmt.prepare_sql)
+        prepared.add(stmt.name)
+        QUERY_PREPARES.inc(query.name)
+        cur.execute(stmt.execute_sql, query.params)
@@ -0,0 +1,255 @@
+import os
+import re
+from functools import lru_cache
+
+from api.cache import MISSING, get_cache
+
+# Data access shared by the sync (psycopg2) and async (asyncpg) apps.
+#
+# Each operation is a generator that yields Query objects and receives the
+# resulting rows (a list of dicts) back, then returns its result. The
+# runners in api/db.py and api/db_async.py only execute queries, so both
+# serving modes run exactly the same SQL and build exactly the same JSON.
+
+# How long a claimed QnA pair stays reserved for the annotator who got it.
+# Abandoned claims simply expire and the pair returns to the queue.
+CLAIM_LEASE_SECONDS = int(os.getenv('QNA_LEASE_SECONDS', '600'))
+
+# Upper bound on how many QnA pairs one request may claim at once
+MAX_CLAIM_BATCH = int(os.getenv('QNA_MAX_CLAIM_BATCH', '20'))
+
+# Upper bound on how many labels one /api/label_batch request may carry
+MAX_LABEL_BATCH = int(os.getenv('QNA_MAX_LABEL_BATCH', '200'))
+
+# Labeling a pair moves it to the labeled partition of fomc_qna (migration
+# 0015). A concurrent claim or label that was about to lock it then fails
+# with a serialization error instead of following it, so the runners try
+# claims and label writes this many times before giving up.
+WRITE_ATTEMPTS = 3
+
+# Statement date/filename rarely change; overall stats are shared by every
+# annotator and refreshed whenever this worker writes labels
+statement_cache = get_cache('statements', maxsize=4096,
+                            ttl=int(os.getenv('CACHE_STATEMENT_TTL', '3600')))
+# Full statement texts for /api/statement/<id>; browsers cache them too
+statement_text_cache = get_cache('statement_text', maxsize=64,
+                                 ttl=int(os.getenv('CACHE_STATEMENT_TTL', '3600')))
+stats_cache = get_cache('overall_stats', maxsize=1,
+                        ttl=int(os.getenv('CACHE_STATS_TTL', '5')))
+
+STATEMENT_META_SQL = """
+    SELECT id, date, filename FROM fomc_statements
+"""
+
+# md5 of the text doubles as the ETag, so it changes if a re-import edits it
+STATEMENT_TEXT_SQL = """
+    SELECT id, date, filename, speaker, content, md5(content) AS etag
+    FROM fomc_statements
+    WHERE id = %(statement_id)s
+"""
+
+# Record a batch of labels in one statement; the SQL text is the same for
+# every batch size. Triggers on qna_labels update the pair's summary
+# columns (majority label, is_labeled, claim) and the counters.
+APPLY_LABELS_SQL = """
+    INSERT INTO qna_labels AS l (qna_id, user_id, label, labeled_at)
+    SELECT v.id, %(user_id)s, v.label, NOW()
+    FROM unnest(%(ids)s::integer[], %(labels)s::boolean[]) AS v(id, label)
+    JOIN fomc_qna q ON q.id = v.id
+    ON CONFLICT (qna_id, user_id) DO UPDATE
+    SET label = EXCLUDED.label,
+        labeled_at = EXCLUDED.labeled_at
+"""
+
+RECORD_BATCH_SQL = """
+    INSERT INTO label_batches (batch_id, user_id, label_count)
+    VALUES (%(batch_id)s, %(user_id)s, %(label_count)s)
+    ON CONFLICT (user_id, batch_id) DO NOTHING
+    RETURNING batch_id
+"""
+
+# Global ('') and/or per-user counter rows maintained by triggers
+READ_STATS_SQL = """
+    SELECT user_id, total, labeled, relevant, irrelevant
+    FROM labeling_stats
+    WHERE user_id = ANY(%(user_ids)s::varchar[])
+"""
+
+
+class Query:
+    """One SQL statement (psycopg2 pyformat) for a runner to execute
+
+    `name` identifies the query in timings and metrics.
+    """
+
+    __slots__ = ('name', 'sql', 'params', 'returns_rows')
+
+    def __init__(self, name, sql, params=None, returns_rows=True):
+        self.name = name
+        self.sql = sql
+        self.params = params or {}
+        self.returns_rows = returns_rows
+
+
+BEGIN = Query('begin', "BEGIN", returns_rows=False)
+COMMIT = Query('commit', "COMMIT", returns_rows=False)
+
+_PLACEHOLDER = re.compile(r"%\((\w+)\)s")
+
+@lru_cache(maxsize=None)
+def numbered_sql(sql):
+    """Rewrite %(name)s placeholders as $1, $2, ... for asyncpg
+
+    Returns the new SQL and the parameter names in $n order.
+    """
+    names = []
+
+    def replace(match):
+        name = match.group(1)
+        if name not in names:
+            names.append(name)
+        return f"${names.index(name) + 1}"
+
+    return _PLACEHOLDER.sub(replace, sql), tuple(names)
+
+def load_statement_meta():
+    """Cache the date and filename of every statement; returns them by id"""
+    rows = yield Query('statement_meta', STATEMENT_META_SQL)
+    loaded = {}
+    for row in rows:
+        loaded[row['id']] = {
+            'date': row['date'].strftime('%Y-%m-%d') if row['date'] else None,
+            'filename': row['filename']
+        }
+        statement_cache.set(row['id'], loaded[row['id']])
+    return loaded
+
+def attach_statement_meta(results):
+    """Add statement date and filename to claimed QnA pairs from the cache"""
+    # One cache lookup per statement, so the hit/miss counters stay honest
+    metas = {}
+    for result in results:
+        if result['statement_id'] not in metas:
+            metas[result['statement_id']] = statement_cache.get(result['statement_id'])
+    if any(meta is MISSING for meta in metas.values()):
+        # There are only a few dozen statements: reload them all at once
+        loaded = yield from load_statement_meta()
+        metas = {statement_id: loaded.get(statement_id, MISSING) if meta is MISSING else meta
+                 for statement_id, meta in metas.items()}
+
+    for result in results:
+        meta = metas[result['statement_id']]
+        if meta is MISSING:
+            meta = {'date': None, 'filename': None}
+        result.update(meta)
+
+def get_statement(statement_id):
+    """Full text of one statement plus its ETag, or None if it does not exist"""
+    statement = statement_text_cache.get(statement_id)
+    if statement is MISSING:
+        rows = yield Query('statement_text', STATEMENT_TEXT_SQL, {'statement_id': statement_id})
+        if not rows:
+            return None
+        row = rows[0]
+        statement = {
+            'id': row['id'],
+            'date': row['date'].strftime('%Y-%m-%d') if row['date'] else None,
+            'filename': row['filename'],
+            'speaker': row['speaker'],
+            'content': row['content'],
+            'etag': row['etag']
+        }
+        statement_text_cache.set(statement_id, statement)
+    return dict(statement)
+
+def overall_stats(row):
+    """Overall progress from the global counter row (None if there is none yet)"""
+    row = row or {'total': 0, 'labeled': 0}
+    return {
+        'total': row['total'],
+        'labeled': row['labeled'],
+        'unlabeled': row['total'] - row['labeled']
+    }
+
+def user_stats(row):
+    """One annotator's label counts from their counter row (None if they have none)"""
+    row = row or {'total': 0, 'relevant': 0, 'irrelevant': 0}
+    return {
+        'total': row['total'],
+        'relevant': row['relevant'],
+        'irrelevant': row['irrelevant']
+    }
+
+def read_stats(user_id, fresh=False):
+    """Read global and per-user counters, using the cached global row if allowed"""
+    overall = MISSING if fresh else stats_cache.get('overall')
+    user_ids = [user_id] if overall is not MISSING else ['', user_id]
+
+    rows = yield Query('read_stats', READ_STATS_SQL, {'user_ids': user_ids})
+    rows = {row['user_id']: row for row in rows}
+
+    if overall is MISSING:
+        overall = overall_stats(rows.get(''))
+        stats_cache.set('overall', overall)
+
+    return {
+        'user': user_stats(rows.get(user_id)),
+        'overall': overall
+    }
+
+def warm_up():
+    """Fill the caches a new process would otherwise fill on its first requests"""
+    yield from load_statement_meta()
+    yield from read_stats('', fresh=True)
+
+def apply_labels(labels, user_id):
+    """Write (qna_id, label) pairs, coalescing repeats to the latest label"""
+    latest = dict(labels)
+    yield Query('apply_labels', APPLY_LABELS_SQL, {
+        'user_id': user_id,
+        'ids': list(latest.keys()),
+        'labels': list(latest.values()),
+    }, returns_rows=False)
+    return len(latest)
+
+def label_counts(user_id):
+    """Remaining unlabeled pairs overall and pairs labeled by this user after a write"""
+    # Labels were just written: re-read (and re-cache) the global counters
+    stats = yield from read_stats(user_id, fresh=True)
+    return stats['overall']['unlabeled'], stats['user']['total']
+
+def label_qna(qna_id, label_value, user_id):
+    """Label a QnA pair and record the user who labeled it"""
+    yield from apply_labels([(qna_id, label_value)], user_id)
+    remaining, user_count = yield from label_counts(user_id)
+    return {
+        'success': True,
+        'remaining': remaining,
+        'user_count': user_count
+    }
+
+def label_qna_batch(labels, user_id, batch_id):
+    """Apply a batch of (qna_id, label) pairs at most once per batch_id of the user"""
+    # Record the batch and write its labels in one transaction, so a retried
+    # batch is either fully applied already or not at all
+    yield BEGIN
+    rows = yield Query('record_batch', RECORD_BATCH_SQL, {
+        'batch_id': batch_id,
+        'user_id': user_id,
+        'label_count': len(labels),
+    })
+    duplicate = not rows
+
+    applied = 0
+    if not duplicate and labels:
+        applied = yield from apply_labels(labels, user_id)
+    yield COMMIT
+
+    remaining, user_count = yield from label_counts(user_id)
+    return {
+        'success': True,
+        'applied': applied,
+        'duplicate': duplicate,
+        'remaining': remaining,
+        'user_count': user_count
+    }
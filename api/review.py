@@ -0,0 +1,89 @@
+from datetime import datetime
+
+from api.queries import Query, attach_statement_meta, label_counts
+
+# Review and correction of an annotator's own labels.
+#
+# /api/my_labels pages through them newest first by keyset on
+# (labeled_at, id): each page returns a cursor for its last label and the
+# next page starts strictly before it, an index range scan on
+# qna_labels_user_labeled_at_idx. Page 200 costs the same as page 1, where
+# OFFSET would read and discard every label before it.
+#
+# Editing a label moves it to the top (labeled_at is bumped, which is also
+# how agreement.py notices the change). It never reappears further down the
+# pages being read.
+
+# Cursor of the first page: before every label
+FIRST_PAGE = (datetime.max, 0)
+
+MY_LABELS_SQL = """
+    SELECT l.id AS label_id, l.label, l.labeled_at,
+           q.id, q.statement_id, q.questioner, q.question, q.responder, q.response,
+           q.label AS consensus, q.label_count
+    FROM qna_labels l
+    JOIN fomc_qna q ON q.id = l.qna_id
+    WHERE l.user_id = %(user_id)s
+      AND (l.labeled_at, l.id) < (%(before_at)s::timestamp, %(before_id)s::bigint)
+    ORDER BY l.labeled_at DESC, l.id DESC
+    LIMIT %(limit)s
+"""
+
+# Only the annotator's own label can be changed; the qna_labels triggers
+# update the pair's majority label and the counters
+EDIT_LABEL_SQL = """
+    UPDATE qna_labels
+    SET label = %(label)s,
+        labeled_at = NOW()
+    WHERE qna_id = %(qna_id)s AND user_id = %(user_id)s
+    RETURNING qna_id, label, labeled_at
+"""
+
+
+def format_cursor(labeled_at, label_id):
+    return f"{labeled_at.isoformat()}_{label_id}"
+
+
+def parse_cursor(cursor):
+    """(labeled_at, label id) from a cursor; raises ValueError if it is malformed"""
+    labeled_at, label_id = cursor.rsplit('_', 1)
+    return datetime.fromisoformat(labeled_at), int(label_id)
+
+
+def my_labels(user_id, before=FIRST_PAGE, limit=50):
+    """One page of the labels `user_id` has given, newest first"""
+    before_at, before_id = before
+    rows = yield Query('my_labels', MY_LABELS_SQL, {
+        'user_id': user_id,
+        'before_at': before_at,
+        'before_id': before_id,
+        'limit': limit + 1,
+    })
+    more = len(rows) > limit
+    items = rows[:limit]
+    next_cursor = format_cursor(items[-1]['labeled_at'], items[-1]['label_id']) if more else None
+    for item in items:
+        del item['label_id']
+        item['labeled_at'] = item['labeled_at'].isoformat()
+    yield from attach_statement_meta(items)
+    return {'items': items, 'next': next_cursor}
+
+
+def edit_label(qna_id, label_value, user_id):
+    """Change the label `user_id` gave a QnA pair, or None if there is none"""
+    rows = yield Query('edit_label', EDIT_LABEL_SQL, {
+        'qna_id': qna_id,
+        'label': label_value,
+        'user_id': user_id,
+    })
+    if not rows:
+        return None
+    remaining, user_count = yield from label_counts(user_id)
+    return {
+        'success': True,
+        'qna_id': rows[0]['qna_id'],
+        'label': rows[0]['label'],
+        'labeled_at': rows[0]['labeled_at'].isoformat(),
+        'remaining': remaining,
+        'user_count': user_count
+    }
@@ -0,0 +1,30 @@
+import os
+import time
+
+from api.pool import REPLICAS
+
+# Read-your-writes for replica reads (see DB_REPLICA_HOSTS in api/pool.py).
+#
+# A replica applies the primary's changes a little later, so an annotator
+# who has just labeled could see counters without their last labels. The
+# label routes record the time of the write in the session, and for
+# DB_REPLICA_READ_YOUR_WRITES seconds after it that annotator's own reads
+# stay on the primary. The session cookie travels with the annotator, so
+# this holds whichever worker or instance serves the next request.
+
+READ_YOUR_WRITES_SECONDS = float(os.getenv('DB_REPLICA_READ_YOUR_WRITES', '10'))
+
+WROTE_AT = 'wrote_at'
+
+
+def note_write(session):
+    """Record that the session's user has just written"""
+    if REPLICAS:
+        session[WROTE_AT] = time.time()
+
+
+def use_replica(session):
+    """Whether the session's user's reads may go to a replica"""
+    if not REPLICAS:
+        return False
+    return time.time() - session.get(WROTE_AT, 0) >= READ_YOUR_WRITES_SECONDS
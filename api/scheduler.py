@@ -0,0 +1,263 @@
+import os
+import random
+
+from api.queries import (CLAIM_LEASE_SECONDS, MAX_CLAIM_BATCH, Query,
+                         attach_statement_meta)
+
+# Assignment strategies for /api/next_qna, selected with QNA_DISPATCH:
+#
+#   random       - uniformly random pairs from the whole corpus (default)
+#   round_robin  - one pair from each statement in turn, so every press
+#                  conference gets coverage at the same pace
+#   oldest_first - finish press conferences in date order
+#   affinity     - keep each annotator on the statement they are working
+#                  through, moving to the next one in round-robin order
+#                  once it is done, so its context stays fresh
+#   uncertainty  - pairs the relevance model is least sure about first
+#                  (active learning; scores are written by prioritize.py),
+#                  then unscored pairs at random
+#
+# Pairs that need several labels (required_labels > 1) go back to the
+# queue after each label, but never to an annotator who already labeled
+# them. Near-duplicates of another pair (duplicate_of) are never handed
+# out; they take over their representative's label.
+#
+# Claims name is_labeled = FALSE in their UPDATE too, so it only looks at
+# the unlabeled partition of fomc_qna (migration 0015).
+#
+# Statement strategies walk per-statement queues (the partial index on
+# (statement_id, shuffle_key) and the trigger-maintained statement_progress
+# table) instead of sorting fomc_qna. Whatever a strategy cannot fill, e.g.
+# because the remaining pairs of its statements are leased, is topped up
+# with random pairs.
+
+QNA_DISPATCH = os.getenv('QNA_DISPATCH', 'random')
+
+# Walk the partial index on shuffle_key from a random start, skipping rows
+# that are leased or locked by a concurrent claim, and lease the first ones.
+CLAIM_NEXT_QNA_SQL = """
+    WITH next AS (
+        SELECT id
+        FROM fomc_qna
+        WHERE is_labeled = FALSE
+          AND duplicate_of IS NULL
+          AND shuffle_key >= %(start)s
+          AND (claim_expires_at IS NULL OR claim_expires_at < NOW())
+          AND id <> ALL(%(exclude)s::integer[])
+          AND NOT EXISTS (SELECT 1 FROM qna_labels l
+                          WHERE l.qna_id = fomc_qna.id AND l.user_id = %(user_id)s)
+        ORDER BY shuffle_key
+        LIMIT %(count)s
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE fomc_qna q
+    SET claimed_by = %(user_id)s,
+        claim_expires_at = NOW() + %(lease_seconds)s::integer * INTERVAL '1 second'
+    FROM next
+    WHERE q.id = next.id
+      AND q.is_labeled = FALSE
+    RETURNING q.id, q.statement_id, q.questioner, q.question, q.responder, q.response
+"""
+
+# Walk the partial index on (priority DESC NULLS LAST, shuffle_key) from the
+# top. Concurrent annotators skip each other's leased and locked rows.
+UNCERTAINTY_CLAIM_SQL = """
+    WITH next AS (
+        SELECT id
+        FROM fomc_qna
+        WHERE is_labeled = FALSE
+          AND duplicate_of IS NULL
+          AND (claim_expires_at IS NULL OR claim_expires_at < NOW())
+          AND NOT EXISTS (SELECT 1 FROM qna_labels l
+                          WHERE l.qna_id = fomc_qna.id AND l.user_id = %(user_id)s)
+        ORDER BY priority DESC NULLS LAST, shuffle_key
+        LIMIT %(count)s
+        FOR UPDATE SKIP LOCKED
+    ),
+    claimed AS (
+        UPDATE fomc_qna q
+        SET claimed_by = %(user_id)s,
+            claim_expires_at = NOW() + %(lease_seconds)s::integer * INTERVAL '1 second'
+        FROM next
+        WHERE q.id = next.id
+          AND q.is_labeled = FALSE
+        RETURNING q.id, q.statement_id, q.questioner, q.question, q.responder, q.response,
+                  q.priority, q.shuffle_key
+    )
+    SELECT id, statement_id, questioner, question, responder, response
+    FROM claimed
+    ORDER BY priority DESC NULLS LAST, shuffle_key
+"""
+
+# Lease up to %(per_statement)s pairs from each statement chosen by the
+# `picked` CTE (statement_id, position), preferring lower positions.
+# {extra} adds strategy-specific CTEs that run in the same statement.
+_CLAIM_FROM_STATEMENTS_SQL = """
+    WITH picked AS ({picked}),
+    next AS (
+        SELECT q.id, p.position
+        FROM picked p
+        CROSS JOIN LATERAL (
+            SELECT id
+            FROM fomc_qna
+            WHERE statement_id = p.statement_id
+              AND is_labeled = FALSE
+              AND duplicate_of IS NULL
+              AND (claim_expires_at IS NULL OR claim_expires_at < NOW())
+              AND NOT EXISTS (SELECT 1 FROM qna_labels l
+                              WHERE l.qna_id = fomc_qna.id AND l.user_id = %(user_id)s)
+            ORDER BY shuffle_key
+            LIMIT %(per_statement)s
+            FOR UPDATE SKIP LOCKED
+        ) AS q
+        ORDER BY p.position
+        LIMIT %(count)s
+    ),
+    claimed AS (
+        UPDATE fomc_qna q
+        SET claimed_by = %(user_id)s,
+            claim_expires_at = NOW() + %(lease_seconds)s::integer * INTERVAL '1 second'
+        FROM next
+        WHERE q.id = next.id
+          AND q.is_labeled = FALSE
+        RETURNING q.id, q.statement_id, q.questioner, q.question, q.responder, q.response,
+                  next.position
+    ){extra}
+    SELECT id, statement_id, questioner, question, responder, response
+    FROM claimed
+    ORDER BY position, id
+"""
+
+# Statements with work left, least recently dispatched first. Rows locked
+# by a concurrent claim are skipped rather than waited for.
+_NEXT_STATEMENTS = """
+        SELECT statement_id
+        FROM statement_progress
+        WHERE labeled < total
+        ORDER BY last_dispatched_at NULLS FIRST, statement_id
+        LIMIT {limit}
+        FOR UPDATE SKIP LOCKED
+"""
+
+_TOUCH_PICKED = """,
+    touched AS (
+        UPDATE statement_progress s
+        SET last_dispatched_at = NOW()
+        FROM picked
+        WHERE s.statement_id = picked.statement_id
+    )"""
+
+ROUND_ROBIN_CLAIM_SQL = _CLAIM_FROM_STATEMENTS_SQL.format(
+    picked="""
+        SELECT statement_id, row_number() OVER () AS position
+        FROM (""" + _NEXT_STATEMENTS.format(limit='%(count)s') + """) AS s
+    """,
+    extra=_TOUCH_PICKED)
+
+OLDEST_FIRST_CLAIM_SQL = _CLAIM_FROM_STATEMENTS_SQL.format(
+    picked="""
+        SELECT p.statement_id, row_number() OVER (ORDER BY s.date, s.id) AS position
+        FROM fomc_statements s
+        JOIN statement_progress p ON p.statement_id = s.id
+        WHERE p.labeled < p.total
+        ORDER BY s.date, s.id
+        LIMIT %(count)s
+    """,
+    extra='')
+
+# The annotator's current statement first, then the next one in
+# round-robin order; the statement of the last pair handed out becomes the
+# annotator's current one.
+AFFINITY_CLAIM_SQL = _CLAIM_FROM_STATEMENTS_SQL.format(
+    picked="""
+        SELECT statement_id, 0 AS position
+        FROM user_affinity
+        WHERE user_id = %(user_id)s
+        UNION ALL
+        SELECT statement_id, row_number() OVER () AS position
+        FROM (""" + _NEXT_STATEMENTS.format(limit='2') + """) AS s
+        WHERE statement_id IS DISTINCT FROM (
+            SELECT statement_id FROM user_affinity WHERE user_id = %(user_id)s
+        )
+    """,
+    extra=_TOUCH_PICKED + """,
+    remembered AS (
+        INSERT INTO user_affinity AS a (user_id, statement_id)
+        SELECT %(user_id)s, statement_id
+        FROM claimed
+        ORDER BY position DESC
+        LIMIT 1
+        ON CONFLICT (user_id) DO UPDATE
+        SET statement_id = EXCLUDED.statement_id,
+            updated_at = NOW()
+        WHERE a.statement_id <> EXCLUDED.statement_id
+    )""")
+
+
+def claim_random(user_id, count, exclude=()):
+    """Lease up to `count` random unlabeled pairs"""
+    # Start at a random point of the shuffle order, wrapping around to the
+    # beginning if not enough is left after it
+    results = []
+    for start in (random.random(), 0.0):
+        rows = yield Query('claim', CLAIM_NEXT_QNA_SQL, {
+            'user_id': user_id,
+            'start': start,
+            'count': count - len(results),
+            'exclude': list(exclude) + [r['id'] for r in results],
+            'lease_seconds': CLAIM_LEASE_SECONDS,
+        })
+        results.extend(rows)
+        if len(results) >= count:
+            break
+    return results
+
+
+def claim_uncertain(user_id, count):
+    """Lease up to `count` unlabeled pairs, most uncertain first"""
+    results = yield Query('claim_uncertain', UNCERTAINTY_CLAIM_SQL, {
+        'user_id': user_id,
+        'count': count,
+        'lease_seconds': CLAIM_LEASE_SECONDS,
+    })
+    return results
+
+
+def _statement_strategy(name, sql, per_statement):
+    def claim(user_id, count):
+        results = yield Query(name, sql, {
+            'user_id': user_id,
+            'count': count,
+            'per_statement': per_statement if per_statement else count,
+            'lease_seconds': CLAIM_LEASE_SECONDS,
+        })
+        if len(results) < count:
+            results += yield from claim_random(user_id, count - len(results),
+                                               exclude=[r['id'] for r in results])
+        return results
+    claim.__doc__ = f"Lease up to `count` pairs using the {name} strategy"
+    return claim
+
+
+# Strategy name -> generator function (user_id, count) yielding Query objects.
+# A per_statement of None means as many pairs per statement as requested.
+STRATEGIES = {
+    'random': claim_random,
+    'round_robin': _statement_strategy('claim_round_robin', ROUND_ROBIN_CLAIM_SQL, 1),
+    'oldest_first': _statement_strategy('claim_oldest_first', OLDEST_FIRST_CLAIM_SQL, None),
+    'affinity': _statement_strategy('claim_affinity', AFFINITY_CLAIM_SQL, None),
+    'uncertainty': claim_uncertain,
+}
+
+if QNA_DISPATCH not in STRATEGIES:
+    raise ValueError(f"Unknown QNA_DISPATCH strategy {QNA_DISPATCH!r}; "
+                     f"choose one of: {', '.join(STRATEGIES)}")
+
+
+def claim_next_qnas(user_id, count=1, strategy=None):
+    """Claim up to `count` unlabeled QnA pairs for a user"""
+    count = max(1, min(int(count), MAX_CLAIM_BATCH))
+    claim = STRATEGIES[strategy or QNA_DISPATCH]
+    results = yield from claim(user_id, count)
+    yield from attach_statement_meta(results)
+    return results
@@ -0,0 +1,133 @@
+from api.queries import Query, attach_statement_meta
+
+# Full-text search over QnA pairs and opening statements, for labeling
+# sessions targeted at a topic ("balance sheet runoff").
+#
+# Queries use web search syntax: quoted phrases, OR, and -word to exclude.
+# Pages are fetched by keyset, never OFFSET: each page returns a cursor
+# for the last row, and the next page starts strictly after it, so deep
+# pages cost the same as the first and labels written between pages do not
+# shift the results.
+#
+#   sort=rank - best matches first; the cursor is "<rank>:<id>"
+#   sort=id   - in import order; the cursor is "<id>"
+
+SEARCH_SORTS = ('rank', 'id')
+SEARCH_SCOPES = ('qna', 'statements')
+
+# With unlabeled=1 only pairs that can still be labeled are returned:
+# not labeled yet, not a near-duplicate, and not labeled by this user
+_QNA_HITS = """
+    SELECT q.id, {rank} AS rank
+    FROM fomc_qna q, websearch_to_tsquery('english', %(q)s) AS query(tsq)
+    WHERE q.search_vector @@ query.tsq
+      AND (NOT %(unlabeled)s OR (q.is_labeled = FALSE AND q.duplicate_of IS NULL
+           AND NOT EXISTS (SELECT 1 FROM qna_labels l
+                           WHERE l.qna_id = q.id AND l.user_id = %(user_id)s)))
+"""
+
+_QNA_PAGE = """
+    WITH hits AS ({hits})
+    SELECT h.rank, q.id, q.statement_id, q.questioner, q.question, q.responder, q.response,
+           q.is_labeled, q.label
+    FROM hits h
+    JOIN fomc_qna q ON q.id = h.id
+    WHERE {after}
+    ORDER BY {order}
+    LIMIT %(limit)s
+"""
+
+_STATEMENT_HITS = """
+    SELECT s.id, {rank} AS rank, query.tsq
+    FROM fomc_statements s, websearch_to_tsquery('english', %(q)s) AS query(tsq)
+    WHERE s.search_vector @@ query.tsq
+"""
+
+# Snippets are only built for the rows of the page
+_STATEMENT_PAGE = """
+    WITH hits AS ({hits}),
+    page AS (
+        SELECT h.rank, h.id, h.tsq
+        FROM hits h
+        WHERE {after}
+        ORDER BY {order}
+        LIMIT %(limit)s
+    )
+    SELECT p.rank, s.id, s.date, s.filename, s.speaker,
+           ts_headline('english', s.content, p.tsq,
+                       'MaxFragments=2, MaxWords=30, MinWords=10') AS headline
+    FROM page p
+    JOIN fomc_statements s ON s.id = p.id
+    ORDER BY {order}
+"""
+
+_AFTER = {
+    'rank': """(%(after_rank)s::real IS NULL
+               OR (h.rank, h.id) < (%(after_rank)s::real, %(after_id)s::integer))""",
+    'id': "h.id > %(after_id)s::integer",
+}
+# Ranks are only computed when sorting by them
+_RANK = {
+    'rank': "ts_rank_cd({table}.search_vector, query.tsq)",
+    'id': "NULL::real",
+}
+_ORDER = {
+    'rank': "rank DESC, id DESC",
+    'id': "id",
+}
+
+SEARCH_QNA_SQL = {
+    sort: _QNA_PAGE.format(hits=_QNA_HITS.format(rank=_RANK[sort].format(table='q')),
+                           after=_AFTER[sort], order=_ORDER[sort])
+    for sort in SEARCH_SORTS}
+SEARCH_STATEMENTS_SQL = {
+    sort: _STATEMENT_PAGE.format(hits=_STATEMENT_HITS.format(rank=_RANK[sort].format(table='s')),
+                                 after=_AFTER[sort], order=_ORDER[sort])
+    for sort in SEARCH_SORTS}
+
+
+def _cursor(row, sort):
+    if sort == 'rank':
+        return f"{row['rank']!r}:{row['id']}"
+    return str(row['id'])
+
+
+def _page(rows, sort, limit):
+    """Split off the look-ahead row and build the cursor of the next page"""
+    more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = _cursor(rows[-1], sort) if more else None
+    for row in rows:
+        del row['rank']
+    return rows, next_cursor
+
+
+def search_qna(text, user_id, sort='rank', after=(None, 0), limit=20, unlabeled=False):
+    """One page of QnA pairs matching `text`, with statement metadata"""
+    after_rank, after_id = after
+    rows = yield Query('search_qna', SEARCH_QNA_SQL[sort], {
+        'q': text,
+        'user_id': user_id,
+        'unlabeled': unlabeled,
+        'after_rank': after_rank,
+        'after_id': after_id,
+        'limit': limit + 1,
+    })
+    items, next_cursor = _page(rows, sort, limit)
+    yield from attach_statement_meta(items)
+    return {'items': items, 'next': next_cursor}
+
+
+def search_statements(text, sort='rank', after=(None, 0), limit=20):
+    """One page of opening statements matching `text`, with highlighted snippets"""
+    after_rank, after_id = after
+    rows = yield Query('search_statements', SEARCH_STATEMENTS_SQL[sort], {
+        'q': text,
+        'after_rank': after_rank,
+        'after_id': after_id,
+        'limit': limit + 1,
+    })
+    items, next_cursor = _page(rows, sort, limit)
+    for item in items:
+        item['date'] = item['date'].strftime('%Y-%m-%d') if item['date'] else None
+    return {'items': items, 'next': next_cursor}
@@ -0,0 +1,253 @@
+import json
+import os
+import select
+import threading
+import time
+
+from api.queries import READ_STATS_SQL, Query, overall_stats, stats_cache, user_stats
+
+# Live progress for /api/stream/stats (server-sent events).
+#
+# Label writes change labeling_stats, whose triggers NOTIFY the
+# 'labeling_stats' channel on commit with the annotators whose counters
+# changed. Each worker process keeps one listening connection: the first
+# notification opens a STATS_STREAM_DEBOUNCE_MS window, every notification
+# in that window is coalesced, and at its end one query reads the global
+# row plus the changed rows of connected annotators. The result is pushed
+# to every subscribed browser, so the number of stats queries follows the
+# label rate (at most one per window) instead of the number of annotators.
+#
+# This module holds the shared parts and the thread-based hub for the
+# Flask app; api/stream_async.py is the asyncpg hub for the ASGI app.
+# STATS_STREAM turns the endpoint on or off; while it is off the page polls
+# /api/stats instead. It is on by default only in the ASGI app: the Flask
+# app runs on gunicorn's sync workers, where each open stream would hold a
+# whole worker for as long as its page is open. Enable it there only with
+# threads to spare (worker_class = 'gthread' and more threads than open
+# pages). Serverless hosts cannot hold a response open and leave it off.
+
+
+def stats_stream_enabled(default):
+    """Whether to serve /api/stream/stats: STATS_STREAM, else this app's default"""
+    value = os.getenv('STATS_STREAM')
+    if value is None:
+        return default
+    return value.lower() in ('1', 'true', 'yes')
+
+STATS_CHANNEL = 'labeling_stats'
+DEBOUNCE_SECONDS = float(os.getenv('STATS_STREAM_DEBOUNCE_MS', '1000')) / 1000
+# A comment line this often keeps proxies from closing an idle stream and
+# notices clients that went away
+KEEPALIVE_SECONDS = float(os.getenv('STATS_STREAM_KEEPALIVE', '15'))
+# How long to wait before reconnecting a lost listening connection
+RECONNECT_SECONDS = 5
+
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    # Stop nginx from buffering the stream
+    'X-Accel-Buffering': 'no',
+}
+
+
+def parse_notification(payload):
+    """The annotators a notification names, or None if it may concern all of them"""
+    try:
+        user_ids = json.loads(payload)
+    except ValueError:
+        return None
+    return set(user_ids) if isinstance(user_ids, list) else None
+
+
+def read_snapshot(user_ids):
+    """Overall progress and the counters of the given annotators"""
+    rows = yield Query('stream_stats', READ_STATS_SQL, {'user_ids': [''] + sorted(user_ids)})
+    rows = {row['user_id']: row for row in rows}
+    overall = overall_stats(rows.get(''))
+    # Fresh anyway: let /api/stats in this process use it
+    stats_cache.set('overall', overall)
+    return overall, {user_id: user_stats(rows.get(user_id)) for user_id in user_ids}
+
+
+def format_event(data, event='stats'):
+    """One server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+KEEPALIVE_EVENT = ": keepalive\n\n"
+
+
+class Subscription:
+    """One open stream; holds only the latest message not yet sent"""
+
+    def __init__(self, hub, user_id):
+        self.hub = hub
+        self.user_id = user_id
+        self._cond = threading.Condition()
+        self._latest = None
+
+    def push(self, message):
+        with self._cond:
+            self._latest = message
+            self._cond.notify()
+
+    def events(self, first):
+        """Server-sent events for this subscriber, starting with `first`"""
+        yield "retry: 5000\n\n" + format_event(first)
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._latest is not None, KEEPALIVE_SECONDS)
+                message, self._latest = self._latest, None
+            yield format_event(message) if message is not None else KEEPALIVE_EVENT
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+
+class StatsFanout:
+    """Open streams by annotator, and the numbers last pushed to them"""
+
+    subscription_class = Subscription
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}      # user_id -> set of subscriptions
+        self._user_stats = {}       # user_id -> last counters pushed
+        self._counters = {'notifications': 0, 'publishes': 0, 'reconnects': 0}
+
+    def subscribe(self, user_id, stats):
+        """Register a stream that starts from `stats` (the /api/stats response)"""
+        subscription = self.subscription_class(self, user_id)
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+            self._user_stats[user_id] = stats['user']
+            self._ensure_listener()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscribers.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscribers[subscription.user_id]
+                    self._user_stats.pop(subscription.user_id, None)
+
+    def publish(self, overall, users):
+        """Push the new numbers to every open stream"""
+        with self._lock:
+            self._user_stats.update((user_id, stats) for user_id, stats in users.items()
+                                    if user_id in self._subscribers)
+            targets = [(subscription, self._user_stats[user_id])
+                       for user_id, subscriptions in self._subscribers.items()
+                       for subscription in subscriptions]
+            self._counters['publishes'] += 1
+        for subscription, user in targets:
+            subscription.push({'user': user, 'overall': overall})
+
+    def subscribed_users(self, changed):
+        """Connected annotators among `changed` (None: all connected ones), or None if nobody is"""
+        with self._lock:
+            if not self._subscribers:
+                return None
+            if changed is None:
+                return set(self._subscribers)
+            return changed & set(self._subscribers)
+
+    def count(self, counter):
+        with self._lock:
+            self._counters[counter] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters,
+                        subscribers=sum(len(s) for s in self._subscribers.values()))
+
+
+class StatsHub(StatsFanout):
+    """Fan-out fed by a LISTEN connection in a background thread"""
+
+    def __init__(self, connect):
+        super().__init__()
+        self._connect = connect
+        self._thread = None
+
+    def _ensure_listener(self):
+        # Also restarts it in a forked worker, where the thread is gone
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._listen, name='stats-stream', daemon=True)
+            self._thread.start()
+
+    def _listen(self):
+        # Imported here so the ASGI app never loads the sync runner
+        from api.db import run_sync
+
+        while True:
+            try:
+                conn = self._connect()
+                try:
+                    with conn.cursor() as cur:
+                        cur.execute(f"LISTEN {STATS_CHANNEL}")
+                    self._drain(conn, run_sync)
+                finally:
+                    conn.close()
+            except Exception as e:
+                print(f"Error in stats stream listener: {e}")
+            self.count('reconnects')
+            time.sleep(RECONNECT_SECONDS)
+
+    def _drain(self, conn, run_sync):
+        """Wait for notifications and publish once per debounce window"""
+        # pending: None = everything changed, a set = these annotators changed,
+        # False = nothing to publish. Anything may have changed while not
+        # listening, so start with a publish.
+        pending, due = None, time.monotonic()
+        while True:
+            timeout = KEEPALIVE_SECONDS if due is None else max(due - time.monotonic(), 0)
+            if select.select([conn], [], [], timeout)[0]:
+                conn.poll()
+                for notify in conn.notifies:
+                    self.count('notifications')
+                    changed = parse_notification(notify.payload)
+                    if pending is False:
+                        pending = changed
+                        due = time.monotonic() + DEBOUNCE_SECONDS
+                    elif pending is not None:
+                        pending = None if changed is None else pending | changed
+                conn.notifies.clear()
+            elif due is None:
+                # Quiet for a while: make sure the connection is still there
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+
+            if due is not None and time.monotonic() >= due:
+                users = self.subscribed_users(pending)
+                pending, due = False, None
+                if users is not None:
+                    overall, users = run_sync(conn, read_snapshot(users))
+                    self.publish(overall, users)
+
+
+_hub = None
+_hub_lock = threading.Lock()
+
+
+def get_hub():
+    """This process's hub, listening on its own connection outside the pool"""
+    global _hub
+    with _hub_lock:
+        if _hub is None:
+            import psycopg2
+            from api.pool import DB_PARAMS
+
+            def connect():
+                conn = psycopg2.connect(**DB_PARAMS)
+                conn.autocommit = True
+                return conn
+
+            _hub = StatsHub(connect)
+        return _hub
+
+
+def stream_stats():
+    """Counters of the stats streams in this process, for /health"""
+    return _hub.stats() if _hub is not None else {'subscribers': 0}
@@ -0,0 +1,127 @@
+import asyncio
+
+import asyncpg
+
+from api.db_async import _run
+from api.pool import DB_PARAMS
+from api.stream import (DEBOUNCE_SECONDS, KEEPALIVE_EVENT, KEEPALIVE_SECONDS, RECONNECT_SECONDS,
+                        STATS_CHANNEL, StatsFanout, format_event, parse_notification,
+                        read_snapshot)
+
+# The /api/stream/stats hub for the ASGI app: the same fan-out as
+# api/stream.py, fed by an asyncpg listener on the worker's event loop.
+# The debounced stats read borrows a connection from the pool, since the
+# listening connection is kept free for its liveness checks.
+
+
+class AsyncSubscription:
+    """One open stream; holds only the latest message not yet sent"""
+
+    def __init__(self, hub, user_id):
+        self.hub = hub
+        self.user_id = user_id
+        self._ready = asyncio.Event()
+        self._latest = None
+
+    def push(self, message):
+        self._latest = message
+        self._ready.set()
+
+    async def events(self, first):
+        """Server-sent events for this subscriber, starting with `first`"""
+        yield "retry: 5000\n\n" + format_event(first)
+        while True:
+            try:
+                await asyncio.wait_for(self._ready.wait(), KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield KEEPALIVE_EVENT
+                continue
+            self._ready.clear()
+            message, self._latest = self._latest, None
+            yield format_event(message)
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+
+class AsyncStatsHub(StatsFanout):
+    """Fan-out fed by a LISTEN connection on the event loop"""
+
+    subscription_class = AsyncSubscription
+
+    def __init__(self):
+        super().__init__()
+        self._task = None
+        self._pending = False   # as in StatsHub._drain
+        self._timer = None
+
+    def _ensure_listener(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._listen())
+
+    async def _listen(self):
+        while True:
+            try:
+                conn = await asyncpg.connect(
+                    host=DB_PARAMS['host'],
+                    port=int(DB_PARAMS['port']) if DB_PARAMS['port'] else None,
+                    database=DB_PARAMS['database'],
+                    user=DB_PARAMS['user'],
+                    password=DB_PARAMS['password'],
+                )
+                try:
+                    await conn.add_listener(STATS_CHANNEL, self._on_notify)
+                    # Anything may have changed while not listening
+                    self._schedule(None, delay=0)
+                    while True:
+                        await asyncio.sleep(KEEPALIVE_SECONDS)
+                        await conn.execute("SELECT 1")
+                finally:
+                    await conn.close()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error in stats stream listener: {e}")
+            self.count('reconnects')
+            await asyncio.sleep(RECONNECT_SECONDS)
+
+    def _on_notify(self, conn, pid, channel, payload):
+        self.count('notifications')
+        self._schedule(parse_notification(payload))
+
+    def _schedule(self, changed, delay=DEBOUNCE_SECONDS):
+        """Add to the pending changes, opening a debounce window if none is open"""
+        if self._pending is False:
+            self._pending = changed
+        elif self._pending is not None:
+            self._pending = None if changed is None else self._pending | changed
+        if self._timer is None:
+            loop = asyncio.get_running_loop()
+            self._timer = loop.call_later(delay, lambda: loop.create_task(self._publish()))
+
+    async def _publish(self):
+        users = self.subscribed_users(self._pending)
+        self._pending, self._timer = False, None
+        if users is None:
+            return
+        try:
+            overall, users = await _run(read_snapshot(users), "Error reading stream stats")
+        except Exception:
+            return
+        self.publish(overall, users)
+
+
+_hub = None
+
+
+def get_hub():
+    """This worker's hub"""
+    global _hub
+    if _hub is None:
+        _hub = AsyncStatsHub()
+    return _hub
+
+
+def stream_stats():
+    """Counters of the stats streams in this worker, for /health"""
+    return _hub.stats() if _hub is not None else {'subscribers': 0}
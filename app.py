@@ -1,17 +1,70 @@
-from flask import Flask, render_template, request, redirect, url_for, jsonify, session
+from flask import Flask, Response, render_template, request, redirect, url_for, jsonify, session
 import os
 import secrets
-from dotenv import load_dotenv
 
-# Load environment variables
-load_dotenv()
+# Load environment variables (set by the platform on Vercel)
+if not os.getenv('VERCEL'):
+    from dotenv import load_dotenv
+    load_dotenv()
 
 # Create Flask app
-app = Flask(__name__, template_folder='../templates')
+app = Flask(__name__)
 app.secret_key = os.getenv("SECRET_KEY", secrets.token_hex(16))
 
-# Import database functions
-from api.db import get_next_unlabeled_qna, label_qna, get_user_stats
+# Routes are thin: the shared handlers in api/handlers.py do the work, run
+# on the synchronous data layer in api/db.py
+from api import db, handlers
+from api.handlers import run_handler
+from api.stream import SSE_HEADERS, get_hub, stats_stream_enabled, stream_stats
+from api.metrics import begin_request, end_request
+from api.compression import COMPRESSIBLE_MIMETYPES, add_vary, choose_encoding, compress
+
+# Off unless STATS_STREAM=true: on gunicorn's sync workers an open stream
+# holds a whole worker (see api/stream.py)
+STATS_STREAM = stats_stream_enabled(False)
+
+TEMPLATES = ('index.html', 'label.html')
+
+def respond(reply):
+    """Turn a handler's Reply into a Flask response"""
+    if reply.mimetype:
+        response = Response(reply.body, status=reply.status, mimetype=reply.mimetype)
+    elif reply.body is None:
+        response = app.make_response(('', reply.status))
+    else:
+        response = jsonify(reply.body)
+        response.status_code = reply.status
+    response.headers.update(reply.headers)
+    return response
+
+def handle(handler, *args):
+    """Run a shared handler and respond with its Reply"""
+    return respond(run_handler(handler(*args), db))
+
+@app.before_request
+def start_request_timing():
+    begin_request()
+
+@app.after_request
+def add_server_timing(response):
+    timing = end_request(request.endpoint, request.method, request.path, response.status_code)
+    if timing:
+        response.headers['Server-Timing'] = timing
+    return response
+
+# Registered after the timing hook, so it runs first and is timed too
+@app.after_request
+def compress_response(response):
+    if response.mimetype not in COMPRESSIBLE_MIMETYPES or response.is_streamed:
+        return response
+    add_vary(response.headers)
+    data = response.get_data()
+    encoding = choose_encoding(request.headers.get('Accept-Encoding'), response.mimetype,
+                               len(data), response.headers.get('Content-Encoding'))
+    if encoding:
+        response.set_data(compress(data, encoding))
+        response.headers['Content-Encoding'] = encoding
+    return response
 
 # Routes
 @app.route('/')
@@ -26,65 +79,74 @@ def label():
     if 'user_id' not in session:
         return redirect(url_for('index'))
     
-    # Get user's labeling statistics
-    try:
-        stats = get_user_stats(session['user_id'])
-    except Exception as e:
-        print(f"Error getting stats: {e}")
-        stats = {
-            'user': {'total': 0, 'relevant': 0, 'irrelevant': 0},
-            'overall': {'total': 0, 'labeled': 0, 'unlabeled': 0}
-        }
-    
+    stats = run_handler(handlers.label_page_stats(session), db)
     return render_template('label.html', 
                           user_id=session['user_id'], 
-                          stats=stats)
+                          stats=stats,
+                          stats_stream=STATS_STREAM)
 
 @app.route('/api/next_qna', methods=['GET'])
 def api_next_qna():
-    """API to get the next QnA pair"""
-    if 'user_id' not in session:
-        return jsonify({'error': 'User not authenticated'}), 401
-    
-    try:
-        next_qna = get_next_unlabeled_qna()
-        if next_qna:
-            return jsonify(next_qna)
-        else:
-            return jsonify({'error': 'No more unlabeled QnA pairs available'}), 404
-    except Exception as e:
-        return jsonify({'error': f'Database error: {str(e)}'}), 500
+    """API to get the next QnA pair, or a batch of them with ?count=N"""
+    return handle(handlers.next_qna, session, request.args)
 
 @app.route('/api/label_qna', methods=['POST'])
 def api_label_qna():
     """API to label a QnA pair"""
-    if 'user_id' not in session:
-        return jsonify({'error': 'User not authenticated'}), 401
-    
-    data = request.json
-    qna_id = data.get('qna_id')
-    label = data.get('label')
-    
-    if not qna_id or label is None:
-        return jsonify({'error': 'Missing qna_id or label'}), 400
-    
-    try:
-        result = label_qna(qna_id, label, session['user_id'])
-        return jsonify(result)
-    except Exception as e:
-        return jsonify({'error': f'Database error: {str(e)}'}), 500
+    return handle(handlers.label_one, session, request.get_json(silent=True))
+
+@app.route('/api/label_batch', methods=['POST'])
+def api_label_batch():
+    """API to label several QnA pairs at once"""
+    # Batches sent with navigator.sendBeacon arrive as text/plain
+    return handle(handlers.label_batch, session, request.get_json(force=True, silent=True))
+
+@app.route('/api/statement/<int:statement_id>', methods=['GET'])
+def api_statement(statement_id):
+    """API to get the full text of a statement, cacheable by the browser"""
+    return handle(handlers.statement, session, statement_id, request.if_none_match)
 
 @app.route('/api/stats', methods=['GET'])
 def api_stats():
     """API to get user statistics"""
-    if 'user_id' not in session:
-        return jsonify({'error': 'User not authenticated'}), 401
-    
-    try:
-        stats = get_user_stats(session['user_id'])
-        return jsonify(stats)
-    except Exception as e:
-        return jsonify({'error': f'Database error: {str(e)}'}), 500
+    return handle(handlers.stats, session)
+
+@app.route('/api/stream/stats', methods=['GET'])
+def api_stream_stats():
+    """Server-sent events with the user's statistics, pushed as labels come in"""
+    reply = run_handler(handlers.stream_start(session, STATS_STREAM), db)
+    if reply.status != 200:
+        return respond(reply)
+    stats = reply.body
+    subscription = get_hub().subscribe(session['user_id'], stats)
+
+    def events():
+        try:
+            yield from subscription.events(stats)
+        finally:
+            subscription.close()
+
+    return Response(events(), mimetype='text/event-stream', headers=SSE_HEADERS)
+
+@app.route('/api/search', methods=['GET'])
+def api_search():
+    """API to search QnA pairs (or statements with scope=statements), one keyset page at a time"""
+    return handle(handlers.search, session, request.args)
+
+@app.route('/api/my_labels', methods=['GET'])
+def api_my_labels():
+    """API to page through the user's own labels, newest first"""
+    return handle(handlers.my_labels, session, request.args)
+
+@app.route('/api/my_labels/<int:qna_id>', methods=['POST'])
+def api_edit_label(qna_id):
+    """API to change a label the user gave earlier"""
+    return handle(handlers.edit, session, qna_id, request.get_json(silent=True))
+
+@app.route('/api/agreement', methods=['GET'])
+def api_agreement():
+    """API to get inter-annotator agreement over all labels"""
+    return handle(handlers.agreement, session)
 
 @app.route('/set_user', methods=['POST'])
 def set_user():
@@ -101,10 +163,19 @@ def logout():
     session.pop('user_id', None)
     return redirect(url_for('index'))
 
+def compile_templates():
+    for template in TEMPLATES:
+        app.jinja_env.get_template(template)
+
 @app.route('/health')
 def health_check():
-    """Health check endpoint for Vercel"""
-    return jsonify({"status": "ok"})
+    """Health check endpoint for Vercel; ?warm=1 also warms the instance up"""
+    return handle(handlers.health, request.args, compile_templates, stream_stats())
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics for this worker process"""
+    return handle(handlers.metrics)
 
 # This is important for Vercel
 app.debug = False
\ No newline at end of file
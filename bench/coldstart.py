@@ -0,0 +1,163 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from bench.localpg import add_embedded_argument, start_embedded
+
+# Cold-start benchmark for the Vercel entry point (api/index.py).
+#
+#   python -m bench.coldstart --runs 10
+#   python -m bench.coldstart --warm --max-first-request-ms 150
+#
+# Each run is a fresh interpreter, like a new serverless instance, with
+# VERCEL=1 set. It times importing api.index, then the first request and
+# a second one for comparison. The first request pays for opening the
+# database connection, filling the caches and compiling templates. With
+# --warm, GET /health?warm=1 runs first (as a scheduled ping would) and is
+# timed on its own. The default request claims QnA pairs, so run this
+# against a benchmark database. Use --max-* to fail on regressions.
+
+PROBE = r"""
+import json, sys, time
+started = time.perf_counter()
+from api.index import app
+imported = time.perf_counter()
+path, user, warm = sys.argv[1], sys.argv[2], sys.argv[3] == '1'
+client = app.test_client()
+with client.session_transaction() as session:
+    session['user_id'] = user
+timings = {'import_ms': (imported - started) * 1000}
+if warm:
+    t = time.perf_counter()
+    status = client.get('/health?warm=1').status_code
+    timings['warm_ms'] = (time.perf_counter() - t) * 1000
+    timings['warm_status'] = status
+for key in ('first_ms', 'second_ms'):
+    t = time.perf_counter()
+    status = client.get(path).status_code
+    timings[key] = (time.perf_counter() - t) * 1000
+    timings[key.replace('_ms', '_status')] = status
+timings['modules'] = len(sys.modules)
+timings['numpy_loaded'] = 'numpy' in sys.modules
+print(json.dumps(timings))
+"""
+
+MEASURES = ('import_ms', 'warm_ms', 'first_ms', 'second_ms')
+
+
+def run_probe(args):
+    env = dict(os.environ, VERCEL='1', REQUEST_LOG='false')
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run(
+        [sys.executable, '-c', PROBE, args.path, args.user, '1' if args.warm else '0'],
+        cwd=root, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise SystemExit(f"Probe failed:\n{result.stderr}")
+    # The app may print warnings before the timings
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(args, count):
+    """The modules with the largest cumulative import time, from python -X importtime"""
+    env = dict(os.environ, VERCEL='1')
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import api.index'],
+                            cwd=root, env=env, capture_output=True, text=True)
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Nested imports are indented two spaces per level: keep what
+        # api.index and app import directly
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if 1 <= depth <= 2:
+            modules.append((int(cumulative) / 1000, name.strip()))
+    return sorted(modules, reverse=True)[:count]
+
+
+def summarize(runs):
+    summary = {}
+    for measure in MEASURES:
+        values = [run[measure] for run in runs if measure in run]
+        if values:
+            summary[measure] = {
+                'median': round(statistics.median(values), 2),
+                'min': round(min(values), 2),
+                'max': round(max(values), 2),
+            }
+    return summary
+
+
+def print_summary(summary, runs, args):
+    print(f"\n{'measure':<12} {'median ms':>10} {'min ms':>8} {'max ms':>8}")
+    for measure, s in summary.items():
+        print(f"{measure:<12} {s['median']:>10.2f} {s['min']:>8.2f} {s['max']:>8.2f}")
+    last = runs[-1]
+    print(f"\n{len(runs)} cold starts of {args.path}: first response {last['first_status']}, "
+          f"{last['modules']} modules loaded, numpy {'loaded' if last['numpy_loaded'] else 'not loaded'}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Measure cold-start time of the Vercel entry point")
+    parser.add_argument('--runs', type=int, default=5,
+                        help="fresh interpreters to start (default: 5)")
+    parser.add_argument('--path', default='/api/next_qna?count=5',
+                        help="first request after the import (default: /api/next_qna?count=5)")
+    parser.add_argument('--user', default='coldstart-bench',
+                        help="session user for the requests (default: coldstart-bench)")
+    parser.add_argument('--warm', action='store_true',
+                        help="call /health?warm=1 before the first request")
+    parser.add_argument('--imports', type=int, default=0, metavar='N',
+                        help="also list the N slowest imports of the entry point")
+    parser.add_argument('--json', metavar='PATH', help="also write the summary as JSON")
+    parser.add_argument('--max-import-ms', type=float, metavar='MS',
+                        help="exit with status 1 if the median import time exceeds MS")
+    parser.add_argument('--max-first-request-ms', type=float, metavar='MS',
+                        help="exit with status 1 if the median first request exceeds MS")
+    add_embedded_argument(parser)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.embedded:
+        start_embedded(args.embedded)
+
+    runs = []
+    for i in range(args.runs):
+        runs.append(run_probe(args))
+        print(f"Run {i + 1}/{args.runs}: import {runs[-1]['import_ms']:.1f} ms, "
+              f"first request {runs[-1]['first_ms']:.1f} ms")
+
+    summary = summarize(runs)
+    print_summary(summary, runs, args)
+
+    if args.imports:
+        print("\nSlowest imports:")
+        for ms, name in slowest_imports(args, args.imports):
+            print(f"  {ms:>8.1f} ms  {name}")
+
+    if args.json:
+        summary['config'] = {key: value for key, value in vars(args).items()
+                             if key not in ('json', 'embedded')}
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2)
+        print(f"Summary written to {args.json}")
+
+    failed = False
+    if args.max_import_ms is not None and summary['import_ms']['median'] > args.max_import_ms:
+        print(f"Median import time above {args.max_import_ms} ms")
+        failed = True
+    if (args.max_first_request_ms is not None
+            and summary['first_ms']['median'] > args.max_first_request_ms):
+        print(f"Median first request above {args.max_first_request_ms} ms")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,239 @@
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+
+from psycopg2 import extensions
+
+from bench.localpg import add_embedded_argument, start_embedded
+
+# Simulated annotators against the Flask app, in-process.
+#
+#   python -m bench.seed --rows 100k --reset
+#   python -m bench.loadtest --annotators 50 --duration 30
+#
+# Each annotator is a thread with its own test client and session: it
+# claims QnA pairs through /api/next_qna, labels them one by one through
+# /api/label_qna (or all at once through /api/label_batch with --batch),
+# and reads /api/stats after each round. Latency is measured around each
+# request inside the process, so it covers the Flask handler, the pool and
+# PostgreSQL but not the HTTP server. Statements per request are counted
+# on the pooled connections.
+
+_local = threading.local()
+_counting_cursors = {}
+
+
+def _counting_cursor(base):
+    """Subclass of a cursor class that counts executions in the current thread"""
+    cls = _counting_cursors.get(base)
+    if cls is None:
+        def execute(self, query, vars=None):
+            _local.queries = getattr(_local, 'queries', 0) + 1
+            return base.execute(self, query, vars)
+
+        def executemany(self, query, vars_list):
+            _local.queries = getattr(_local, 'queries', 0) + 1
+            return base.executemany(self, query, vars_list)
+
+        cls = type(f"Counting{base.__name__}", (base,),
+                   {'execute': execute, 'executemany': executemany})
+        _counting_cursors[base] = cls
+    return cls
+
+
+class CountingConnection(extensions.connection):
+    """psycopg2 connection whose cursors count the statements they run"""
+
+    def cursor(self, *args, **kwargs):
+        base = kwargs.pop('cursor_factory', None) or self.cursor_factory or extensions.cursor
+        return super().cursor(*args, cursor_factory=_counting_cursor(base), **kwargs)
+
+
+def install_query_counter():
+    """Make the API's pool open CountingConnections"""
+    from api.pool import DB_PARAMS, reset_pool
+    DB_PARAMS['connection_factory'] = CountingConnection
+    reset_pool()
+
+
+class Recorder:
+    """Thread-safe collection of (endpoint, seconds, status, queries) samples"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = []
+        self.labels = 0
+
+    def add(self, endpoint, seconds, status, queries):
+        with self._lock:
+            self.samples.append((endpoint, seconds, status, queries))
+
+    def add_labels(self, count):
+        with self._lock:
+            self.labels += count
+
+
+def timed(recorder, endpoint, call):
+    """Run one request, recording its latency, status and statement count"""
+    _local.queries = 0
+    started = time.perf_counter()
+    resp = call()
+    recorder.add(endpoint, time.perf_counter() - started, resp.status_code, _local.queries)
+    return resp
+
+
+def annotator(app, index, deadline, args, recorder):
+    """One simulated annotator: claim, label, check stats, repeat"""
+    client = app.test_client()
+    client.post('/set_user', data={'user_id': f'bench-{index}'})
+    rng = random.Random(index)
+
+    while time.perf_counter() < deadline:
+        resp = timed(recorder, 'next_qna',
+                     lambda: client.get(f'/api/next_qna?count={args.claim}'))
+        items = resp.get_json().get('items', []) if resp.status_code == 200 else []
+        if not items:
+            if resp.status_code == 200:
+                print(f"Annotator {index}: nothing left to label")
+                return
+            time.sleep(0.1)
+            continue
+
+        if args.batch:
+            labels = [{'qna_id': item['id'], 'label': rng.random() < 0.5} for item in items]
+            batch_id = f"bench-{index}-{time.time_ns()}"
+            resp = timed(recorder, 'label_batch', lambda: client.post(
+                '/api/label_batch', json={'batch_id': batch_id, 'labels': labels}))
+            if resp.status_code == 200:
+                recorder.add_labels(len(labels))
+        else:
+            for item in items:
+                if args.think_ms:
+                    time.sleep(rng.uniform(0.5, 1.5) * args.think_ms / 1000)
+                resp = timed(recorder, 'label_qna', lambda: client.post(
+                    '/api/label_qna', json={'qna_id': item['id'], 'label': rng.random() < 0.5}))
+                if resp.status_code == 200:
+                    recorder.add_labels(1)
+
+        timed(recorder, 'stats', lambda: client.get('/api/stats'))
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)
+    return sorted_values[rank]
+
+
+def summarize(recorder, elapsed):
+    """Per-endpoint latency percentiles (ms), errors and statements per request"""
+    by_endpoint = {}
+    for endpoint, seconds, status, queries in recorder.samples:
+        by_endpoint.setdefault(endpoint, []).append((seconds, status, queries))
+
+    endpoints = {}
+    for endpoint, samples in sorted(by_endpoint.items()):
+        latencies = sorted(s[0] * 1000 for s in samples)
+        endpoints[endpoint] = {
+            'requests': len(samples),
+            'errors': sum(1 for s in samples if s[1] >= 400),
+            'p50_ms': round(percentile(latencies, 50), 2),
+            'p95_ms': round(percentile(latencies, 95), 2),
+            'p99_ms': round(percentile(latencies, 99), 2),
+            'max_ms': round(latencies[-1], 2),
+            'queries_per_request': round(sum(s[2] for s in samples) / len(samples), 2),
+        }
+
+    return {
+        'elapsed_s': round(elapsed, 2),
+        'requests': len(recorder.samples),
+        'requests_per_s': round(len(recorder.samples) / elapsed, 1),
+        'labels': recorder.labels,
+        'labels_per_s': round(recorder.labels / elapsed, 1),
+        'endpoints': endpoints,
+    }
+
+
+def print_summary(summary, pool_stats):
+    print(f"\n{'endpoint':<12} {'requests':>9} {'errors':>7} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'p99 ms':>8} {'max ms':>8} {'queries':>8}")
+    for endpoint, s in summary['endpoints'].items():
+        print(f"{endpoint:<12} {s['requests']:>9} {s['errors']:>7} {s['p50_ms']:>8.2f} "
+              f"{s['p95_ms']:>8.2f} {s['p99_ms']:>8.2f} {s['max_ms']:>8.2f} "
+              f"{s['queries_per_request']:>8.2f}")
+    print(f"\n{summary['requests']} requests in {summary['elapsed_s']}s: "
+          f"{summary['requests_per_s']} requests/s, {summary['labels_per_s']} labels/s")
+    print(f"Pool: {pool_stats['checkouts']} checkouts, {pool_stats['waits']} waits, "
+          f"{pool_stats['timeouts']} timeouts, {pool_stats['connections_opened']} connections opened")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load-test the labeling API with simulated annotators")
+    parser.add_argument('--annotators', type=int, default=20,
+                        help="concurrent simulated annotators (default: 20)")
+    parser.add_argument('--duration', type=float, default=20,
+                        help="seconds to run (default: 20)")
+    parser.add_argument('--claim', type=int, default=5,
+                        help="QnA pairs claimed per /api/next_qna request (default: 5)")
+    parser.add_argument('--batch', action='store_true',
+                        help="send each round's labels through /api/label_batch")
+    parser.add_argument('--think-ms', type=float, default=0,
+                        help="average pause before each label, in ms (default: 0)")
+    parser.add_argument('--pool-max', type=int,
+                        help="connections in the API pool (default: DB_POOL_MAX)")
+    parser.add_argument('--json', metavar='PATH', help="also write the summary as JSON")
+    parser.add_argument('--fail-p95', type=float, metavar='MS',
+                        help="exit with status 1 if any endpoint's p95 exceeds MS")
+    add_embedded_argument(parser)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.embedded:
+        start_embedded(args.embedded)
+    if args.pool_max:
+        os.environ['DB_POOL_MAX'] = str(args.pool_max)
+
+    # Imported late: pool settings are read from the environment on import
+    install_query_counter()
+    from app import app
+    from api.pool import get_pool_stats
+
+    recorder = Recorder()
+    started = time.perf_counter()
+    deadline = started + args.duration
+    threads = [threading.Thread(target=annotator, args=(app, i, deadline, args, recorder))
+               for i in range(args.annotators)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = max(time.perf_counter() - started, 1e-9)
+
+    summary = summarize(recorder, elapsed)
+    summary['config'] = {key: value for key, value in vars(args).items()
+                         if key not in ('json', 'embedded')}
+    print_summary(summary, get_pool_stats())
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2)
+        print(f"Summary written to {args.json}")
+
+    if args.fail_p95 is not None:
+        slow = [e for e, s in summary['endpoints'].items() if s['p95_ms'] > args.fail_p95]
+        if slow:
+            print(f"p95 above {args.fail_p95} ms: {', '.join(slow)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
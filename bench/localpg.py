@@ -0,0 +1,66 @@
+import os
+
+# Throwaway local PostgreSQL for benchmarks, without Docker.
+#
+# Uses the optional 'pgserver' package (pip install pgserver), which ships
+# PostgreSQL binaries and runs a server on a Unix socket inside the data
+# directory. Without --embedded the benchmarks use the usual DB_* settings.
+
+def start_embedded(data_dir):
+    """Start (or reuse) an embedded server in data_dir and point DB_* at it
+
+    Must run before api.pool is imported, since DB_PARAMS is read from the
+    environment at import time. The server keeps running after exit so
+    later runs can reuse its data.
+    """
+    try:
+        import pgserver
+    except ImportError:
+        raise SystemExit("--embedded needs the 'pgserver' package (pip install pgserver)")
+
+    data_dir = os.path.abspath(data_dir)
+    os.makedirs(os.path.dirname(data_dir), exist_ok=True)
+    server = pgserver.get_server(data_dir, cleanup_mode=None)
+
+    os.environ['DB_HOST'] = data_dir
+    os.environ['DB_PORT'] = '5432'
+    os.environ['DB_NAME'] = 'postgres'
+    os.environ['DB_USER'] = server.postgres_user
+    os.environ['DB_PASSWORD'] = ''
+    print(f"Embedded PostgreSQL running in {data_dir}")
+    return server
+
+def start_embedded_replica(primary, data_dir):
+    """Start (or reuse) a streaming replica of an embedded primary in data_dir
+
+    The first run clones the primary with pg_basebackup -R, which also
+    writes standby.signal and the connection back to the primary, so the
+    server starts as a hot standby. Points DB_REPLICA_HOSTS at it.
+    """
+    import pgserver
+
+    data_dir = os.path.abspath(data_dir)
+    if not os.path.exists(os.path.join(data_dir, 'PG_VERSION')):
+        os.makedirs(data_dir, mode=0o700, exist_ok=True)
+        if primary.system_user is not None:
+            # pgserver runs PostgreSQL as its own user when started by root
+            import pwd
+            user = pwd.getpwnam(primary.system_user)
+            os.chown(data_dir, user.pw_uid, user.pw_gid)
+        pgserver.pg_basebackup(['-D', data_dir, '-R', '-X', 'stream', '-c', 'fast',
+                                '-h', os.environ['DB_HOST'], '-U', primary.postgres_user],
+                               user=primary.system_user)
+        # The primary keeps its socket and log in its data directory too
+        for name in ('.s.PGSQL.5432.lock', '.handle_pids.json', 'log'):
+            if os.path.exists(os.path.join(data_dir, name)):
+                os.remove(os.path.join(data_dir, name))
+    server = pgserver.get_server(data_dir, cleanup_mode=None)
+
+    os.environ['DB_REPLICA_HOSTS'] = data_dir
+    print(f"Embedded PostgreSQL replica running in {data_dir}")
+    return server
+
+def add_embedded_argument(parser):
+    parser.add_argument('--embedded', metavar='DATA_DIR',
+                        help="start an embedded PostgreSQL in DATA_DIR (needs pgserver) "
+                             "instead of using the DB_* settings")
@@ -0,0 +1,122 @@
+import argparse
+import json
+import statistics
+import sys
+import time
+
+from bench.localpg import add_embedded_argument, start_embedded
+
+# Micro-benchmark of server-side prepared statements (api/prepared.py).
+#
+#   python -m bench.prepared --iterations 200
+#
+# Runs every hot query of the `python -m api.migrations` plan check on one
+# connection, first as plain text and then through EXECUTE of its prepared
+# statement, and reports the median time per call of each. The planning
+# time of the text form (EXPLAIN (SUMMARY)) is shown alongside: it is what
+# every text call pays and a prepared statement with a cached plan does
+# not. Each call runs in a transaction that is rolled back, so claims and
+# labels leave the database unchanged.
+
+
+def time_calls(conn, sql, params, iterations, warmup):
+    """Median seconds per execution (with fetch) over `iterations` calls"""
+    samples = []
+    with conn.cursor() as cur:
+        for i in range(warmup + iterations):
+            cur.execute("BEGIN")
+            started = time.perf_counter()
+            cur.execute(sql, params)
+            if cur.description is not None:
+                cur.fetchall()
+            elapsed = time.perf_counter() - started
+            cur.execute("ROLLBACK")
+            if i >= warmup:
+                samples.append(elapsed)
+    return statistics.median(samples)
+
+
+def planning_ms(conn, sql, params):
+    with conn.cursor() as cur:
+        cur.execute("BEGIN")
+        cur.execute("EXPLAIN (SUMMARY, FORMAT JSON) " + sql, params)
+        plan = cur.fetchone()[0][0]
+        cur.execute("ROLLBACK")
+    return plan['Planning Time']
+
+
+def run(conn, iterations, warmup):
+    from api.migrations import _hot_queries
+    from api.prepared import statement
+
+    results = []
+    for name, sql, params in _hot_queries():
+        if not isinstance(params, dict):
+            # Only the data-access queries (named parameters) are prepared
+            continue
+        stmt = statement(name.replace(' ', '_'), sql)
+        with conn.cursor() as cur:
+            cur.execute(stmt.prepare_sql)
+        text = time_calls(conn, sql, params, iterations, warmup)
+        prepared = time_calls(conn, stmt.execute_sql, params, iterations, warmup)
+        with conn.cursor() as cur:
+            cur.execute(f"DEALLOCATE {stmt.name}")
+        results.append({
+            'query': name,
+            'planning_ms': round(planning_ms(conn, sql, params), 3),
+            'text_ms': round(text * 1000, 3),
+            'prepared_ms': round(prepared * 1000, 3),
+            'saved_ms': round((text - prepared) * 1000, 3),
+        })
+    return results
+
+
+def print_results(results, iterations):
+    print(f"\n{'query':<22} {'planning ms':>12} {'text ms':>9} {'prepared ms':>12} {'saved ms':>9} {'saved':>7}")
+    for r in results:
+        saved_pct = r['saved_ms'] / r['text_ms'] * 100 if r['text_ms'] else 0
+        print(f"{r['query']:<22} {r['planning_ms']:>12.3f} {r['text_ms']:>9.3f} "
+              f"{r['prepared_ms']:>12.3f} {r['saved_ms']:>9.3f} {saved_pct:>6.1f}%")
+    text = sum(r['text_ms'] for r in results)
+    prepared = sum(r['prepared_ms'] for r in results)
+    print(f"\nMedian of {iterations} calls each. All queries once: {text:.3f} ms as text, "
+          f"{prepared:.3f} ms prepared ({text - prepared:.3f} ms saved)")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare text and prepared execution of the hot queries")
+    parser.add_argument('--iterations', type=int, default=100,
+                        help="timed calls per query and mode (default: 100)")
+    parser.add_argument('--warmup', type=int, default=10,
+                        help="untimed calls first, so plans are cached (default: 10)")
+    parser.add_argument('--json', metavar='PATH', help="also write the results as JSON")
+    add_embedded_argument(parser)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.embedded:
+        start_embedded(args.embedded)
+
+    # Imported late: DB_PARAMS is read from the environment on import
+    import psycopg2
+    from api.pool import DB_PARAMS
+
+    conn = psycopg2.connect(**DB_PARAMS)
+    conn.autocommit = True
+    try:
+        results = run(conn, args.iterations, args.warmup)
+    finally:
+        conn.close()
+    print_results(results, args.iterations)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
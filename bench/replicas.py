@@ -0,0 +1,139 @@
+import argparse
+import os
+import sys
+import time
+
+from bench.localpg import start_embedded, start_embedded_replica
+
+# Check read/write splitting against a primary and a streaming replica.
+#
+#   python -m bench.seed --rows 10k --embedded .benchdb/primary
+#   python -m bench.replicas --embedded .benchdb
+#
+# --embedded starts the primary in DIR/primary and a replica cloned from it
+# in DIR/replica (created on the first run). Without it the usual DB_*
+# settings name the primary and DB_REPLICA_HOSTS the replicas.
+#
+# One annotator goes through the Flask app in-process: stats before any
+# write come from a replica, a label batch goes to the primary, stats right
+# after it stay on the primary and include the new label (read-your-writes),
+# and once the window has passed they come from a replica again. Which
+# server answered is read from the pool counters.
+
+
+def checkouts():
+    """Primary and replica checkouts so far"""
+    from api.pool import get_pool_stats, get_replica_stats
+    return get_pool_stats()['checkouts'], get_replica_stats()['replica_checkouts']
+
+
+def routed(client, method, path, **kwargs):
+    """Send one request; (response, 'primary' or 'replica' or 'both')"""
+    primary, replica = checkouts()
+    response = client.open(path, method=method, **kwargs)
+    primary, replica = checkouts()[0] - primary, checkouts()[1] - replica
+    return response, ('both' if primary and replica else 'replica' if replica else 'primary')
+
+
+def replication_lag(user_id, total, timeout=10):
+    """Seconds until a replica shows `total` labels for the user"""
+    from api.db import get_user_stats
+    started = time.monotonic()
+    while time.monotonic() - started < timeout:
+        if get_user_stats(user_id, replica=True)['user']['total'] >= total:
+            return time.monotonic() - started
+        time.sleep(0.01)
+    return None
+
+
+def run(window):
+    import psycopg2
+    from api.pool import DB_PARAMS, REPLICAS
+    from app import app
+
+    failures = []
+
+    def check(name, ok, detail=''):
+        print(f"{'ok  ' if ok else 'FAIL'} {name}{': ' + detail if detail else ''}")
+        if not ok:
+            failures.append(name)
+
+    for params, standby in [(DB_PARAMS, False)] + [(dict(DB_PARAMS, **r), True) for r in REPLICAS]:
+        conn = psycopg2.connect(**params)
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_is_in_recovery()")
+            in_recovery = cur.fetchone()[0]
+        conn.close()
+        check(f"{params['host']} is a {'replica' if standby else 'primary'}", in_recovery == standby)
+
+    user_id = f'replica-check-{os.getpid()}'
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+
+    response, server = routed(client, 'GET', '/api/stats')
+    before = response.get_json()['user']['total']
+    check("stats before any write read a replica", server == 'replica', server)
+
+    response, server = routed(client, 'GET', '/api/next_qna?count=1')
+    qnas = response.get_json()['items']
+    check("claim uses the primary", server == 'primary', server)
+    if not qnas:
+        print("No unlabeled QnA pairs left to label")
+        return 1
+
+    response, server = routed(client, 'POST', '/api/label_batch',
+                              json={'batch_id': f'{user_id}-1',
+                                    'labels': [{'qna_id': qnas[0]['id'], 'label': True}]})
+    check("label batch uses the primary", server == 'primary' and response.status_code == 200,
+          f"{server}, HTTP {response.status_code}")
+
+    response, server = routed(client, 'GET', '/api/stats')
+    after = response.get_json()['user']['total']
+    check("stats right after the write read the primary", server == 'primary', server)
+    check("stats right after the write include it", after == before + 1, f"{before} -> {after}")
+
+    response, server = routed(client, 'GET', f"/api/statement/{qnas[0]['statement_id']}")
+    check("statement lookup reads a replica", server == 'replica' and response.status_code == 200,
+          f"{server}, HTTP {response.status_code}")
+
+    lag = replication_lag(user_id, after)
+    check("replica catches up", lag is not None,
+          f"{lag * 1000:.1f} ms" if lag is not None else "not within 10 s")
+
+    time.sleep(window)
+    response, server = routed(client, 'GET', '/api/stats')
+    check(f"stats {window:g} s after the write read a replica again", server == 'replica', server)
+    check("replica stats include the write", response.get_json()['user']['total'] == after)
+
+    print(f"\n{len(failures)} check(s) failed" if failures else "\nAll checks passed.")
+    return 1 if failures else 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Check read/write splitting against a primary and a replica")
+    parser.add_argument('--embedded', metavar='DIR',
+                        help="start an embedded primary in DIR/primary and a replica of it in "
+                             "DIR/replica (needs pgserver) instead of using the DB_* settings")
+    parser.add_argument('--window', type=float, default=1.0,
+                        help="read-your-writes window to test with, in seconds (default: 1)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.embedded:
+        primary = start_embedded(os.path.join(args.embedded, 'primary'))
+        start_embedded_replica(primary, os.path.join(args.embedded, 'replica'))
+    os.environ['DB_REPLICA_READ_YOUR_WRITES'] = str(args.window)
+    os.environ.setdefault('REQUEST_LOG', 'false')
+
+    # Imported late: the settings are read from the environment on import
+    from api.pool import REPLICAS
+    if not REPLICAS:
+        raise SystemExit("No replicas configured: set DB_REPLICA_HOSTS or use --embedded")
+    return run(args.window)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,142 @@
+import argparse
+import sys
+import time
+
+from bench.localpg import add_embedded_argument, start_embedded
+
+# Fill fomc_statements/fomc_qna with synthetic rows for benchmarking.
+#
+#   python -m bench.seed --rows 1M --reset
+#   python -m bench.seed --rows 100k --embedded .benchdb
+#
+# Rows are generated server-side with generate_series, so even 10M rows
+# only cost a handful of round trips. Statements are named bench_<n>.json;
+# real imports and earlier seeds are left alone unless --reset is given.
+
+QUESTION_TOPICS = ['inflation', 'the labor market', 'interest rates', 'economic growth',
+                   'the balance sheet', 'wage growth', 'financial stability', 'housing']
+
+INSERT_STATEMENTS_SQL = """
+    INSERT INTO fomc_statements (date, filename, speaker, content)
+    SELECT DATE '2018-01-31' + (g %% 2500), 'bench_' || g || '.json', 'Synthetic Chair',
+           repeat(md5(g::text) || ' ', 200)
+    FROM generate_series(%(first)s, %(last)s) AS g
+    ON CONFLICT (filename) DO NOTHING
+"""
+
+# Question/response lengths roughly match the real transcripts
+# (about 500 and 1500 characters). Pre-labeled rows get their qna_labels
+# row in the same statement.
+INSERT_QNA_SQL = """
+    WITH inserted AS (
+        INSERT INTO fomc_qna (statement_id, questioner, question, responder, response,
+                              is_labeled, label, labeled_by, labeled_at, label_count)
+        SELECT s.id,
+               'Reporter ' || (g %% 200),
+               'What is the outlook for ' || (%(topics)s::text[])[1 + g %% %(topic_count)s] || '? '
+                   || repeat(md5(g::text) || ' ', 14),
+               'Synthetic Chair',
+               repeat(md5((g + 1)::text) || ' ', 45),
+               labeled,
+               CASE WHEN labeled THEN g %% 3 = 0 END,
+               CASE WHEN labeled THEN 'bench-seed-' || (g %% 10) END,
+               CASE WHEN labeled THEN NOW() - (g %% 10000) * INTERVAL '1 minute' END,
+               labeled::int
+        FROM generate_series(%(first)s, %(last)s) AS g
+        CROSS JOIN LATERAL (SELECT (g %% 1000) < %(labeled_per_mille)s AS labeled) AS l
+        JOIN fomc_statements s ON s.filename = 'bench_' || (g / %(per_statement)s) || '.json'
+        RETURNING id, label, labeled_by, labeled_at
+    )
+    INSERT INTO qna_labels (qna_id, user_id, label, labeled_at)
+    SELECT id, labeled_by, label, labeled_at
+    FROM inserted
+    WHERE labeled_by IS NOT NULL
+"""
+
+def parse_scale(value):
+    """Parse row counts such as 10000, 10k or 2.5M"""
+    multipliers = {'k': 1000, 'm': 1000000}
+    value = value.strip().lower()
+    try:
+        if value and value[-1] in multipliers:
+            return int(float(value[:-1]) * multipliers[value[-1]])
+        return int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid row count: {value}")
+
+def seed(conn, rows, per_statement=30, labeled_fraction=0.0, chunk_rows=200000):
+    """Append `rows` synthetic QnA pairs, committing every `chunk_rows`"""
+    with conn.cursor() as cur:
+        # Continue numbering after any earlier seed
+        cur.execute("""
+            SELECT COALESCE(MAX(substring(filename FROM 'bench_(\\d+)\\.json')::bigint) + 1, 0)
+            FROM fomc_statements WHERE filename LIKE 'bench\\_%%'
+        """)
+        first_statement = cur.fetchone()[0]
+        first_row = first_statement * per_statement
+        last_row = first_row + rows - 1
+
+        cur.execute(INSERT_STATEMENTS_SQL, {'first': first_statement,
+                                            'last': last_row // per_statement})
+        conn.commit()
+
+        started = time.perf_counter()
+        done = 0
+        for first in range(first_row, last_row + 1, chunk_rows):
+            last = min(first + chunk_rows - 1, last_row)
+            cur.execute(INSERT_QNA_SQL, {
+                'first': first,
+                'last': last,
+                'per_statement': per_statement,
+                'topics': QUESTION_TOPICS,
+                'topic_count': len(QUESTION_TOPICS),
+                'labeled_per_mille': int(labeled_fraction * 1000),
+            })
+            conn.commit()
+            done += last - first + 1
+            elapsed = max(time.perf_counter() - started, 1e-9)
+            print(f"Progress: {done}/{rows} QnA rows ({done / elapsed:.0f} rows/s)")
+
+        # Fresh statistics so the planner sees the new table size
+        cur.execute("ANALYZE fomc_statements")
+        cur.execute("ANALYZE fomc_qna")
+        conn.commit()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Seed the database with synthetic QnA pairs")
+    parser.add_argument('--rows', type=parse_scale, default=parse_scale('10k'),
+                        help="QnA rows to add, e.g. 10k, 1M, 10M (default: 10k)")
+    parser.add_argument('--per-statement', type=int, default=30,
+                        help="QnA pairs per synthetic statement (default: 30)")
+    parser.add_argument('--labeled', type=float, default=0.0,
+                        help="fraction of rows inserted as already labeled (default: 0)")
+    parser.add_argument('--chunk-rows', type=int, default=200000,
+                        help="rows inserted per transaction (default: 200000)")
+    parser.add_argument('--reset', action='store_true',
+                        help="drop all tables first (removes real data too!)")
+    add_embedded_argument(parser)
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    if args.embedded:
+        start_embedded(args.embedded)
+
+    # Imported late: DB_PARAMS is read from the environment on import
+    import psycopg2
+    from api.pool import DB_PARAMS
+    from add_fomc_database import create_tables, reset_tables
+
+    conn = psycopg2.connect(**DB_PARAMS)
+    try:
+        if args.reset and not reset_tables(conn):
+            return 1
+        create_tables(conn)
+        seed(conn, args.rows, args.per_statement, args.labeled, args.chunk_rows)
+    finally:
+        conn.close()
+    print(f"Seeded {args.rows} QnA rows.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
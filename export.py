@@ -1,40 +1,225 @@
 import psycopg2
-import csv
+from psycopg2.extras import RealDictCursor
+import argparse
+import datetime
+import gzip
+import json
 import os
 
-DB_PARAMS = {
-    'host': '10.8.12.8',
-    'port': '5555',
-    'database': 'qfind_db',
-    'user': 'qfind',
-    'password': 'qfind'
+# Same DB_* environment settings as the API
+from api.pool import DB_PARAMS, REPLICAS
+
+# Columns exported per table (internal dispatch columns are left out)
+EXPORT_COLUMNS = {
+    'fomc_statements': ['id', 'date', 'filename', 'speaker', 'content', 'created_at'],
+    'fomc_qna': ['id', 'statement_id', 'questioner', 'question', 'responder', 'response',
+                 'is_labeled', 'label', 'labeled_by', 'labeled_at', 'required_labels',
+                 'label_count', 'created_at'],
+    # Every annotator's label; fomc_qna.label is their majority
+    'qna_labels': ['id', 'qna_id', 'user_id', 'label', 'labeled_at'],
 }
 
-def export_tables():
-    conn = psycopg2.connect(**DB_PARAMS)
-    cur = conn.cursor()
-    
-    # Export fomc_statements table
-    os.makedirs('export', exist_ok=True)
-    
-    # Get statements data
-    cur.execute("SELECT * FROM fomc_statements")
-    with open('export/fomc_statements.csv', 'w', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow([desc[0] for desc in cur.description])  # Write headers
-        writer.writerows(cur.fetchall())  # Write data
-    
-    # Get qna data
-    cur.execute("SELECT * FROM fomc_qna")
-    with open('export/fomc_qna.csv', 'w', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow([desc[0] for desc in cur.description])  # Write headers
-        writer.writerows(cur.fetchall())  # Write data
-    
-    print("Export complete! Data saved to export directory.")
-    
-    cur.close()
-    conn.close()
+# labeled_at is the label transaction's start time, so a label can commit
+# after an export whose watermark is already later than it (and a replica
+# applies it later still). --since re-reads this far behind the watermark,
+# as api/agreement.py does; re-exported rows keep their id, so apply an
+# incremental export as upserts by id.
+SINCE_OVERLAP_SECONDS = 60
+
+# Rows fetched per round trip from the server-side cursor (JSONL/Parquet)
+FETCH_SIZE = 2000
+
+# PostgreSQL type OIDs -> Parquet column types; anything else is exported as text
+PARQUET_TYPES = {
+    16: 'bool_',
+    20: 'int64',
+    21: 'int16',
+    23: 'int32',
+    700: 'float32',
+    701: 'float64',
+    1082: 'date32',
+    1114: 'timestamp',
+}
+
+def open_output(path, compression):
+    """Open a binary output stream, compressed with gzip or zstd if requested"""
+    if compression == 'gzip':
+        return gzip.open(path + '.gz', 'wb')
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise SystemExit("zstd output needs the 'zstandard' package (pip install zstandard)")
+        return zstandard.ZstdCompressor().stream_writer(open(path + '.zst', 'wb'), closefd=True)
+    return open(path, 'wb')
+
+def build_query(cur, table, labeled_only=False, since=None, overlap=SINCE_OVERLAP_SECONDS):
+    """SELECT for one table with the requested filters inlined (COPY cannot bind parameters)"""
+    conditions = []
+    params = []
+    if table == 'fomc_qna' and labeled_only:
+        conditions.append("is_labeled")
+    if table in ('fomc_qna', 'qna_labels'):
+        if since is not None:
+            conditions.append("labeled_at > %s")
+            params.append(since - datetime.timedelta(seconds=overlap))
+
+    sql = f"SELECT {', '.join(EXPORT_COLUMNS[table])} FROM {table}"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY id"
+    return cur.mogrify(sql, params).decode()
+
+def export_csv(conn, query, path, compression):
+    """Stream rows straight from COPY ... TO STDOUT into the output file; returns the row count"""
+    with conn.cursor() as cur, open_output(path, compression) as f:
+        cur.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)", f)
+        return cur.rowcount
+
+def iter_batches(conn, query, name):
+    """Yield lists of rows from a named (server-side) cursor, FETCH_SIZE at a time
+
+    If nothing matches, one empty list is yielded, so the caller still gets
+    the column description.
+    """
+    with conn.cursor(name=name, cursor_factory=RealDictCursor) as cur:
+        cur.itersize = FETCH_SIZE
+        cur.execute(query)
+        rows = cur.fetchmany(FETCH_SIZE)
+        yield rows, cur.description
+        while rows:
+            rows = cur.fetchmany(FETCH_SIZE)
+            if rows:
+                yield rows, cur.description
+
+def export_jsonl(conn, query, path, compression, name):
+    """Write one JSON object per row with bounded memory; returns the row count"""
+    count = 0
+    with open_output(path, compression) as f:
+        for rows, _ in iter_batches(conn, query, name):
+            f.write(''.join(json.dumps(row, default=str) + '\n' for row in rows).encode('utf-8'))
+            count += len(rows)
+    return count
+
+def export_parquet(conn, query, path, name):
+    """Write a Parquet file one row group per fetched batch; returns the row count
+
+    An export with no rows still writes a valid file with the columns.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise SystemExit("Parquet output needs the 'pyarrow' package (pip install pyarrow)")
+
+    writer = None
+    count = 0
+    try:
+        for rows, description in iter_batches(conn, query, name):
+            if writer is None:
+                fields = []
+                for column in description:
+                    type_name = PARQUET_TYPES.get(column.type_code)
+                    if type_name == 'timestamp':
+                        arrow_type = pa.timestamp('us')
+                    elif type_name:
+                        arrow_type = getattr(pa, type_name)()
+                    else:
+                        arrow_type = pa.string()
+                    fields.append(pa.field(column.name, arrow_type))
+                schema = pa.schema(fields)
+                writer = pq.ParquetWriter(path, schema, compression='zstd')
+
+            columns = {}
+            for field in schema:
+                values = [row[field.name] for row in rows]
+                if pa.types.is_string(field.type):
+                    values = [None if v is None else str(v) for v in values]
+                columns[field.name] = values
+            writer.write_table(pa.table(columns, schema=schema))
+            count += len(rows)
+    finally:
+        if writer is not None:
+            writer.close()
+    return count
+
+def connect(primary=False):
+    """Connect to the first reachable replica (DB_REPLICA_HOSTS), else the primary
+
+    An export is one long read, so it is kept off the primary when it can be.
+    On a replica it may be cancelled by a conflict with replication unless
+    the replica runs with hot_standby_feedback = on; use --primary then.
+    """
+    if not primary:
+        for replica in REPLICAS:
+            try:
+                conn = psycopg2.connect(**dict(DB_PARAMS, **replica))
+            except psycopg2.OperationalError as e:
+                print(f"Error connecting to replica {replica['host']}: {e}")
+                continue
+            print(f"Exporting from replica {replica['host']}")
+            return conn
+    return psycopg2.connect(**DB_PARAMS)
+
+def export_tables(out_dir='export', fmt='csv', compression='none', tables=None,
+                  labeled_only=False, since=None, primary=False, overlap=SINCE_OVERLAP_SECONDS):
+    """Export the tables without loading them into memory"""
+    conn = connect(primary)
+    conn.set_client_encoding('UTF8')
+    os.makedirs(out_dir, exist_ok=True)
+
+    try:
+        # One snapshot for every table, so the files are consistent
+        conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+
+        for table in tables or EXPORT_COLUMNS:
+            with conn.cursor() as cur:
+                query = build_query(cur, table, labeled_only, since, overlap)
+            path = os.path.join(out_dir, f"{table}.{fmt}")
+
+            if fmt == 'csv':
+                count = export_csv(conn, query, path, compression)
+            elif fmt == 'jsonl':
+                count = export_jsonl(conn, query, path, compression, name=f"export_{table}")
+            else:
+                count = export_parquet(conn, query, path, name=f"export_{table}")
+            print(f"Exported {count} rows of {table} to {path}")
+
+        # Report the watermark to pass as --since next time
+        if 'fomc_qna' in (tables or EXPORT_COLUMNS):
+            with conn.cursor() as cur:
+                cur.execute("SELECT MAX(labeled_at) FROM fomc_qna")
+                watermark = cur.fetchone()[0]
+            if watermark:
+                print(f"Latest labeled_at: {watermark.isoformat()} (use --since for the next incremental export)")
+
+        conn.commit()
+    finally:
+        conn.close()
+
+    print(f"Export complete! Data saved to {out_dir} directory.")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Export the labeling tables")
+    parser.add_argument('--out-dir', default='export', help="output directory (default: export)")
+    parser.add_argument('--format', choices=['csv', 'jsonl', 'parquet'], default='csv')
+    parser.add_argument('--compress', choices=['none', 'gzip', 'zstd'], default='none',
+                        help="compression for csv/jsonl output (Parquet is always zstd-compressed)")
+    parser.add_argument('--table', action='append', choices=sorted(EXPORT_COLUMNS),
+                        help="table to export (repeatable; default: all)")
+    parser.add_argument('--labeled-only', action='store_true', help="only export labeled QnA pairs")
+    parser.add_argument('--since', type=datetime.datetime.fromisoformat,
+                        help="only export QnA pairs and labels labeled after this timestamp (ISO format), "
+                             "less --overlap; rows may repeat, so upsert them by id")
+    parser.add_argument('--overlap', type=float, default=SINCE_OVERLAP_SECONDS,
+                        help="seconds re-read before --since to catch labels committed late "
+                             f"(default: {SINCE_OVERLAP_SECONDS})")
+    parser.add_argument('--primary', action='store_true',
+                        help="read from the primary even if DB_REPLICA_HOSTS lists replicas")
+    return parser.parse_args()
 
 if __name__ == "__main__":
-    export_tables()
\ No newline at end of file
+    args = parse_args()
+    export_tables(out_dir=args.out_dir, fmt=args.format, compression=args.compress,
+                  tables=args.table, labeled_only=args.labeled_only, since=args.since,
+                  primary=args.primary, overlap=args.overlap)
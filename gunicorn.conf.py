@@ -0,0 +1,6 @@
+# Gunicorn settings, picked up automatically from the working directory
+
+def post_fork(server, worker):
+    """Give each worker its own database connection pool"""
+    from api.pool import reset_pool
+    reset_pool()
@@ -0,0 +1,195 @@
+import argparse
+import sys
+import time
+
+import psycopg2
+
+# Same DB_* environment settings as the API
+from api.pool import DB_PARAMS
+from api.db import run_transaction
+from export import iter_batches
+
+# Active learning for the labeling queue:
+#
+#   python prioritize.py                 # train, score every unlabeled pair
+#   python prioritize.py --dry-run       # only report held-out model quality
+#
+# A TF-IDF + logistic regression relevance model is trained on the labeled
+# pairs (the majority label; labels copied to near-duplicates are left out)
+# and every unlabeled pair that can be handed out is scored in batches.
+# Each pair gets its predicted probability (relevance_score) and an
+# uncertainty priority, 1 - |2p - 1|; QNA_DISPATCH=uncertainty then serves
+# the most uncertain pairs first. Re-run it as labels accumulate, e.g. from
+# cron. Needs the packages in requirements-scoring.txt.
+
+# Words and word pairs are hashed into a fixed-size feature space, so
+# nothing but the IDF weights has to be fitted and batches can be scored
+# independently
+HASH_FEATURES = 2 ** 20
+NGRAM_RANGE = (1, 2)
+# The model is not trained with fewer labels than this in either class
+MIN_LABELS_PER_CLASS = 5
+
+LABELED_SQL = """
+    SELECT id, question, response, label
+    FROM fomc_qna
+    WHERE is_labeled AND label IS NOT NULL AND label_count > 0
+    ORDER BY id
+"""
+
+UNLABELED_SQL = """
+    SELECT id, question, response
+    FROM fomc_qna
+    WHERE is_labeled = FALSE AND duplicate_of IS NULL
+    ORDER BY id
+"""
+
+WRITE_SCORES_SQL = """
+    UPDATE fomc_qna AS q
+    SET relevance_score = v.score,
+        priority = v.priority
+    FROM unnest(%(ids)s::integer[], %(scores)s::real[], %(priorities)s::real[])
+         AS v(id, score, priority)
+    WHERE q.id = v.id
+"""
+
+def load_model_packages():
+    try:
+        import numpy as np
+        from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer
+        from sklearn.linear_model import LogisticRegression
+        from sklearn import metrics
+        from sklearn.model_selection import train_test_split
+    except ImportError:
+        raise SystemExit("Scoring needs the packages in requirements-scoring.txt "
+                         "(pip install -r requirements-scoring.txt)")
+    return np, HashingVectorizer, TfidfTransformer, LogisticRegression, metrics, train_test_split
+
+def document(row):
+    """Text the model sees for one QnA pair"""
+    return f"{row['question'] or ''}\n{row['response'] or ''}"
+
+class RelevanceModel:
+    """Hashed TF-IDF features and a class-balanced logistic regression"""
+
+    def __init__(self, C=4.0):
+        _, HashingVectorizer, TfidfTransformer, LogisticRegression, _, _ = load_model_packages()
+        self.vectorizer = HashingVectorizer(n_features=HASH_FEATURES, ngram_range=NGRAM_RANGE,
+                                            alternate_sign=False, norm=None)
+        self.tfidf = TfidfTransformer(sublinear_tf=True)
+        self.classifier = LogisticRegression(C=C, class_weight='balanced', solver='liblinear')
+
+    def fit(self, documents, labels):
+        counts = self.vectorizer.transform(documents)
+        self.classifier.fit(self.tfidf.fit_transform(counts), labels)
+        return self
+
+    def predict(self, documents):
+        """Probability that each document is relevant"""
+        features = self.tfidf.transform(self.vectorizer.transform(documents))
+        return self.classifier.predict_proba(features)[:, 1]
+
+def uncertainty(probabilities):
+    """1 for a coin flip, 0 for a certain prediction"""
+    return 1 - abs(2 * probabilities - 1)
+
+def load_labeled(conn):
+    documents, labels = [], []
+    for rows, _ in iter_batches(conn, LABELED_SQL, name='prioritize_labeled'):
+        documents.extend(document(row) for row in rows)
+        labels.extend(int(row['label']) for row in rows)
+    conn.commit()
+    return documents, labels
+
+def evaluate(documents, labels, holdout, C):
+    """Print the quality of a model trained without a held-out sample"""
+    np, _, _, _, metrics, train_test_split = load_model_packages()
+    train_docs, test_docs, train_labels, test_labels = train_test_split(
+        documents, labels, test_size=holdout, stratify=labels, random_state=0)
+    probabilities = RelevanceModel(C).fit(train_docs, train_labels).predict(test_docs)
+    predictions = (probabilities >= 0.5).astype(int)
+    print(f"Held-out sample: {len(test_labels)} labels")
+    print(f"  ROC AUC:  {metrics.roc_auc_score(test_labels, probabilities):.3f}")
+    print(f"  Accuracy: {metrics.accuracy_score(test_labels, predictions):.3f}")
+    print(f"  F1:       {metrics.f1_score(test_labels, predictions):.3f}")
+    print(f"  Mean uncertainty: {np.mean(uncertainty(probabilities)):.3f}")
+
+def score_unlabeled(read_conn, write_conn, model, batch_size):
+    """Score every unlabeled pair and write its priority, one batch per transaction"""
+    with read_conn.cursor() as cur:
+        cur.execute("SELECT COUNT(*) FROM fomc_qna WHERE is_labeled = FALSE AND duplicate_of IS NULL")
+        total = cur.fetchone()[0]
+
+    started = time.perf_counter()
+    done = 0
+    batches = []
+    for rows, _ in iter_batches(read_conn, UNLABELED_SQL, name='prioritize_unlabeled'):
+        batches.extend(rows)
+        if len(batches) < batch_size:
+            continue
+        _write_scores(write_conn, model, batches)
+        done += len(batches)
+        batches = []
+        elapsed = max(time.perf_counter() - started, 1e-9)
+        print(f"Progress: {done}/{total} QnA pairs scored ({done / elapsed:.0f} rows/s)")
+    if batches:
+        _write_scores(write_conn, model, batches)
+        done += len(batches)
+    read_conn.commit()
+    return done
+
+def _write_scores(conn, model, rows):
+    """Score one batch and write it in its own transaction"""
+    probabilities = model.predict([document(row) for row in rows])
+    params = {
+        'ids': [row['id'] for row in rows],
+        'scores': probabilities.tolist(),
+        'priorities': uncertainty(probabilities).tolist(),
+    }
+    # Annotators keep labeling meanwhile: retried if a pair moves partition
+    run_transaction(conn, lambda cur: cur.execute(WRITE_SCORES_SQL, params))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Train the relevance model and prioritise the labeling queue")
+    parser.add_argument('--holdout', type=float, default=0.2,
+                        help="fraction of labels held out to report model quality (0 to skip)")
+    parser.add_argument('--C', type=float, default=4.0,
+                        help="inverse regularisation strength of the classifier (default: 4)")
+    parser.add_argument('--batch-size', type=int, default=5000,
+                        help="unlabeled pairs scored and written per transaction (default: 5000)")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="report model quality without writing any scores")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    load_model_packages()
+
+    read_conn = psycopg2.connect(**DB_PARAMS)
+    write_conn = psycopg2.connect(**DB_PARAMS)
+    try:
+        documents, labels = load_labeled(read_conn)
+        relevant = sum(labels)
+        print(f"Training data: {len(labels)} labeled QnA pairs ({relevant} relevant)")
+        if min(relevant, len(labels) - relevant) < MIN_LABELS_PER_CLASS:
+            print(f"Need at least {MIN_LABELS_PER_CLASS} relevant and {MIN_LABELS_PER_CLASS} "
+                  f"irrelevant labels to train a model")
+            return 1
+
+        if args.holdout > 0:
+            evaluate(documents, labels, args.holdout, args.C)
+        if args.dry_run:
+            return 0
+
+        started = time.perf_counter()
+        model = RelevanceModel(args.C).fit(documents, labels)
+        print(f"Trained on all labels in {time.perf_counter() - started:.1f}s")
+        scored = score_unlabeled(read_conn, write_conn, model, args.batch_size)
+        print(f"Scored {scored} unlabeled QnA pairs.")
+    finally:
+        read_conn.close()
+        write_conn.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())